@@ -0,0 +1,264 @@
+"""
+Approximate nearest-neighbor search for large KNN reference sets.
+
+IVFIndex is an inverted-file index: k-means splits the preprocessed
+reference points into n_lists clusters, and the points are stored grouped by
+cluster so every list is one contiguous slice. A query is compared with the
+centroids first and then only with the points in its n_probe closest lists.
+More lists make each probe cheaper; more probes raise recall. n_probe ==
+n_lists is exact search.
+
+The index is built at export time (`python mmap_store.py export --ann-lists
+N`) and served when ANN_NPROBE is set. Measure recall and latency against
+exact search with:
+
+    python ann_index.py bench --rows 1000000 10000000 --probes 4 8 16 32
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from numpy_engine import SEARCH_BLOCK, SEARCH_CELLS, exact_search
+
+# k-means is fitted on at most this many sampled points per list
+KMEANS_SAMPLE_PER_LIST = 64
+KMEANS_ITERATIONS = 10
+# Batches probing up to this many (row, list) pairs are searched row by
+# row, larger ones list by list
+ROW_LOOP_PAIRS = 2048
+
+
+def default_lists(n_points):
+    """About sqrt(n) lists balances centroid and list scanning cost."""
+    return max(1, int(np.sqrt(n_points)))
+
+
+def _assign(X, centroids):
+    """Index of the nearest centroid for every row of X, in bounded blocks."""
+    c_norms = np.einsum('ij,ij->i', centroids, centroids)
+    step = max(1, SEARCH_CELLS // len(centroids))
+    out = np.empty(len(X), dtype=np.int32)
+    for start in range(0, len(X), step):
+        block = np.asarray(X[start:start + step], dtype=np.float64)
+        out[start:start + step] = (c_norms[None, :] - 2.0 * (block @ centroids.T)).argmin(axis=1)
+    return out
+
+
+def kmeans(points, n_clusters, seed=0):
+    """
+    Lloyd's k-means on a sample of at most KMEANS_SAMPLE_PER_LIST points per
+    cluster. Returns the (n_clusters, n_features) centroids.
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(points))
+    sample_size = min(len(points), n_clusters * KMEANS_SAMPLE_PER_LIST)
+    sample = np.asarray(points[np.sort(rng.choice(len(points), sample_size, replace=False))])
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+
+    for _ in range(KMEANS_ITERATIONS):
+        assigned = _assign(sample, centroids)
+        counts = np.bincount(assigned, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assigned, sample)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Reseed empty clusters from random sample points
+        centroids[empty] = sample[rng.choice(len(sample), empty.sum())]
+    return centroids
+
+
+def build_ivf(points, n_lists, seed=0):
+    """
+    Cluster points into n_lists lists.
+
+    Returns (order, centroids, offsets): points[order] groups the points by
+    list, and list j is rows offsets[j]:offsets[j + 1] of that reordering.
+    """
+    centroids = kmeans(points, n_lists, seed)
+    n_lists = len(centroids)
+    assigned = _assign(points, centroids)
+    order = np.argsort(assigned, kind='stable')
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assigned, minlength=n_lists), out=offsets[1:])
+    return order, centroids, offsets
+
+
+class IVFIndex:
+    """Search over points stored in list order (see build_ivf)."""
+
+    def __init__(self, centroids, offsets, n_probe=8):
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.c_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self.n_probe = min(n_probe, len(self.centroids))
+
+    def _probed(self, ranked, k):
+        """
+        Mask over ranked (each query's lists, nearest centroid first) of the
+        lists it probes: n_probe non-empty lists, and more while they hold
+        fewer than k points.
+        """
+        sizes = np.diff(self.offsets)[ranked]
+        nonempty = sizes > 0
+        # Non-empty lists and points before each position
+        seen = np.cumsum(nonempty, axis=1) - nonempty
+        covered = np.cumsum(sizes, axis=1) - sizes
+        return nonempty & ((seen < self.n_probe) | (covered < k))
+
+    def search(self, Q, points, sq_norms, k):
+        """
+        Approximate k nearest points to preprocessed rows Q. Same return
+        value as numpy_engine.exact_search(): at most as many columns as
+        there are points.
+
+        Large batches are grouped by list, so each probed list is scanned
+        once for all the rows that probe it; below ROW_LOOP_PAIRS probed
+        (row, list) pairs the rows are searched one at a time, which takes
+        fewer numpy calls.
+        """
+        k = min(k, int(self.offsets[-1]))
+        ranked = np.argsort(self.c_norms[None, :] - 2.0 * (Q @ self.centroids.T), axis=1)
+        probed = self._probed(ranked, k)
+        if probed.sum() <= ROW_LOOP_PAIRS:
+            return self._search_rows(Q, points, sq_norms, k, ranked, probed)
+
+        # Each (row, probed list) pair gets k candidate slots; rows are taken
+        # in slices that keep the slots within the cell budget
+        n_slots = int(probed.sum(axis=1).max())
+        step = max(1, SEARCH_CELLS // (n_slots * k))
+        parts = [self._search_grouped(Q[i:i + step], points, sq_norms, k, ranked[i:i + step],
+                                      probed[i:i + step], n_slots)
+                 for i in range(0, len(Q), step)]
+        return np.vstack([p[0] for p in parts]), np.vstack([p[1] for p in parts])
+
+    def _search_rows(self, Q, points, sq_norms, k, ranked, probed):
+        best_d = np.empty((len(Q), k))
+        best_i = np.empty((len(Q), k), dtype=np.intp)
+        for row in range(len(Q)):
+            lists = ranked[row][probed[row]]
+            ids = np.concatenate([np.arange(self.offsets[j], self.offsets[j + 1]) for j in lists])
+            block = np.concatenate([points[self.offsets[j]:self.offsets[j + 1]] for j in lists])
+            norms = np.concatenate([sq_norms[self.offsets[j]:self.offsets[j + 1]] for j in lists])
+            q = Q[row]
+            d = q @ q - 2.0 * (block @ q) + norms
+            top = np.argpartition(d, k - 1)[:k] if len(d) > k else np.arange(len(d))
+            best_d[row] = d[top]
+            best_i[row] = ids[top]
+        return best_d, best_i
+
+    def _search_grouped(self, Q, points, sq_norms, k, ranked, probed, n_slots):
+        rows, ranks = np.nonzero(probed)
+        lists = ranked[rows, ranks]
+        # Slot of each pair among its row's probed lists
+        slots = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        order = np.argsort(lists, kind='stable')
+        rows, lists, slots = rows[order], lists[order], slots[order]
+        starts = np.flatnonzero(np.r_[True, lists[1:] != lists[:-1]])
+
+        q_norms = np.einsum('ij,ij->i', Q, Q)
+        cand_d = np.full((len(Q), n_slots * k), np.inf)
+        cand_i = np.full((len(Q), n_slots * k), -1, dtype=np.intp)
+        for start, end in zip(starts, np.r_[starts[1:], len(lists)]):
+            lo, hi = self.offsets[lists[start]], self.offsets[lists[start] + 1]
+            sub = rows[start:end]
+            d = q_norms[sub, None] - 2.0 * (Q[sub] @ points[lo:hi].T) + sq_norms[lo:hi][None, :]
+            kk = min(k, hi - lo)
+            top = np.argpartition(d, kk - 1, axis=1)[:, :kk] if hi - lo > kk else np.broadcast_to(
+                np.arange(kk), (len(sub), kk))
+            columns = slots[start:end, None] * k + np.arange(kk)
+            cand_d[sub[:, None], columns] = np.take_along_axis(d, top, axis=1)
+            cand_i[sub[:, None], columns] = top + lo
+
+        keep = np.argpartition(cand_d, k - 1, axis=1)[:, :k]
+        return np.take_along_axis(cand_d, keep, axis=1), np.take_along_axis(cand_i, keep, axis=1)
+
+
+def _synthetic_points(n_rows, seed):
+    """Preprocessed synthetic rows and labels, generated chunk by chunk."""
+    import pandas as pd
+    import model_store
+    import synth_data
+    from preprocessing import Preprocessor
+
+    fitted = synth_data.fit(pd.read_csv(model_store.DATA_FILE))
+    X_fit, _ = model_store.read_dataset()
+    preprocessor = Preprocessor.fit(X_fit, model_store.FEATURES, model_store.ZERO_AS_MISSING)
+    points = np.empty((n_rows, len(model_store.FEATURES)))
+    labels = np.empty(n_rows, dtype=np.int8)
+    offset = 0
+    for chunk in synth_data.generate(fitted, n_rows, seed=seed):
+        X = np.column_stack([chunk[c] for c in model_store.FEATURES]).astype(np.float64)
+        points[offset:offset + len(X)] = preprocessor.transform(X)
+        labels[offset:offset + len(X)] = chunk[model_store.TARGET]
+        offset += len(X)
+    return points, labels
+
+
+def _latency(fn, queries):
+    timings = np.empty(len(queries))
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        fn(queries[i:i + 1])
+        timings[i] = time.perf_counter() - start
+    return np.median(timings) * 1e6, np.percentile(timings, 99) * 1e6
+
+
+def bench(n_rows, n_lists, probes, n_queries, k, exact_latency_queries):
+    """Recall@k, vote agreement and single-query latency of IVF vs exact search."""
+    points, labels = _synthetic_points(n_rows, seed=0)
+    queries, _ = _synthetic_points(n_queries, seed=1)
+
+    start = time.perf_counter()
+    order, centroids, offsets = build_ivf(points, n_lists)
+    points = points[order]
+    labels = labels[order]
+    del order
+    build_s = time.perf_counter() - start
+    sq_norms = np.einsum('ij,ij->i', points, points)
+
+    step = max(1, SEARCH_CELLS // SEARCH_BLOCK)
+    exact_i = np.vstack([exact_search(queries[i:i + step], points, sq_norms, k)[1]
+                         for i in range(0, len(queries), step)])
+    exact_votes = labels[exact_i].mean(axis=1) > 0.5
+    p50, p99 = _latency(lambda q: exact_search(q, points, sq_norms, k), queries[:exact_latency_queries])
+    print(f"\n{n_rows} rows, {n_lists} lists (built in {build_s:.1f}s)")
+    print(f"{'search':<14}{'recall@' + str(k):>10}{'same vote':>11}{'p50 us':>10}{'p99 us':>10}")
+    print(f"{'exact':<14}{1.0:>10.4f}{1.0:>11.4f}{p50:>10.0f}{p99:>10.0f}")
+
+    results = []
+    for n_probe in probes:
+        index = IVFIndex(centroids, offsets, n_probe)
+        _, ann_i = index.search(queries, points, sq_norms, k)
+        recall = np.mean([len(np.intersect1d(a, e)) / k for a, e in zip(ann_i, exact_i)])
+        agreement = float(((labels[ann_i].mean(axis=1) > 0.5) == exact_votes).mean())
+        p50, p99 = _latency(lambda q: index.search(q, points, sq_norms, k), queries)
+        print(f"{'n_probe=' + str(n_probe):<14}{recall:>10.4f}{agreement:>11.4f}{p50:>10.0f}{p99:>10.0f}")
+        results.append({'n_probe': n_probe, 'recall': recall, 'p50_us': p50, 'p99_us': p99})
+    return results
+
+
+def main(argv=None):
+    import model_store
+
+    parser = argparse.ArgumentParser(description="Approximate KNN index benchmark.")
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000],
+                        help="synthetic reference set sizes")
+    parser.add_argument('--lists', type=int, default=None, help="IVF lists (default: sqrt(rows))")
+    parser.add_argument('--probes', type=int, nargs='+', default=[4, 8, 16, 32])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--exact-latency-queries', type=int, default=50,
+                        help="queries timed one by one with exact search (slow at 10M rows)")
+    args = parser.parse_args(argv)
+
+    for n_rows in args.rows:
+        bench(n_rows, args.lists or default_lists(n_rows), args.probes, args.queries,
+              model_store.N_NEIGHBORS, args.exact_latency_queries)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,19 @@
 import numpy as np
-import pandas as pd
-from flask import Flask, request, render_template, session, redirect, url_for
-import pickle
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.preprocessing import MinMaxScaler
-import json
+from flask import Flask, request, render_template, session, redirect, url_for, jsonify, g
+import hmac
 import os
+import threading
+from datetime import datetime
+import model_store
+import mmap_store
+from inference import engine_for
+from attribution import Attributor
+import ensemble
+from model_registry import ModelRegistry
+from batching import MicroBatcher
+from prediction_cache import PredictionCache
+from risk import RiskTable
+from user_store import UserStore
 from werkzeug.security import generate_password_hash, check_password_hash
 
 app = Flask(__name__)
@@ -16,53 +24,184 @@ app.secret_key = "change_this_to_any_random_secret_key"
 #  MODEL / PREDICTION LOGIC  (your original logic)
 # ---------------------------------------------------------------------
 
-# Train and save the improved model first
-def train_and_save_model():
-    # Import and preprocess data
-    dataset = pd.read_csv('diabetes.csv')
+# The model is trained by a separate build step (`python model_store.py build`)
+# and only loaded here. Set MODEL_STRICT=1 to refuse to start when the
+# artifact is missing or stale instead of rebuilding it. By default the
+# memory-mapped export is served by the NumPy engine, shared by all workers
+# on the host and without importing scikit-learn; MODEL_FORMAT=pickle serves
+# the scikit-learn model instead. ANN_NPROBE=N searches the export's
+# approximate IVF index (see ann_index.py), probing N lists per query.
+# MODEL_REDUCED=1 serves the prototype-reduced reference set (condense.py):
+# faster and smaller, at the held-out accuracy cost reported by the build.
+MODEL_STRICT = os.environ.get('MODEL_STRICT') == '1'
+ANN_NPROBE = int(os.environ.get('ANN_NPROBE', 0))
+MODEL_REDUCED = os.environ.get('MODEL_REDUCED') == '1'
+
+# MODEL_ENSEMBLE=1 averages the KNN with the artifact's other members (the
+# linear SVC from model.py) scored in parallel; ENSEMBLE_WEIGHTS="knn=2,svc=1"
+# weights them and members slower than ENSEMBLE_BUDGET_MS are left out of
+# that request's result (see ensemble.py).
+MODEL_ENSEMBLE = os.environ.get('MODEL_ENSEMBLE') == '1'
+ENSEMBLE_WEIGHTS = ensemble.parse_weights(os.environ.get('ENSEMBLE_WEIGHTS'))
+ENSEMBLE_BUDGET_MS = float(os.environ.get('ENSEMBLE_BUDGET_MS', 25))
+_ensemble_pool = None
+
+# Feature importance is the change in diabetes probability when a feature
+# is set to its training mean (attribution.py), computed in the same model
+# call as the prediction. Batches that would take longer than
+# ATTRIBUTION_BUDGET_MS get attributions for as many rows as fit.
+ATTRIBUTION_BUDGET_MS = float(os.environ.get('ATTRIBUTION_BUDGET_MS', 50))
+
+def make_engine(artifact):
+    """Serving engine for a loaded artifact: optionally an Ensemble, always with attributions"""
+    global _ensemble_pool
+    engine = engine_for(artifact)
+    if MODEL_ENSEMBLE:
+        if _ensemble_pool is None:
+            # Shared by every model version the registry swaps in
+            from concurrent.futures import ThreadPoolExecutor
+            _ensemble_pool = ThreadPoolExecutor(thread_name_prefix='ensemble')
+        engine = ensemble.build(artifact, engine, ENSEMBLE_WEIGHTS, ENSEMBLE_BUDGET_MS, _ensemble_pool)
+    return Attributor(engine, artifact['preprocessor'].means, ATTRIBUTION_BUDGET_MS)
+
+def _load_pickle():
+    artifact = model_store.load_model(strict=MODEL_STRICT)
+    return model_store.reduced_view(artifact) if MODEL_REDUCED else artifact
+
+if os.environ.get('MODEL_FORMAT', 'mmap') == 'pickle':
+    model_registry = ModelRegistry(
+        _load_pickle, make_engine,
+        watch_paths=[model_store.ARTIFACT_FILE],
+    )
+else:
+    model_registry = ModelRegistry(
+        lambda: mmap_store.load_mmap(strict=MODEL_STRICT, n_probe=ANN_NPROBE, reduced=MODEL_REDUCED),
+        make_engine,
+        watch_paths=[os.path.join(mmap_store.MMAP_DIR, 'meta.json'), model_store.ARTIFACT_FILE],
+    )
+
+# A rebuilt artifact is validated, warmed and swapped in without a restart:
+# the registry polls the artifact files every MODEL_WATCH_INTERVAL seconds
+# (0 disables), and SIGHUP or POST /api/v1/admin/reload force a reload.
+# Requests take model_registry.current() once and finish on that version.
+if float(os.environ.get('MODEL_WATCH_INTERVAL', 5)) > 0:
+    model_registry.watch(float(os.environ.get('MODEL_WATCH_INTERVAL', 5)))
+model_registry.install_signal_handler()
+
+# Input schema of the form and the batch API; a reload never changes it
+features = model_registry.current().features
+
+def served_model():
+    """The model for this request, pinned on first use and reported in X-Model-Version"""
+    if 'served_model' not in g:
+        g.served_model = model_registry.current()
+    return g.served_model
+
+@app.after_request
+def add_model_version(response):
+    if 'served_model' in g:
+        response.headers['X-Model-Version'] = g.served_model.version
+    return response
+
+# PREDICT_BATCHING=1 coalesces concurrent /predict requests into one
+# vectorized model call; tune with BATCH_MAX_SIZE and BATCH_MAX_WAIT_MS.
+# A batch is scored by the model that is current when it is dispatched,
+# and each row's result carries that model back to its request.
+def predict_batch_rows(X):
+    """Score a micro-batch on one model version and return it with the outputs"""
+    served = model_registry.current()
+    return dict(served.engine.predict(X), served_model=served)
+
+batcher = None
+if os.environ.get('PREDICT_BATCHING') == '1':
+    batcher = MicroBatcher(
+        predict_batch_rows,
+        max_batch_size=int(os.environ.get('BATCH_MAX_SIZE', 64)),
+        max_wait_ms=float(os.environ.get('BATCH_MAX_WAIT_MS', 2.0)),
+    )
+
+def score_row(input_values):
+    """
+    Score one row, through the micro-batcher when it is enabled. Returns the
+    model that scored it and the row's result dict (see Attributor.predict).
+    """
+    if batcher is None:
+        served = served_model()
+        result = served.engine.predict([input_values])
+        return served, {key: value[0] if isinstance(value, np.ndarray) else value
+                        for key, value in result.items()}
+    result = batcher.predict(input_values)
+    return result['served_model'], result
+
+# LRU cache of /predict model outputs (prediction, probabilities, importance,
+# attributed) keyed on the input vector. Size 0 disables it;
+# PREDICTION_CACHE_PRECISION rounds inputs before lookup.
+prediction_cache = None
+if int(os.environ.get('PREDICTION_CACHE_SIZE', 4096)) > 0:
+    _precision = os.environ.get('PREDICTION_CACHE_PRECISION')
+    prediction_cache = PredictionCache(
+        max_size=int(os.environ.get('PREDICTION_CACHE_SIZE', 4096)),
+        precision=int(_precision) if _precision else None,
+    )
+
+# Abnormal-value flags and risk tiers, compiled once for the model's features
+risk_table = RiskTable(features)
+
+def member_metrics(served):
+    """
+    Held-out accuracy and AUC of each ensemble member. The weighted ensemble
+    itself is not cross-validated, so these are all the figures there are.
+    """
+    metrics = {'knn': served.metrics}
+    metrics.update((name, member['metrics']) for name, member in served.artifact['members'].items())
+    return {name: {'accuracy': round(float(m['accuracy']), 4), 'auc': round(float(m['auc']), 4)}
+            for name, m in metrics.items()}
+
+def predict_row(input_values):
+    """Prediction, probabilities and feature analysis for one row; model outputs come from cache when possible"""
+    scored = prediction_cache.get(input_values, served_model().version) if prediction_cache is not None else None
+    if scored is None:
+        # One model call scores the input and its per-feature perturbations,
+        # giving the prediction, probability and feature importance
+        served, result = score_row(input_values)
+        # A batch may have run on a newer version than the one this request
+        # pinned; the cache key and X-Model-Version follow the one that scored it
+        g.served_model = served
+        scored = (int(result['predictions']), result['probabilities'], result['importance'],
+                  bool(result['attributed']))
+        # A result cut short by a budget (ensemble members left out, or no
+        # attributions) is served to this request only, not to every later hit
+        if prediction_cache is not None and not result.get('partial') and scored[3]:
+            prediction_cache.put(input_values, served.version, scored)
+    prediction, probability, importance, attributed = scored
+
+    # The key may be rounded, so flags and displayed values always come from this request's inputs
+    return {
+        'prediction': prediction,
+        'probability': probability,
+        # False when ATTRIBUTION_BUDGET_MS left no time for the importance
+        'attributed': attributed,
+        'feature_analysis': risk_table.feature_analysis(
+            input_values, risk_table.flags(input_values)[0], importance),
+    }
+
+class LazyInstance:
+    """Stand-in that builds cls() on first attribute access instead of at import"""
     
-    # Replace zero values with NaN and then fill with mean
-    columns_to_process = ['Glucose', 'BloodPressure', 'SkinThickness', 'Insulin', 'BMI']
-    dataset[columns_to_process] = dataset[columns_to_process].replace(0, np.NaN)
-    for column in columns_to_process:
-        dataset[column].fillna(dataset[column].mean(), inplace=True)
+    def __init__(self, cls):
+        self._cls = cls
+        self._instance = None
+        self._lock = threading.Lock()
     
-    # Select all relevant features
-    features = [
-        'Glucose',
-        'BloodPressure',
-        'SkinThickness',
-        'Insulin',
-        'BMI',
-        'DiabetesPedigreeFunction',
-        'Age'
-    ]
-    X = dataset[features]
-    y = dataset['Outcome']
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._cls()
+        return self._instance
     
-    # Scale the features
-    scaler = MinMaxScaler(feature_range=(0, 1))
-    X_scaled = scaler.fit_transform(X)
-    
-    # Train KNN model
-    knn = KNeighborsClassifier(n_neighbors=24, metric='minkowski', p=2)
-    knn.fit(X_scaled, y)
-    
-    # Calculate accuracy
-    accuracy = knn.score(X_scaled, y)
-    
-    return knn, scaler, features, accuracy
-
-# Train model and get components
-model, scaler, features, model_accuracy = train_and_save_model()
-
-def get_feature_importance(input_values):
-    """Calculate the relative importance of each feature's contribution"""
-    scaled_input = scaler.transform([input_values])
-    neighbors = model.kneighbors(scaled_input, return_distance=True)
-    distances = neighbors[0][0]
-    importance = 1 / (distances + 1e-10)  # Add small constant to avoid division by zero
-    return importance / importance.sum()
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
 
 # ---------------------------------------------------------------------
 #  DIET RECOMMENDATION ENGINE (Rule-based AI)
@@ -232,8 +371,8 @@ class DietRecommendationEngine:
         
         return plan
 
-# Initialize diet recommendation engine
-diet_engine = DietRecommendationEngine()
+# Diet recommendation engine, built on first use
+diet_engine = LazyInstance(DietRecommendationEngine)
 
 # ---------------------------------------------------------------------
 #  SYMPTOMS CHECKER ENGINE
@@ -397,8 +536,8 @@ class SymptomsCheckerEngine:
             'all_symptoms': self.symptoms
         }
 
-# Initialize symptoms checker engine
-symptoms_engine = SymptomsCheckerEngine()
+# Symptoms checker engine, built on first use
+symptoms_engine = LazyInstance(SymptomsCheckerEngine)
 
 # ---------------------------------------------------------------------
 #  FOOD SEARCH ENGINE (GI & Sugar Index)
@@ -743,36 +882,20 @@ class FoodSearchEngine:
         else:
             return {'level': 'High', 'color': '#dc3545', 'emoji': '❌', 'advice': 'Limit consumption or choose alternatives'}
 
-# Initialize food search engine
-food_search_engine = FoodSearchEngine()
+# Food search engine, built on first use
+food_search_engine = LazyInstance(FoodSearchEngine)
 
 # ---------------------------------------------------------------------
-#  PERSISTENT USER CREDENTIAL STORAGE (using JSON file)
+#  PERSISTENT USER CREDENTIAL STORAGE (SQLite, see user_store.py)
 # ---------------------------------------------------------------------
 
-# File to store user credentials
+# USERS_DB is the SQLite file; accounts from the old USERS_FILE are
+# imported into it once. Each worker process caches up to USER_CACHE_SIZE
+# accounts, invalidated as soon as any worker changes one (0 disables it).
 USERS_FILE = 'users_credentials.json'
-
-def load_users():
-    """Load users from JSON file. Create empty file if it doesn't exist."""
-    if os.path.exists(USERS_FILE):
-        try:
-            with open(USERS_FILE, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return {}
-    return {}
-
-def save_users(users_dict):
-    """Save users to JSON file."""
-    try:
-        with open(USERS_FILE, 'w') as f:
-            json.dump(users_dict, f, indent=4)
-    except IOError as e:
-        print(f"Error saving users: {e}")
-
-# Load users from file on startup
-users = load_users()
+users = UserStore(os.environ.get('USERS_DB', 'users.db'),
+                  cache_size=int(os.environ.get('USER_CACHE_SIZE', 10000)))
+users.migrate_json(USERS_FILE)
 
 # User health data storage (in-memory; replace with DB later)
 # key = email, value = {predictions: [...], lab_results: [...], water_intake: [...], exercises: [...]}
@@ -863,11 +986,11 @@ def register():
         else:
             # Hash the password for security using PBKDF2 (compatible with all Python versions)
             hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
-            users[email] = {"name": name, "password": hashed_password}
-            # Save users to file
-            save_users(users)
-            # After successful registration, go to login page
-            return redirect(url_for("login"))
+            # A single-row insert; False if another request registered the email first
+            if users.add(email, name, hashed_password):
+                # After successful registration, go to login page
+                return redirect(url_for("login"))
+            error = "Email already registered. Please login or use a different email."
 
     return render_template("register.html", error=error)
 
@@ -974,6 +1097,9 @@ def predict():
         input_values = []
         for feature in features:
             value = float(request.form.get(feature, 0))
+            # float() accepts 'nan' and 'inf', which no model can score
+            if not np.isfinite(value):
+                raise ValueError(f"{feature} must be a finite number")
             input_values.append(value)
 
         # Validate inputs are within reasonable ranges
@@ -989,105 +1115,38 @@ def predict():
         zero_count = sum(1 for i, val in enumerate(input_values) if val == 0 and i > 0)
         data_quality_warning = ""
         if zero_count >= 3:
-            data_quality_warning = "⚠️ Multiple zero values detected. Some measurements may be missing. Results may be less accurate."
-        
-        # Scale the input
-        scaled_input = scaler.transform([input_values])
-        
-        # Get prediction and probability
-        prediction = model.predict(scaled_input)
-        probability = model.predict_proba(scaled_input)[0]
-        confidence = probability[1] if prediction[0] == 1 else probability[0]
+            data_quality_warning = "⚠️ Multiple zero values detected. Missing measurements were filled in with average values from the training data. Results may be less accurate."
         
-        # Get feature importance
-        importance = get_feature_importance(input_values)
+        # Prediction, probability and feature analysis (cached per input)
+        scored = predict_row(input_values)
+        prediction = scored['prediction']
+        probability = scored['probability']
+        confidence = probability[1] if prediction == 1 else probability[0]
         
-        # Create feature contribution analysis with normal ranges
-        feature_analysis = []
-        feature_ranges = {
-            'Glucose': {'min': 70, 'max': 100, 'unit': 'mg/dL', 'normal': 'Normal fasting: 70-100'},
-            'BloodPressure': {'min': 90, 'max': 120, 'unit': 'mmHg', 'normal': 'Normal: <120/80'},
-            'SkinThickness': {'min': 10, 'max': 40, 'unit': 'mm', 'normal': 'Typical: 15-35'},
-            'Insulin': {'min': 0, 'max': 30, 'unit': 'mIU/L', 'normal': 'Normal: 0-25'},
-            'BMI': {'min': 18.5, 'max': 24.9, 'unit': 'kg/m²', 'normal': 'Healthy: 18.5-24.9'},
-            'DiabetesPedigreeFunction': {'min': 0, 'max': 1.0, 'unit': '', 'normal': 'Genetic risk factor'},
-            'Age': {'min': 0, 'max': 120, 'unit': 'years', 'normal': 'Age factor'}
-        }
-        
-        for i, feature in enumerate(features):
-            value = input_values[i]
-            range_info = feature_ranges.get(feature, {})
-            is_abnormal = False
-            status = "Normal"
-            
-            if feature in feature_ranges:
-                min_val = range_info['min']
-                max_val = range_info['max']
-                if feature != 'DiabetesPedigreeFunction' and feature != 'Age':
-                    if value < min_val:
-                        is_abnormal = True
-                        status = f"Low (normal: {min_val}-{max_val})"
-                    elif value > max_val:
-                        is_abnormal = True
-                        status = f"High (normal: {min_val}-{max_val})"
-            
-            feature_analysis.append({
-                'name': feature,
-                'value': round(value, 1),
-                'unit': range_info.get('unit', ''),
-                'importance': f"{importance[i]*100:.1f}%",
-                'is_abnormal': is_abnormal,
-                'status': status
-            })
-        
-        # Sort features by importance
-        feature_analysis.sort(
-            key=lambda x: float(x['importance'].strip('%')),
-            reverse=True
-        )
+        feature_analysis = [
+            dict(item, importance=f"{item['importance']*100:.1f}%" if scored['attributed'] else "not computed")
+            for item in scored['feature_analysis']
+        ]
         
         # Risk stratification
-        risk_level = "Low Risk"
-        risk_color = "green"
-        risk_details = "Your risk indicators suggest low diabetes risk. Maintain healthy habits."
-        
-        if prediction[0] == 1:
-            if confidence >= 0.8:
-                risk_level = "High Risk"
-                risk_color = "red"
-                risk_details = "High probability of diabetes. Consult a healthcare provider immediately."
-            elif confidence >= 0.6:
-                risk_level = "Moderate-High Risk"
-                risk_color = "orange"
-                risk_details = "Significant risk indicators present. Schedule a medical checkup."
-            else:
-                risk_level = "Moderate Risk"
-                risk_color = "yellow"
-                risk_details = "Some risk factors detected. Monitor your health closely."
-        else:
-            if confidence >= 0.85:
-                risk_level = "Very Low Risk"
-                risk_color = "darkgreen"
-                risk_details = "Excellent indicators. Continue your healthy lifestyle."
-            elif confidence >= 0.7:
-                risk_level = "Low Risk"
-                risk_color = "green"
-                risk_details = "Good health indicators. Stay active and eat well."
+        risk_level, risk_color, risk_details = risk_table.tier(
+            risk_table.tiers(prediction, confidence)[0])
         
         result = (
             "Has Diabetes"
-            if prediction[0] == 1
+            if prediction == 1
             else "Does Not Have Diabetes"
         )
         
         # Show precautions if diabetes is detected
-        show_precautions = prediction[0] == 1
+        show_precautions = prediction == 1
         
         return render_template(
             'index.html',
             prediction=result,
             confidence=f"{confidence*100:.1f}%",
             feature_analysis=feature_analysis,
+            attributed=scored['attributed'],
             show_precautions=show_precautions,
             risk_level=risk_level,
             risk_color=risk_color,
@@ -1095,7 +1154,11 @@ def predict():
             data_quality_warning=data_quality_warning,
             probability_class1=f"{probability[1]*100:.1f}%",
             probability_class0=f"{probability[0]*100:.1f}%",
-            model_accuracy=f"{model_accuracy*100:.2f}%"
+            model_accuracy=f"{served_model().metrics['accuracy']*100:.2f}%",
+            # The metrics are the KNN's alone when it is served in an ensemble
+            accuracy_label="KNN component accuracy" if MODEL_ENSEMBLE else "Model accuracy",
+            model_metrics=served_model().metrics,
+            model_version=served_model().version[:12]
         )
                              
     except Exception as e:
@@ -1106,6 +1169,150 @@ def predict():
         )
 
 
+# ---------------------------------------------------------------------
+#  BATCH PREDICTION API
+# ---------------------------------------------------------------------
+
+# Upper bound on rows per request, keeps a single call's memory predictable
+MAX_BATCH_ROWS = 10000
+
+def parse_batch_payload(payload):
+    """
+    Validate a batch payload into an (n_rows, n_features) float array.
+
+    Accepts a list of records ({"Glucose": 148, ...}), a list of rows in
+    feature order, or a column-oriented dict ({"Glucose": [148, 85], ...}).
+    Raises ValueError with a message suitable for the client.
+    """
+    if isinstance(payload, dict):
+        missing = [f for f in features if f not in payload]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        columns = [np.asarray(payload[f], dtype=np.float64) for f in features]
+        if any(col.ndim != 1 or len(col) != len(columns[0]) for col in columns):
+            raise ValueError("All columns must be flat lists of the same length")
+        X = np.column_stack(columns) if columns[0].size else np.empty((0, len(features)))
+    elif isinstance(payload, list):
+        if not payload:
+            raise ValueError("No rows to predict")
+        rows = []
+        for i, row in enumerate(payload):
+            if isinstance(row, dict):
+                missing = [f for f in features if f not in row]
+                if missing:
+                    raise ValueError(f"Row {i} is missing: {', '.join(missing)}")
+                row = [row[f] for f in features]
+            rows.append(row)
+        X = np.array(rows, dtype=np.float64).reshape(len(rows), -1)
+    else:
+        raise ValueError("Expected a JSON array of rows or an object of columns")
+
+    if X.shape[1] != len(features):
+        raise ValueError(f"Each row needs {len(features)} values in order: {', '.join(features)}")
+    if len(X) == 0:
+        raise ValueError("No rows to predict")
+    if len(X) > MAX_BATCH_ROWS:
+        raise ValueError(f"At most {MAX_BATCH_ROWS} rows per request")
+    if not np.isfinite(X).all():
+        raise ValueError("All values must be finite numbers")
+    return X
+
+
+@app.route('/api/v1/predict/batch', methods=['POST'])
+def predict_batch():
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({'error': "Request body must be JSON"}), 400
+    try:
+        X = parse_batch_payload(payload)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    # One vectorized pass and one model call over the batch and its attribution perturbations
+    served = served_model()
+    scored = served.engine.predict(X)
+    predictions = scored['predictions']
+    probabilities = scored['probabilities']
+    importance = scored['importance']
+    confidence = probabilities.max(axis=1)
+    # Flags and risk tiers for the whole batch; text is filled in per row below
+    flags = risk_table.flags(X)
+    tiers = risk_table.tiers(predictions, confidence)
+
+    results = []
+    for i in range(len(X)):
+        prediction = int(predictions[i])
+        probability = probabilities[i]
+        risk_level, risk_color, risk_details = risk_table.tier(tiers[i])
+        attributed = bool(scored['attributed'][i])
+        feature_analysis = risk_table.feature_analysis(X[i], flags[i], importance[i],
+                                                       scored['attribution'][i])
+        for item in feature_analysis:
+            # Rows past ATTRIBUTION_BUDGET_MS have no attributions
+            item['importance'] = round(item['importance'], 4) if attributed else None
+            item['attribution'] = round(item['attribution'], 4) if attributed else None
+        results.append({
+            'prediction': prediction,
+            'result': "Has Diabetes" if prediction == 1 else "Does Not Have Diabetes",
+            'confidence': round(float(confidence[i]), 4),
+            'probability_class0': round(float(probability[0]), 4),
+            'probability_class1': round(float(probability[1]), 4),
+            'risk_level': risk_level,
+            'risk_color': risk_color,
+            'risk_details': risk_details,
+            'feature_analysis': feature_analysis,
+        })
+
+    response = {
+        'count': len(results),
+        'model_version': served.version,
+        'model_accuracy': round(float(served.metrics['accuracy']), 4),
+        'model_auc': round(float(served.metrics['auc']), 4),
+        'results': results,
+    }
+    if 'members' in scored:
+        # Ensemble serving: which members made it into this result. There is
+        # no held-out figure for the ensemble, only for its members
+        response.update(model_accuracy=None, model_auc=None, member_metrics=member_metrics(served))
+        response['ensemble_members'] = scored['members']
+        response['partial'] = scored['partial']
+    return jsonify(response)
+
+
+@app.route('/api/v1/metrics')
+def serving_metrics():
+    metrics = {'model_checksum': model_registry.current().version, 'model': model_registry.status()}
+    if batcher is not None:
+        metrics['batching'] = batcher.metrics()
+    if prediction_cache is not None:
+        metrics['prediction_cache'] = prediction_cache.stats()
+    metrics['user_cache'] = users.cache_stats()
+    served = model_registry.current()
+    calibrated = served.artifact.get('calibration')
+    # Held-out quality of the probability calibration, if the model has one
+    metrics['calibration'] = calibrated and dict(calibrated['metrics'], method=calibrated['method'])
+    engine = served.engine
+    metrics['attribution'] = engine.status()
+    if MODEL_ENSEMBLE:
+        metrics['ensemble'] = engine.engine.status()
+    return jsonify(metrics)
+
+
+@app.route('/api/v1/admin/reload', methods=['POST'])
+def reload_model():
+    """Load, warm and swap in the artifact on disk. Needs X-Admin-Token = MODEL_ADMIN_TOKEN."""
+    token = os.environ.get('MODEL_ADMIN_TOKEN')
+    if not token or not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), token.encode()):
+        return jsonify({'error': "Forbidden"}), 403
+    previous = model_registry.current().version
+    try:
+        version = model_registry.reload()
+    except Exception as e:
+        return jsonify({'error': f"Reload failed: {e}", 'model': model_registry.status()}), 500
+    return jsonify({'previous_version': previous, 'version': version,
+                    'swapped': version != previous, 'model': model_registry.status()})
+
+
 # -----
 #  DIET RECOMMENDATION ROUTE
 # -----
@@ -1404,7 +1611,7 @@ def log_water():
             
             user_health_data[email]['water_intake'].append({
                 'amount': amount,
-                'date': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M')
+                'date': datetime.now().strftime('%Y-%m-%d %H:%M')
             })
             message = f"✅ Logged {amount}ml of water!"
         except Exception as e:
@@ -1413,7 +1620,7 @@ def log_water():
     # Calculate today's water intake
     today_water = 0
     if email in user_health_data:
-        today = pd.Timestamp.now().strftime('%Y-%m-%d')
+        today = datetime.now().strftime('%Y-%m-%d')
         today_water = sum([w['amount'] for w in user_health_data[email]['water_intake'] if w['date'].startswith(today)])
     
     return render_template('water_tracker.html', message=message, today_water=today_water)
@@ -1440,7 +1647,7 @@ def log_exercise():
                 'type': exercise_type,
                 'duration': duration,
                 'intensity': intensity,
-                'date': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M'),
+                'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
                 'calories_burned': duration * {'light': 3, 'moderate': 5, 'vigorous': 8}.get(intensity, 5)
             })
             message = f"✅ Logged {duration} min of {exercise_type}!"
@@ -1493,7 +1700,7 @@ def lab_results():
                 'result': float(result),
                 'unit': unit,
                 'normal_range': normal_range,
-                'date': pd.Timestamp.now().strftime('%Y-%m-%d')
+                'date': datetime.now().strftime('%Y-%m-%d')
             })
             message = f"✅ Lab result recorded: {test_name} = {result} {unit}"
         except Exception as e:
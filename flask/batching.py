@@ -0,0 +1,105 @@
+"""
+Micro-batching scheduler for concurrent single-row predictions.
+
+Request threads enqueue one feature row each and wait on a Future. A single
+dispatcher thread drains the queue until it has max_batch_size rows or
+max_wait_ms has passed since the first row arrived, then scores the whole
+batch with one vectorized call. This trades a little latency (at most
+max_wait_ms) for much less per-call overhead under load.
+"""
+
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Coalesce rows into batches for predict_fn.
+
+    predict_fn takes an (n, n_features) array and returns a dict of arrays
+    whose first dimension is n; each caller's Future resolves to a dict with
+    its own row of every array.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=2.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = collections.Counter()
+        self._rows = 0
+        self._batches = 0
+        self._max_queue_depth = 0
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        """Queue one feature row. Returns a Future for its result."""
+        future = Future()
+        self._queue.put((row, future))
+        depth = self._queue.qsize()
+        if depth > self._max_queue_depth:
+            self._max_queue_depth = depth
+        return future
+
+    def predict(self, row, timeout=None):
+        """Queue one row and block until its result is ready."""
+        return self.submit(row).result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            rows = [row for row, _ in batch]
+            futures = [future for _, future in batch]
+            try:
+                result = self.predict_fn(np.asarray(rows, dtype=np.float64))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for i, future in enumerate(futures):
+                    # Per-row arrays are split; batch-level values (e.g. the
+                    # ensemble's 'members') are shared by every row
+                    future.set_result({key: value[i] if isinstance(value, np.ndarray) else value
+                                       for key, value in result.items()})
+
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._rows += len(batch)
+                self._batches += 1
+
+    def metrics(self):
+        """Queue depth and batch-size histogram since startup."""
+        with self._lock:
+            histogram = dict(sorted(self._batch_sizes.items()))
+            rows, batches = self._rows, self._batches
+        return {
+            'queue_depth': self._queue.qsize(),
+            'max_queue_depth': self._max_queue_depth,
+            'batches': batches,
+            'rows': rows,
+            'mean_batch_size': round(rows / batches, 2) if batches else 0.0,
+            'batch_size_histogram': histogram,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+        }
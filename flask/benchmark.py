@@ -0,0 +1,347 @@
+"""
+Serving benchmarks for the prediction routes.
+
+Run from the flask/ directory:
+
+    python benchmark.py batch --rows 2000
+    python benchmark.py inference
+    python benchmark.py batching --threads 16
+    python benchmark.py reload --swaps 10
+    python benchmark.py ensemble --budget-ms 5
+    python benchmark.py attribution
+    python benchmark.py users --users 1000 100000 1000000
+
+The batch benchmark drives the app through Flask's test client, so its
+numbers include request parsing and response rendering but no network.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import mmap_store
+import model_store
+
+
+def sample_rows(n_rows, seed=0, data_path=model_store.DATA_FILE):
+    """Draw n_rows feature rows (dicts) from the dataset with replacement."""
+    X, _ = model_store.read_dataset(data_path)
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(X), size=n_rows)
+    return [dict(zip(model_store.FEATURES, row)) for row in X[idx].tolist()]
+
+
+def bench_batch(args):
+    """Rows/sec through /predict (one form post per row) vs /api/v1/predict/batch."""
+    import app as webapp
+
+    client = webapp.app.test_client()
+    rows = sample_rows(args.rows, data_path=args.data)
+
+    form_rows = rows[:args.form_rows]
+    start = time.perf_counter()
+    for row in form_rows:
+        client.post('/predict', data=row)
+    form_elapsed = time.perf_counter() - start
+    form_rate = len(form_rows) / form_elapsed
+
+    print(f"{'path':<28}{'rows':>8}{'seconds':>10}{'rows/sec':>12}")
+    print(f"{'/predict (form, per row)':<28}{len(form_rows):>8}{form_elapsed:>10.3f}{form_rate:>12.0f}")
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, len(rows), batch_size):
+            response = client.post('/api/v1/predict/batch', json=rows[i:i + batch_size])
+            assert response.status_code == 200, response.get_json()
+        elapsed = time.perf_counter() - start
+        rate = len(rows) / elapsed
+        label = f"/api/v1/predict/batch x{batch_size}"
+        print(f"{label:<28}{len(rows):>8}{elapsed:>10.3f}{rate:>12.0f}  ({rate / form_rate:.1f}x)")
+
+
+def _timeit(fn, repeat):
+    """Median and p99 wall time of fn() in microseconds."""
+    timings = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings[i] = time.perf_counter() - start
+    return np.median(timings) * 1e6, np.percentile(timings, 99) * 1e6
+
+
+def bench_inference(args):
+    """Per-request latency: three separate KNN passes vs one pass (sklearn and NumPy engines)."""
+    from inference import InferenceEngine
+
+    artifact = model_store.load_model()
+    model, preprocessor = artifact['model'], artifact['preprocessor']
+    engine = InferenceEngine(model, preprocessor)
+    row = [list(r.values()) for r in sample_rows(1, data_path=args.data)][0]
+
+    def three_passes():
+        scaled = preprocessor.transform([row])
+        model.predict(scaled)
+        model.predict_proba(scaled)
+        model.kneighbors(preprocessor.transform([row]), return_distance=True)
+
+    def one_pass():
+        engine.predict_one(row)
+
+    print(f"{'path':<34}{'p50 us':>10}{'p99 us':>10}")
+    baseline, _ = _timeit(three_passes, args.repeat)
+    numpy_engine = mmap_store.load_mmap()['engine']
+    paths = [
+        ("predict + proba + kneighbors", three_passes),
+        ("InferenceEngine.predict_one", one_pass),
+        ("NumpyKNN.predict_one", lambda: numpy_engine.predict_one(row)),
+    ]
+    for label, fn in paths:
+        p50, p99 = _timeit(fn, args.repeat)
+        print(f"{label:<34}{p50:>10.0f}{p99:>10.0f}  ({baseline / p50:.1f}x)")
+
+
+def bench_batching(args):
+    """Concurrent single-row throughput with and without the micro-batcher."""
+    import threading
+    from batching import MicroBatcher
+    from inference import InferenceEngine
+
+    artifact = model_store.load_model()
+    engine = InferenceEngine(artifact['model'], artifact['preprocessor'])
+    rows = [list(r.values()) for r in sample_rows(args.rows, data_path=args.data)]
+
+    def run(score):
+        def worker(offset):
+            for i in range(offset, len(rows), args.threads):
+                score(rows[i])
+        threads = [threading.Thread(target=worker, args=(t,)) for t in range(args.threads)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return len(rows) / (time.perf_counter() - start)
+
+    print(f"{'mode':<34}{'rows/sec':>10}")
+    baseline = run(engine.predict_one)
+    print(f"{'unbatched':<34}{baseline:>10.0f}")
+    for wait_ms in args.wait_ms:
+        batcher = MicroBatcher(engine.predict, args.max_batch_size, wait_ms)
+        rate = run(batcher.predict)
+        label = f"batched (max {args.max_batch_size}, {wait_ms} ms)"
+        print(f"{label:<34}{rate:>10.0f}  ({rate / baseline:.1f}x, "
+              f"mean batch {batcher.metrics()['mean_batch_size']})")
+
+
+def bench_reload(args):
+    """Latency and errors under concurrent load while the model is hot-swapped."""
+    import tempfile
+    import threading
+    import pandas as pd
+    import app as webapp
+    import synth_data
+
+    # A second model to alternate with, trained on synthetic rows
+    tmp = tempfile.mkdtemp()
+    synth = synth_data.fit(pd.read_csv(model_store.DATA_FILE))
+    synth_data.write_csv(synth_data.generate(synth, 5000), f"{tmp}/alt.csv")
+    alt = model_store.build_artifact(f"{tmp}/alt.csv", f"{tmp}/alt.pkl", cv_folds=2, n_jobs=1)
+    mmap_store.export_mmap(alt, f"{tmp}/alt.mmap", f"{tmp}/alt.pkl")
+    dirs = [f"{tmp}/alt.mmap", mmap_store.MMAP_DIR]
+    swaps = iter(range(1 << 30))
+    webapp.model_registry.loader = lambda: mmap_store.read_mmap(dirs[next(swaps) % 2])
+
+    rows = sample_rows(1000, data_path=args.data)
+    samples = []  # (start time, latency, status, version)
+    stop = threading.Event()
+
+    def worker(offset):
+        client = webapp.app.test_client()
+        i = offset
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = client.post('/api/v1/predict/batch', json=[rows[i % len(rows)]])
+            samples.append((start, time.perf_counter() - start, response.status_code,
+                            response.headers.get('X-Model-Version')))
+            i += args.threads
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(args.threads)]
+    for t in threads:
+        t.start()
+    reload_times, swap_at = [], []
+    for _ in range(args.swaps):
+        time.sleep(args.interval)
+        start = time.perf_counter()
+        webapp.model_registry.reload()
+        reload_times.append(time.perf_counter() - start)
+        swap_at.append(time.perf_counter())
+    time.sleep(args.interval)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    latency = np.array([s[1] for s in samples]) * 1e6
+    after_swap = np.array([any(0 <= s[0] - t < 0.1 for t in swap_at) for s in samples])
+    errors = sum(1 for s in samples if s[2] != 200)
+    print(f"requests {len(samples)}, errors {errors}, versions served {len({s[3] for s in samples})}, "
+          f"swaps {len(swap_at)}, reload (load + validate + warm) median "
+          f"{np.median(reload_times) * 1000:.0f} ms off the request path")
+    print(f"{'window':<28}{'requests':>10}{'p50 us':>10}{'p99 us':>10}")
+    for label, mask in [("steady state", ~after_swap), ("100 ms after a swap", after_swap)]:
+        if mask.any():
+            print(f"{label:<28}{mask.sum():>10}{np.median(latency[mask]):>10.0f}"
+                  f"{np.percentile(latency[mask], 99):>10.0f}")
+
+
+def bench_ensemble(args):
+    """Single-row latency of the KNN, the ensemble, and the ensemble with a slow member."""
+    import ensemble
+
+    artifact = mmap_store.load_mmap()
+    knn = artifact['engine']
+    rows = [list(r.values()) for r in sample_rows(args.repeat, data_path=args.data)]
+    rng = np.random.default_rng(0)
+
+    class SlowMember:
+        """The SVC, but one call in slow_every also sleeps slow_ms, like a GC pause or cold cache."""
+        def __init__(self, engine):
+            self.engine = engine
+            self.classes = engine.classes
+
+        def predict(self, X):
+            if rng.integers(args.slow_every) == 0:
+                time.sleep(args.slow_ms / 1000)
+            return self.engine.predict(X)
+
+    svc = ensemble.MEMBER_KINDS['linear'](artifact['members']['svc'])
+    configs = [
+        ("knn alone", knn),
+        ("svc alone", svc),
+        ("ensemble, no budget", ensemble.Ensemble({'knn': knn, 'svc': svc})),
+        ("+ slow member, no budget", ensemble.Ensemble({'knn': knn, 'svc': svc, 'slow': SlowMember(svc)})),
+        (f"+ slow member, {args.budget_ms} ms budget",
+         ensemble.Ensemble({'knn': knn, 'svc': svc, 'slow': SlowMember(svc)}, budget_ms=args.budget_ms)),
+    ]
+    print(f"{'engine':<34}{'p50 us':>10}{'p99 us':>10}{'partial':>9}")
+    for label, engine in configs:
+        row = iter(rows * 2)
+        p50, p99 = _timeit(lambda: engine.predict_one(next(row)), args.repeat)
+        partial = engine.status()['partial_results'] if hasattr(engine, 'status') else 0
+        print(f"{label:<34}{p50:>10.0f}{p99:>10.0f}{partial:>9}")
+
+
+def bench_attribution(args):
+    """Latency of scoring with per-feature attributions vs plain scoring, single rows and batches."""
+    from attribution import Attributor
+
+    artifact = mmap_store.load_mmap()
+    engine = artifact['engine']
+    rows = np.array([list(r.values()) for r in sample_rows(max(args.batch_sizes), data_path=args.data)])
+    unbounded = Attributor(engine, artifact['preprocessor'].means)
+    budgeted = Attributor(engine, artifact['preprocessor'].means, args.budget_ms)
+
+    print(f"{'rows':>6}{'plain p50 us':>14}{'attributed p50 us':>19}{'x':>6}"
+          f"{'budgeted p50 us':>17}{'attributed rows':>17}")
+    for n in args.batch_sizes:
+        X = rows[:n]
+        plain, _ = _timeit(lambda: engine.predict(X), args.repeat)
+        full, _ = _timeit(lambda: unbounded.predict(X), args.repeat)
+        capped, _ = _timeit(lambda: budgeted.predict(X), args.repeat)
+        attributed = int(budgeted.predict(X)['attributed'].sum())
+        print(f"{n:>6}{plain:>14.0f}{full:>19.0f}{full / plain:>6.1f}{capped:>17.0f}{attributed:>17}")
+
+
+def bench_users(args):
+    """Registration and login lookup latency of the SQLite user store as it grows, vs rewriting the JSON file."""
+    import json
+    import os
+    import shutil
+    import tempfile
+    from user_store import UserStore
+
+    workdir = tempfile.mkdtemp(prefix='users-bench-')
+    store = UserStore(os.path.join(workdir, 'users.db'))
+    # Stored hashes are about this long; hashing itself is not timed
+    password = 'pbkdf2:sha256:1000000$' + 'x' * 80
+    rng = np.random.default_rng(0)
+    new_ids = iter(range(10 ** 9))
+
+    print(f"{'users':>9}{'register p50 us':>17}{'p99 us':>9}{'login p50 us':>14}{'json rewrite ms':>17}")
+    filled = 0
+    try:
+        for n in sorted(args.users):
+            store.add_many((f'user{i}@example.com', 'User', password) for i in range(filled, n))
+            filled = n
+            register, register_p99 = _timeit(
+                lambda: store.add(f'new{next(new_ids)}@example.com', 'New', password), args.repeat)
+            login, _ = _timeit(lambda: store.get(f'user{rng.integers(n)}@example.com'), args.repeat)
+
+            # What the old save_users() did on every registration
+            accounts = {f'user{i}@example.com': {'name': 'User', 'password': password} for i in range(n)}
+            start = time.perf_counter()
+            with open(os.path.join(workdir, 'users.json'), 'w') as f:
+                json.dump(accounts, f, indent=4)
+            rewrite = (time.perf_counter() - start) * 1000
+            del accounts
+            print(f"{n:>9}{register:>17.0f}{register_p99:>9.0f}{login:>14.0f}{rewrite:>17.1f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prediction serving benchmarks.")
+    parser.add_argument('--data', default=model_store.DATA_FILE,
+                        help="dataset to draw query rows from (CSV or synth_data.py columnar directory)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    batch = sub.add_parser('batch', help=bench_batch.__doc__)
+    batch.add_argument('--rows', type=int, default=2000, help="rows scored through the batch API")
+    batch.add_argument('--form-rows', type=int, default=300, help="rows posted one by one to /predict")
+    batch.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 1000])
+    batch.set_defaults(func=bench_batch)
+
+    inference = sub.add_parser('inference', help=bench_inference.__doc__)
+    inference.add_argument('--repeat', type=int, default=2000)
+    inference.set_defaults(func=bench_inference)
+
+    batching = sub.add_parser('batching', help=bench_batching.__doc__)
+    batching.add_argument('--rows', type=int, default=2000)
+    batching.add_argument('--threads', type=int, default=16)
+    batching.add_argument('--max-batch-size', type=int, default=64)
+    batching.add_argument('--wait-ms', type=float, nargs='+', default=[0.5, 2.0, 5.0])
+    batching.set_defaults(func=bench_batching)
+
+    reload = sub.add_parser('reload', help=bench_reload.__doc__)
+    reload.add_argument('--threads', type=int, default=8)
+    reload.add_argument('--swaps', type=int, default=10)
+    reload.add_argument('--interval', type=float, default=0.5, help="seconds between swaps")
+    reload.set_defaults(func=bench_reload)
+
+    ensemble = sub.add_parser('ensemble', help=bench_ensemble.__doc__)
+    ensemble.add_argument('--repeat', type=int, default=2000)
+    ensemble.add_argument('--budget-ms', type=float, default=5.0)
+    ensemble.add_argument('--slow-ms', type=float, default=50.0, help="extra delay of a slow call")
+    ensemble.add_argument('--slow-every', type=int, default=50, help="one call in this many is slow")
+    ensemble.set_defaults(func=bench_ensemble)
+
+    attribution = sub.add_parser('attribution', help=bench_attribution.__doc__)
+    attribution.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 100, 1000])
+    attribution.add_argument('--repeat', type=int, default=50)
+    attribution.add_argument('--budget-ms', type=float, default=50.0)
+    attribution.set_defaults(func=bench_attribution)
+
+    users = sub.add_parser('users', help=bench_users.__doc__)
+    users.add_argument('--users', type=int, nargs='+', default=[1000, 100000, 1000000],
+                       help="store sizes to measure at")
+    users.add_argument('--repeat', type=int, default=1000)
+    users.set_defaults(func=bench_users)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
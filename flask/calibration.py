@@ -0,0 +1,124 @@
+"""
+Calibrated probabilities for the uniform-vote KNN.
+
+With k uniform neighbors, predict_proba() can only return k + 1 values,
+votes / k, and those fractions are not probabilities: a patient with 12 of
+24 diabetic neighbors is not necessarily 50% likely to be diabetic. At
+build time fit_vote_table() fits isotonic regression (or Platt scaling) on
+the out-of-fold vote counts of cross-validation and evaluates it at every
+count, giving a table of k + 1 calibrated probabilities of the positive
+class. It is stored with the model; serving counts the positive votes and
+indexes the table, so calibration costs one array lookup per row.
+
+Isotonic regression is a step function, and on a plateau one more positive
+vote changes nothing, which zeroes the perturbation attributions
+(attribution.py) of most features. The table therefore interpolates
+linearly between the centers of the isotonic steps. It is also clipped to
+[TABLE_CLIP, 1 - TABLE_CLIP], since no vote count makes a diagnosis certain.
+
+Held-out quality is measured by cross-fitting: each fold is scored with a
+table fitted on the other folds' out-of-fold votes. Serving predicts the
+class with the larger calibrated probability, so served_metrics() reports
+that rule's cross-fitted accuracy as the model's accuracy.
+"""
+
+import numpy as np
+
+METHODS = ('isotonic', 'platt')
+# Equal-width probability bins for the expected calibration error
+ECE_BINS = 10
+# Calibrated probabilities are kept this far from 0 and 1
+TABLE_CLIP = 0.01
+
+
+def _interpolated_isotonic(votes, positive, counts):
+    """Isotonic fit of positive on votes, interpolated between the weighted centers of its steps."""
+    from sklearn.isotonic import IsotonicRegression
+
+    iso = IsotonicRegression(y_min=0.0, y_max=1.0, out_of_bounds='clip').fit(votes, positive)
+    seen, weight = np.unique(votes, return_counts=True)
+    fitted = iso.predict(seen)
+    steps = np.flatnonzero(np.diff(fitted)) + 1
+    centers = [np.average(v, weights=w) for v, w in zip(np.split(seen, steps), np.split(weight, steps))]
+    return np.interp(counts, centers, fitted[np.r_[0, steps]])
+
+
+def fit_vote_table(votes, positive, n_neighbors, method='isotonic'):
+    """
+    Calibrated probability of the positive class for 0..n_neighbors positive
+    votes, fitted on vote counts and 0/1 outcomes. Returns a float64 array.
+    """
+    votes = np.asarray(votes, dtype=np.float64)
+    positive = np.asarray(positive, dtype=np.float64)
+    counts = np.arange(n_neighbors + 1, dtype=np.float64)
+    if method == 'isotonic':
+        table = _interpolated_isotonic(votes, positive, counts)
+    elif method == 'platt':
+        from sklearn.linear_model import LogisticRegression
+        platt = LogisticRegression(C=1e6).fit(votes[:, None] / n_neighbors, positive)
+        table = platt.predict_proba(counts[:, None] / n_neighbors)[:, 1]
+    else:
+        raise ValueError(f"unknown calibration method {method!r}, expected one of {', '.join(METHODS)}")
+    return np.clip(table, TABLE_CLIP, 1.0 - TABLE_CLIP)
+
+
+def _scores(positive, p, n_bins=ECE_BINS):
+    """Brier score, expected calibration error and accuracy of probabilities p."""
+    bins = np.minimum((p * n_bins).astype(int), n_bins - 1)
+    gap = np.bincount(bins, weights=positive - p, minlength=n_bins)
+    return {
+        'brier': float(np.mean((p - positive) ** 2)),
+        'ece': float(np.abs(gap).sum() / len(p)),
+        'accuracy': float(((p > 0.5) == positive).mean()),
+    }
+
+
+def calibrate(votes, positive, n_neighbors, splits, method='isotonic'):
+    """
+    Fit the vote table on all out-of-fold votes and measure it by
+    cross-fitting over splits ((train, test) index pairs). Returns the
+    'calibration' dict stored with a model: method, table and metrics,
+    which compare the raw vote fractions with the calibrated probabilities.
+    """
+    votes = np.asarray(votes)
+    positive = np.asarray(positive, dtype=np.float64)
+    held_out = np.empty(len(votes))
+    for train, test in splits:
+        held_out[test] = fit_vote_table(votes[train], positive[train], n_neighbors, method)[votes[test]]
+    raw = _scores(positive, votes / n_neighbors)
+    calibrated = _scores(positive, held_out)
+    return {
+        'method': method,
+        'table': fit_vote_table(votes, positive, n_neighbors, method).tolist(),
+        'metrics': {
+            'brier_raw': raw['brier'], 'brier': calibrated['brier'],
+            'ece_raw': raw['ece'], 'ece': calibrated['ece'],
+            'accuracy_raw': raw['accuracy'], 'accuracy': calibrated['accuracy'],
+            'fold_accuracy': [float(((held_out[test] > 0.5) == positive[test]).mean()) for _, test in splits],
+            'folds': len(splits),
+        },
+    }
+
+
+def served_metrics(metrics, calibrated):
+    """
+    Model metrics with the accuracy of the calibrated decision rule, which
+    is what serving predicts with, in place of the raw-vote accuracy (kept
+    as 'accuracy_raw').
+    """
+    if calibrated is None:
+        return metrics
+    import evaluation
+
+    fold_accuracy = calibrated['metrics']['fold_accuracy']
+    accuracy, accuracy_ci = evaluation.mean_ci(fold_accuracy)
+    return dict(metrics, accuracy=accuracy, accuracy_ci=accuracy_ci, fold_accuracy=fold_accuracy,
+                accuracy_raw=metrics['accuracy'], accuracy_raw_ci=metrics['accuracy_ci'])
+
+
+def describe(calibrated):
+    """One line summary of a 'calibration' dict for the build CLIs."""
+    m = calibrated['metrics']
+    return (f"  calibrated: {calibrated['method']}, Brier {m['brier_raw']:.4f} -> {m['brier']:.4f}, "
+            f"ECE {m['ece_raw']:.4f} -> {m['ece']:.4f}, "
+            f"accuracy {m['accuracy_raw'] * 100:.2f}% -> {m['accuracy'] * 100:.2f}% (cross-fitted)")
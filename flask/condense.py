@@ -0,0 +1,138 @@
+"""
+Prototype condensation of the KNN reference set.
+
+Instead of keeping every training row as a neighbor, each class is
+summarized by k-means centroids ("prototypes"), fraction times as many as
+the class has rows. The reduced model votes among as many nearest
+prototypes as the full model uses rows, capped at one per
+PROTOTYPES_PER_NEIGHBOR prototypes so tiny reference sets still vote
+locally. Fewer neighbors, or weighting prototypes by cluster size, agreed
+less or no better with the full model on held-out rows.
+
+model_store.py builds the reduced model next to the full one and reports
+its held-out agreement with the full model. Serve it with MODEL_REDUCED=1.
+
+    python condense.py --fractions 0.02 0.05 0.1 0.2
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import evaluation
+from ann_index import kmeans
+
+DEFAULT_FRACTION = 0.1
+PROTOTYPES_PER_NEIGHBOR = 8
+
+
+def prototypes(points, labels, fraction=DEFAULT_FRACTION, seed=0):
+    """k-means prototypes per class. Returns (prototype points, prototype labels)."""
+    parts, part_labels = [], []
+    for label in np.unique(labels):
+        members = points[labels == label]
+        n_prototypes = max(1, int(round(len(members) * fraction)))
+        centroids = kmeans(members, n_prototypes, seed)
+        parts.append(centroids)
+        part_labels.append(np.full(len(centroids), label))
+    return np.vstack(parts), np.concatenate(part_labels)
+
+
+def fit_reduced(points, labels, n_neighbors, fraction=DEFAULT_FRACTION, seed=0):
+    """A KNeighborsClassifier over the prototypes of preprocessed points."""
+    from sklearn.neighbors import KNeighborsClassifier
+
+    proto_points, proto_labels = prototypes(points, labels, fraction, seed)
+    k = max(1, min(n_neighbors, len(proto_points) // PROTOTYPES_PER_NEIGHBOR))
+    return KNeighborsClassifier(n_neighbors=k).fit(proto_points, proto_labels)
+
+
+def _score_fold(task):
+    from sklearn.metrics import roc_auc_score
+    from sklearn.neighbors import KNeighborsClassifier
+    from preprocessing import Preprocessor
+
+    X, y, train, test, features, zero_as_missing, n_neighbors, fraction = task
+    preprocessor = Preprocessor.fit(X[train], features, zero_as_missing)
+    X_train = preprocessor.transform(X[train])
+    X_test = preprocessor.transform(X[test])
+    full = KNeighborsClassifier(n_neighbors=n_neighbors).fit(X_train, y[train])
+    reduced = fit_reduced(X_train, y[train], n_neighbors, fraction)
+
+    full_proba = full.predict_proba(X_test)
+    reduced_proba = reduced.predict_proba(X_test)
+    full_pred = full.classes_[full_proba.argmax(axis=1)]
+    reduced_pred = reduced.classes_[reduced_proba.argmax(axis=1)]
+    return {
+        'agreement': float((full_pred == reduced_pred).mean()),
+        'accuracy': float((reduced_pred == y[test]).mean()),
+        'full_accuracy': float((full_pred == y[test]).mean()),
+        'auc': float(roc_auc_score(y[test], reduced_proba[:, 1])),
+    }
+
+
+def evaluate(X, y, features, zero_as_missing, n_neighbors, fraction=DEFAULT_FRACTION,
+             n_splits=5, n_jobs=None, seed=42, data_checksum=None):
+    """
+    Held-out comparison of the reduced and full models on the same folds as
+    evaluation.cross_validate(). Returns a metrics dict in the same shape,
+    plus agreement with the full model and the reference set sizes.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    splits = evaluation.fold_splits(y, n_splits, seed, data_checksum)
+    tasks = [(X, y, train, test, features, zero_as_missing, n_neighbors, fraction)
+             for train, test in splits]
+
+    workers = min(n_jobs or os.cpu_count() or 1, len(tasks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            folds = list(pool.map(_score_fold, tasks))
+    else:
+        folds = [_score_fold(task) for task in tasks]
+
+    accuracy, accuracy_ci = evaluation.mean_ci([f['accuracy'] for f in folds])
+    auc, auc_ci = evaluation.mean_ci([f['auc'] for f in folds])
+    agreement, agreement_ci = evaluation.mean_ci([f['agreement'] for f in folds])
+    return {
+        'accuracy': accuracy,
+        'accuracy_ci': accuracy_ci,
+        'auc': auc,
+        'auc_ci': auc_ci,
+        'agreement': agreement,
+        'agreement_ci': agreement_ci,
+        'full_accuracy': float(np.mean([f['full_accuracy'] for f in folds])),
+        'fraction': fraction,
+        'cv_folds': n_splits,
+        'cv_seed': seed,
+        'n_samples': int(len(y)),
+    }
+
+
+def main(argv=None):
+    import model_store
+
+    parser = argparse.ArgumentParser(description="Agreement of prototype-reduced KNN models.")
+    parser.add_argument('--data', default=model_store.DATA_FILE)
+    parser.add_argument('--fractions', type=float, nargs='+', default=[0.02, 0.05, 0.1, 0.2])
+    parser.add_argument('--cv-folds', type=int, default=5)
+    parser.add_argument('--jobs', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    X, y = model_store.read_dataset(args.data)
+    checksum = model_store.dataset_checksum(args.data)
+    print(f"{'fraction':>9}{'rows':>10}{'agreement':>11}{'accuracy':>10}{'full acc':>10}{'auc':>8}")
+    for fraction in args.fractions:
+        m = evaluate(X, y, model_store.FEATURES, model_store.ZERO_AS_MISSING, model_store.N_NEIGHBORS,
+                     fraction, args.cv_folds, args.jobs, data_checksum=checksum)
+        rows = int(round(len(y) * (args.cv_folds - 1) / args.cv_folds * fraction))
+        print(f"{fraction:>9.3f}{rows:>10}{m['agreement']:>11.4f}"
+              f"{m['accuracy']:>10.4f}{m['full_accuracy']:>10.4f}{m['auc']:>8.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""
+Ensemble serving: the KNN plus other registered models, scored concurrently.
+
+model.py trains a linear SVC on Glucose, Insulin, BMI and Age that was never
+served. fit_linear_svc() trains the same model in the build step (on the
+shared preprocessing, with Platt-scaled probabilities from out-of-fold
+decision values) and stores it in the artifact as a JSON-serializable
+member, served by the pure-NumPy LinearModel. MEMBER_KINDS maps a member's
+'kind' to its loader, so further model types only need an entry there.
+
+Ensemble.predict() submits every member to a shared thread pool and waits
+at most budget_ms. Members that finished are combined with their weights,
+renormalized; the rest are left out of that result ('partial'), so adding
+members cannot push latency past the budget. A member still running from
+earlier requests MAX_STRAGGLERS times is skipped until it catches up, so a
+stuck member cannot fill the pool; the first member (the KNN) always runs.
+If nothing finished within the budget the first member to finish is used.
+
+Enable with MODEL_ENSEMBLE=1; ENSEMBLE_WEIGHTS="knn=2,svc=1" and
+ENSEMBLE_BUDGET_MS=25 configure it.
+"""
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from model_store import SVC_FEATURES
+
+# The kernel SVC is quadratic in the rows, so larger datasets are sampled
+LINEAR_MAX_ROWS = 20000
+MAX_STRAGGLERS = 2
+
+
+class LinearModel:
+    """A linear decision function on a subset of the features, with Platt-scaled probabilities."""
+
+    def __init__(self, features, columns, preprocessor, coef, intercept, platt, classes,
+                 metrics=None):
+        from preprocessing import Preprocessor
+
+        self.features = list(features)
+        self.columns = list(columns)
+        self._index = [self.features.index(c) for c in self.columns]
+        self.preprocessor = (preprocessor if isinstance(preprocessor, Preprocessor)
+                             else Preprocessor.from_dict(preprocessor))
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+        self.platt = [float(v) for v in platt]
+        self.classes = np.asarray(classes)
+        self.metrics = metrics
+
+    def decision_function(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        scaled = self.preprocessor.transform(X[:, self._index])
+        return scaled @ self.coef + self.intercept, scaled
+
+    def predict(self, X):
+        """Same result dict as the KNN engines, for raw rows of all features."""
+        decision, _ = self.decision_function(X)
+        positive = 1.0 / (1.0 + np.exp(-(self.platt[0] * decision + self.platt[1])))
+        probabilities = np.column_stack([1.0 - positive, positive])
+        return {
+            'predictions': self.classes[probabilities.argmax(axis=1)],
+            'probabilities': probabilities,
+        }
+
+    def predict_one(self, input_values):
+        result = self.predict([input_values])
+        return result['predictions'][0], result['probabilities'][0]
+
+    def to_dict(self):
+        return {
+            'kind': 'linear',
+            'features': self.features,
+            'columns': self.columns,
+            'preprocessor': self.preprocessor.to_dict(),
+            'coef': self.coef.tolist(),
+            'intercept': self.intercept,
+            'platt': self.platt,
+            'classes': [int(c) for c in self.classes],
+            'metrics': self.metrics,
+        }
+
+    @classmethod
+    def from_dict(cls, params):
+        params = {k: v for k, v in params.items() if k != 'kind'}
+        return cls(**params)
+
+
+# Member 'kind' -> loader from the stored dict
+MEMBER_KINDS = {
+    'linear': LinearModel.from_dict,
+}
+
+
+def fit_linear_svc(X, y, features, zero_as_missing, columns=SVC_FEATURES, n_splits=5, seed=42,
+                   data_checksum=None):
+    """
+    model.py's linear SVC as a LinearModel, with held-out metrics. Platt
+    scaling is fitted on out-of-fold decision values, as SVC(probability=True)
+    does internally.
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import roc_auc_score
+    from sklearn.svm import SVC
+    import evaluation
+    from preprocessing import Preprocessor
+
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    if len(y) > LINEAR_MAX_ROWS:
+        keep = np.sort(np.random.default_rng(seed).choice(len(y), LINEAR_MAX_ROWS, replace=False))
+        X, y, data_checksum = X[keep], y[keep], None
+    X = X[:, [features.index(c) for c in columns]]
+    subset_missing = [c for c in zero_as_missing if c in columns]
+
+    def fit(rows):
+        preprocessor = Preprocessor.fit(X[rows], columns, subset_missing)
+        svc = SVC(kernel='linear', random_state=42).fit(preprocessor.transform(X[rows]), y[rows])
+        return preprocessor, svc
+
+    oof = np.empty(len(y))
+    accuracy, auc = [], []
+    for train, test in evaluation.fold_splits(y, n_splits, seed, data_checksum):
+        preprocessor, svc = fit(train)
+        oof[test] = svc.decision_function(preprocessor.transform(X[test]))
+        accuracy.append(float((svc.classes_[(oof[test] > 0).astype(int)] == y[test]).mean()))
+        auc.append(float(roc_auc_score(y[test], oof[test])))
+    platt = LogisticRegression(C=1e6).fit(oof[:, None], y)
+
+    preprocessor, svc = fit(np.arange(len(y)))
+    accuracy, accuracy_ci = evaluation.mean_ci(accuracy)
+    auc, auc_ci = evaluation.mean_ci(auc)
+    return LinearModel(
+        features, columns, preprocessor, svc.coef_[0], svc.intercept_[0],
+        [platt.coef_[0, 0], platt.intercept_[0]], svc.classes_,
+        metrics={'accuracy': accuracy, 'accuracy_ci': accuracy_ci, 'auc': auc, 'auc_ci': auc_ci,
+                 'cv_folds': n_splits, 'n_samples': int(len(y))},
+    )
+
+
+def parse_weights(spec):
+    """'knn=2,svc=1' -> {'knn': 2.0, 'svc': 1.0}; empty means equal weights."""
+    weights = {}
+    for part in filter(None, (p.strip() for p in (spec or '').split(','))):
+        name, _, value = part.partition('=')
+        weights[name.strip()] = float(value)
+    return weights
+
+
+def _classes(engine):
+    return [int(c) for c in getattr(engine, 'classes_', getattr(engine, 'classes', []))]
+
+
+class Ensemble:
+    """
+    Weighted average of member probabilities under a latency budget.
+
+    members maps a name to an engine with predict(X) -> the result dict of
+    inference.InferenceEngine. Same predict()/predict_one() interface as the
+    engines.
+    """
+
+    def __init__(self, members, weights=None, budget_ms=None, pool=None):
+        self.members = dict(members)
+        weights = weights or {}
+        unknown = set(weights) - set(self.members)
+        if unknown:
+            raise ValueError(f"weights for unknown ensemble members: {', '.join(sorted(unknown))}")
+        self.weights = {name: float(weights.get(name, 1.0)) for name in self.members}
+        classes = {tuple(_classes(engine)) for engine in self.members.values()}
+        if len(classes) != 1:
+            raise ValueError("ensemble members predict different classes")
+        self.classes = np.asarray(classes.pop())
+        self.budget_s = budget_ms / 1000 if budget_ms else None
+        self.pool = pool or ThreadPoolExecutor(max_workers=2 * len(self.members),
+                                               thread_name_prefix='ensemble')
+        self._lock = threading.Lock()
+        self._stragglers = {name: 0 for name in self.members}
+        self._stats = {name: {'finished': 0, 'late': 0, 'skipped': 0, 'errors': 0}
+                       for name in self.members}
+        self._partial = 0
+        self._requests = 0
+
+    def _straggler_done(self, name):
+        def done(_):
+            with self._lock:
+                self._stragglers[name] -= 1
+        return done
+
+    def predict(self, X):
+        """
+        Score raw rows X. The result dict also holds 'members', the names
+        that contributed, and 'partial', True when some were left out.
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        futures = {}
+        with self._lock:
+            self._requests += 1
+            for i, (name, engine) in enumerate(self.members.items()):
+                # The first member always runs, so there is a result to return
+                if i and self._stragglers[name] >= MAX_STRAGGLERS:
+                    self._stats[name]['skipped'] += 1
+                    continue
+                futures[self.pool.submit(engine.predict, X)] = name
+
+        done, pending = wait(futures, timeout=self.budget_s)
+        if not done:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+        results = {}
+        with self._lock:
+            for future in pending:
+                self._stats[futures[future]]['late'] += 1
+                self._stragglers[futures[future]] += 1
+                future.add_done_callback(self._straggler_done(futures[future]))
+            for future in done:
+                name = futures[future]
+                if future.exception() is None:
+                    results[name] = future.result()
+                    self._stats[name]['finished'] += 1
+                else:
+                    self._stats[name]['errors'] += 1
+            if len(results) < len(self.members):
+                self._partial += 1
+        if not results:
+            raise next(iter(done)).exception()
+
+        names = [name for name in self.members if name in results]
+        weights = np.array([self.weights[name] for name in names])
+        probabilities = sum(w * results[name]['probabilities'] for w, name in zip(weights, names))
+        probabilities = probabilities / weights.sum()
+        return {
+            'predictions': self.classes[probabilities.argmax(axis=1)],
+            'probabilities': probabilities,
+            'members': names,
+            'partial': len(names) < len(self.members),
+        }
+
+    def predict_one(self, input_values):
+        result = self.predict([input_values])
+        return result['predictions'][0], result['probabilities'][0]
+
+    def status(self):
+        with self._lock:
+            return {
+                'members': {name: dict(self._stats[name], weight=self.weights[name])
+                            for name in self.members},
+                'budget_ms': self.budget_s * 1000 if self.budget_s else None,
+                'requests': self._requests,
+                'partial_results': self._partial,
+            }
+
+
+def build(artifact, primary, weights=None, budget_ms=None, pool=None):
+    """
+    Ensemble of an artifact's primary engine (as 'knn') and its stored
+    members. Raises ValueError when the artifact has no members.
+    """
+    stored = artifact.get('members') or {}
+    if not stored:
+        raise ValueError("the model has no ensemble members; rebuild it with `python model_store.py build`")
+    members = {'knn': primary}
+    for name, params in stored.items():
+        members[name] = MEMBER_KINDS[params['kind']](params)
+    return Ensemble(members, weights, budget_ms, pool)
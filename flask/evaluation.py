@@ -0,0 +1,115 @@
+"""
+Held-out evaluation for the training pipeline.
+
+cross_validate() runs stratified k-fold cross-validation with one process
+per fold. The preprocessor (imputation means and scaler bounds) is fitted
+on each training fold only, so the reported accuracy and AUC reflect
+unseen patients. Fold splits are cached on disk, keyed by the data
+checksum, so repeated builds and tuning runs score the exact same folds.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cv_cache')
+
+
+def fold_splits(y, n_splits=5, seed=42, data_checksum=None):
+    """Stratified (train_idx, test_idx) pairs, cached when data_checksum is given."""
+    from sklearn.model_selection import StratifiedKFold
+
+    cache_path = None
+    if data_checksum:
+        cache_path = os.path.join(CACHE_DIR, f"folds-{data_checksum[:16]}-k{n_splits}-s{seed}.npz")
+        if os.path.exists(cache_path):
+            cached = np.load(cache_path)
+            return [(cached[f'train{i}'], cached[f'test{i}']) for i in range(n_splits)]
+
+    skf = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed)
+    splits = list(skf.split(np.zeros(len(y)), y))
+
+    if cache_path:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        arrays = {}
+        for i, (train, test) in enumerate(splits):
+            arrays[f'train{i}'] = train
+            arrays[f'test{i}'] = test
+        np.savez(cache_path, **arrays)
+    return splits
+
+
+def _score_fold(task):
+    from sklearn.metrics import roc_auc_score
+    from sklearn.neighbors import KNeighborsClassifier
+    from preprocessing import Preprocessor
+
+    X, y, train, test, features, zero_as_missing, params = task
+    preprocessor = Preprocessor.fit(X[train], features, zero_as_missing)
+    knn = KNeighborsClassifier(**params).fit(preprocessor.transform(X[train]), y[train])
+    proba_all = knn.predict_proba(preprocessor.transform(X[test]))
+    predictions = knn.classes_[proba_all.argmax(axis=1)]
+    proba = proba_all[:, 1]
+    return {
+        'accuracy': float((predictions == y[test]).mean()),
+        'auc': float(roc_auc_score(y[test], proba)),
+        'test': test,
+        'proba': proba,
+    }
+
+
+def mean_ci(values, confidence=0.95):
+    """Mean and t-distribution confidence interval across folds."""
+    from scipy import stats
+
+    values = np.asarray(values, dtype=np.float64)
+    mean = float(values.mean())
+    if len(values) < 2:
+        return mean, [mean, mean]
+    half = stats.t.ppf((1 + confidence) / 2, len(values) - 1) * values.std(ddof=1) / np.sqrt(len(values))
+    return mean, [float(mean - half), float(mean + half)]
+
+
+def cross_validate(X, y, features, zero_as_missing, params, n_splits=5, n_jobs=None, seed=42,
+                   data_checksum=None, return_oof=False):
+    """
+    Cross-validate a KNN on raw features X (zeros still present).
+
+    Returns a metrics dict: mean accuracy and AUC across folds with 95%
+    confidence intervals, per-fold values and the pooled out-of-fold AUC.
+    With return_oof, returns (metrics, out-of-fold positive-class probabilities).
+    """
+    from sklearn.metrics import roc_auc_score
+
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    splits = fold_splits(y, n_splits, seed, data_checksum)
+    tasks = [(X, y, train, test, features, zero_as_missing, params) for train, test in splits]
+
+    workers = min(n_jobs or os.cpu_count() or 1, len(tasks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            folds = list(pool.map(_score_fold, tasks))
+    else:
+        folds = [_score_fold(task) for task in tasks]
+
+    oof = np.empty(len(y))
+    for fold in folds:
+        oof[fold['test']] = fold['proba']
+
+    accuracy, accuracy_ci = mean_ci([f['accuracy'] for f in folds])
+    auc, auc_ci = mean_ci([f['auc'] for f in folds])
+    metrics = {
+        'accuracy': accuracy,
+        'accuracy_ci': accuracy_ci,
+        'auc': auc,
+        'auc_ci': auc_ci,
+        'oof_auc': float(roc_auc_score(y, oof)),
+        'fold_accuracy': [f['accuracy'] for f in folds],
+        'fold_auc': [f['auc'] for f in folds],
+        'cv_folds': n_splits,
+        'cv_seed': seed,
+        'n_samples': int(len(y)),
+    }
+    return (metrics, oof) if return_oof else metrics
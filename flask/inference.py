@@ -0,0 +1,84 @@
+"""
+Single-pass KNN inference.
+
+The classifier's predict() and predict_proba() each run their own
+neighbor search. InferenceEngine runs the search once per input and derives
+the class and the class probabilities from that one result. With a
+calibration table (calibration.py), the probabilities of a uniform-vote
+model are looked up by positive vote count. Feature importance comes from
+attribution.Attributor, which wraps any engine.
+"""
+
+import numpy as np
+
+
+class InferenceEngine:
+    """
+    Wraps a fitted preprocessing.Preprocessor and scikit-learn KNN model.
+    calibration is None or the positive-class probability for each count of
+    positive votes (n_neighbors + 1 values).
+    """
+
+    def __init__(self, model, preprocessor, calibration=None):
+        self.model = model
+        self.preprocessor = preprocessor
+        self.classes = np.asarray(model.classes_)
+        # Neighbor labels encoded as indices into classes
+        self.labels = np.asarray(model._y)
+        self.distance_weighted = getattr(model, 'weights', 'uniform') == 'distance'
+        self.calibration = calibration_table(calibration, self.classes, model.n_neighbors,
+                                             self.distance_weighted)
+
+    def predict(self, X):
+        """
+        Score a 2-D array of raw feature rows (zeros are imputed here).
+
+        Returns a dict of arrays: 'predictions' (n,) and 'probabilities'
+        (n, n_classes).
+        """
+        scaled = self.preprocessor.transform(X)
+        distances, indices = self.model.kneighbors(scaled)
+
+        votes = self.labels[indices]
+        if self.calibration is not None:
+            probabilities = calibrated_probabilities(self.calibration, votes)
+        else:
+            weights = 1 / (distances + 1e-10) if self.distance_weighted else np.ones_like(distances)
+            probabilities = np.zeros((len(votes), len(self.classes)))
+            for c in range(len(self.classes)):
+                probabilities[:, c] = (weights * (votes == c)).sum(axis=1)
+            probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+        return {
+            'predictions': self.classes[probabilities.argmax(axis=1)],
+            'probabilities': probabilities,
+        }
+
+    def predict_one(self, input_values):
+        """Score a single row. Returns (prediction, probabilities)."""
+        result = self.predict([input_values])
+        return result['predictions'][0], result['probabilities'][0]
+
+
+def calibration_table(table, classes, n_neighbors, distance_weighted):
+    """table as an array when it applies to the model, else None."""
+    if table is None or distance_weighted or len(classes) != 2:
+        return None
+    table = np.asarray(table, dtype=np.float64)
+    if len(table) != n_neighbors + 1:
+        raise ValueError(f"calibration table has {len(table)} entries for {n_neighbors} neighbors")
+    return table
+
+
+def calibrated_probabilities(table, votes):
+    """(n, 2) probabilities from (n, k) neighbor class indices and a calibration table."""
+    positive = table[np.count_nonzero(votes, axis=1)]
+    return np.column_stack([1.0 - positive, positive])
+
+
+def engine_for(artifact):
+    """Serving engine for a loaded artifact: its NumPy engine, or one wrapping the sklearn model."""
+    if 'engine' in artifact:
+        return artifact['engine']
+    calibration = artifact.get('calibration') or {}
+    return InferenceEngine(artifact['model'], artifact['preprocessor'], calibration.get('table'))
@@ -0,0 +1,346 @@
+"""
+Zero-copy, memory-mapped model format for the KNN reference set.
+
+Export the pickled artifact once:
+
+    python mmap_store.py export
+
+This writes a directory of raw aligned .npy arrays (preprocessed training
+points and encoded labels) plus meta.json, which also holds the
+preprocessor parameters. load_mmap() opens the
+arrays with numpy.memmap, so every worker on a host shares the same physical
+pages from the OS page cache and loading costs only a few syscalls. The
+arrays are served by numpy_engine.NumpyKNN, without scikit-learn.
+
+`export --ann-lists N` also builds an approximate (IVF) index: the points
+are stored grouped by list, with the centroids and list offsets next to
+them. It is used only when load_mmap() is given n_probe > 0.
+
+The artifact's prototype-reduced model (condense.py) is exported alongside
+as reduced_*.npy and served instead of the full set with reduced=True.
+
+stream_train.py writes the same layout directly from a dataset too large to
+train in memory; such exports record the dataset in meta['trained_from']
+and have no pickle, ANN index or reduced model.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+import model_store
+import ann_index
+from numpy_engine import NumpyKNN, arrays_from_sklearn
+from preprocessing import Preprocessor
+
+MMAP_DIR = os.path.join(model_store.BASE_DIR, 'improved_model.mmap')
+MMAP_FORMAT = 8
+
+
+def staging_dir(out_dir):
+    """
+    New private directory next to out_dir to write an export into. Exports
+    are built there and swapped in by publish(), so readers never see a mix
+    and concurrent exporters never share files.
+    """
+    parent = os.path.dirname(os.path.abspath(out_dir))
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix=os.path.basename(out_dir) + '.', suffix='.tmp')
+    os.chmod(tmp_dir, 0o755)
+    return tmp_dir
+
+
+def write_meta(out_dir, meta):
+    """Atomically replace out_dir/meta.json."""
+    tmp_path = os.path.join(out_dir, 'meta.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=4)
+    os.replace(tmp_path, os.path.join(out_dir, 'meta.json'))
+
+
+def publish(tmp_dir, out_dir, meta):
+    """
+    Write meta.json into a staging_dir() and swap it in as out_dir, under
+    model_store.build_lock(out_dir). out_dir briefly does not exist during
+    the swap; load_mmap() waits for the lock before acting on a missing one.
+    """
+    write_meta(tmp_dir, meta)
+    with model_store.build_lock(out_dir):
+        if os.path.exists(out_dir):
+            old_dir = out_dir + '.old'
+            shutil.rmtree(old_dir, ignore_errors=True)
+            os.replace(out_dir, old_dir)
+            os.replace(tmp_dir, out_dir)
+            shutil.rmtree(old_dir)
+        else:
+            os.replace(tmp_dir, out_dir)
+
+
+class AppendedRowsError(model_store.ModelArtifactError):
+    """Raised when an export would drop rows appended by model_update.py."""
+
+
+def appended_rows_lost(meta, artifact):
+    """
+    Why replacing the export described by meta with one from the pickled
+    artifact would drop rows appended to it (model_update.py), or None.
+    """
+    appended = (meta or {}).get('appended')
+    if not appended:
+        return None
+    if appended.get('unsaved_rows', appended['rows']):
+        return (f"{appended.get('unsaved_rows', appended['rows'])} rows appended with --no-data "
+                f"exist only in the current export")
+    if artifact.get('data_checksum') != appended.get('data_checksum'):
+        return (f"the pickle was not built from the training data holding the {appended['rows']} "
+                f"rows appended to the current export; rebuild it first")
+    return None
+
+
+def export_mmap(artifact, out_dir=MMAP_DIR, artifact_path=model_store.ARTIFACT_FILE, ann_lists=0,
+                force=False):
+    """
+    Write the reference set of a pickled artifact as memory-mappable arrays,
+    with an IVF index of ann_lists lists when ann_lists > 0. Raises
+    AppendedRowsError rather than drop rows appended to the current export,
+    unless force.
+    """
+    with model_store.build_lock(out_dir):
+        if not force:
+            try:
+                with open(os.path.join(out_dir, 'meta.json')) as f:
+                    current = json.load(f)
+            except (OSError, ValueError):
+                current = None
+            lost = appended_rows_lost(current, artifact)
+            if lost:
+                raise AppendedRowsError(lost)
+        return _export_mmap(artifact, out_dir, artifact_path, ann_lists)
+
+
+def _export_mmap(artifact, out_dir, artifact_path, ann_lists):
+    knn = artifact['model']
+    arrays = arrays_from_sklearn(knn)
+    if ann_lists:
+        order, centroids, offsets = ann_index.build_ivf(arrays['points'], ann_lists)
+        arrays = {name: arr[order] for name, arr in arrays.items()}
+        arrays['ivf_centroids'] = centroids
+        arrays['ivf_offsets'] = offsets
+    reduced = artifact.get('reduced')
+    if reduced:
+        for name, arr in arrays_from_sklearn(reduced['model']).items():
+            arrays['reduced_' + name] = arr
+    meta = {
+        'format': MMAP_FORMAT,
+        'features': artifact['features'],
+        'classes': [int(c) for c in knn.classes_],
+        'n_neighbors': int(knn.n_neighbors),
+        'weights': knn.weights,
+        'metrics': artifact['metrics'],
+        'preprocessor': artifact['preprocessor'].to_dict(),
+        'checksum': artifact['checksum'],
+        'data_size': artifact.get('data_size'),
+        'data_mtime': artifact.get('data_mtime'),
+        'data_checksum': artifact.get('data_checksum'),
+        'n_rows': len(arrays['labels']),
+        'ann_lists': len(arrays['ivf_offsets']) - 1 if ann_lists else 0,
+        'reduced': None,
+        'members': artifact.get('members') or {},
+        'calibration': artifact.get('calibration'),
+    }
+    if reduced:
+        meta['reduced'] = {
+            'n_neighbors': int(reduced['model'].n_neighbors),
+            'weights': reduced['model'].weights,
+            'metrics': reduced['metrics'],
+            'checksum': reduced['checksum'],
+        }
+    if os.path.exists(artifact_path):
+        # Lets load_mmap() notice a rebuilt pickle without unpickling it
+        stat = os.stat(artifact_path)
+        meta['source_size'] = stat.st_size
+        meta['source_mtime'] = stat.st_mtime
+
+    tmp_dir = staging_dir(out_dir)
+    try:
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp_dir, name + '.npy'), arr)
+        publish(tmp_dir, out_dir, meta)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return meta
+
+
+def read_meta(mmap_dir=MMAP_DIR):
+    """meta.json of an export, without opening its arrays."""
+    meta_path = os.path.join(mmap_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        raise model_store.ModelArtifactError(f"memory-mapped model not found: {mmap_dir}")
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get('format') != MMAP_FORMAT:
+        raise model_store.ModelArtifactError("memory-mapped model format is outdated")
+    return meta
+
+
+def read_mmap(mmap_dir=MMAP_DIR, n_probe=0, reduced=False):
+    """
+    Open an exported model. Returns a dict shaped like the pickled artifact.
+    n_probe > 0 searches the export's IVF index, probing that many lists;
+    reduced=True serves the prototype-reduced reference set instead.
+    """
+    meta = read_meta(mmap_dir)
+
+    def _open(name):
+        return np.load(os.path.join(mmap_dir, name + '.npy'), mmap_mode='r')
+
+    artifact = dict(meta)
+    artifact['preprocessor'] = Preprocessor.from_dict(meta['preprocessor'])
+    if reduced:
+        if not meta.get('reduced'):
+            raise model_store.ModelArtifactError("memory-mapped model has no reduced model")
+        if n_probe:
+            raise ValueError("the ANN index covers the full reference set, not the reduced one")
+        artifact.update(metrics=meta['reduced']['metrics'], checksum=meta['reduced']['checksum'],
+                        calibration=None)
+        artifact['engine'] = NumpyKNN(
+            _open('reduced_points'), _open('reduced_sq_norms'), _open('reduced_labels'),
+            artifact['preprocessor'], meta['classes'], meta['reduced']['n_neighbors'],
+            meta['reduced']['weights'],
+        )
+        return artifact
+
+    index = None
+    if n_probe:
+        if not meta.get('ann_lists'):
+            raise model_store.ModelArtifactError("memory-mapped model has no ANN index")
+        index = ann_index.IVFIndex(np.array(_open('ivf_centroids')), np.array(_open('ivf_offsets')),
+                                   n_probe)
+    # The files may hold rows appended after meta.json was read (model_update.py)
+    rows = slice(meta.get('n_rows'))
+    artifact['engine'] = NumpyKNN(
+        _open('points')[rows], _open('sq_norms')[rows], _open('labels')[rows], artifact['preprocessor'],
+        meta['classes'], meta['n_neighbors'], meta['weights'], index,
+        (meta.get('calibration') or {}).get('table'),
+    )
+    return artifact
+
+
+def source_stale_reason(meta, artifact_path=model_store.ARTIFACT_FILE):
+    """Whether the pickled artifact changed since this export was written."""
+    if meta.get('trained_from'):
+        # Trained straight into this format by stream_train.py, not exported
+        return None
+    if not os.path.exists(artifact_path):
+        # Deployed with the export only
+        return None
+    stat = os.stat(artifact_path)
+    if stat.st_size != meta.get('source_size') or stat.st_mtime != meta.get('source_mtime'):
+        return f"{os.path.basename(artifact_path)} was rebuilt since the export"
+    return None
+
+
+def load_mmap(mmap_dir=MMAP_DIR, data_path=model_store.DATA_FILE, strict=False,
+              artifact_path=model_store.ARTIFACT_FILE, n_probe=0, reduced=False):
+    """
+    Load the memory-mapped model, exporting it first unless strict. With
+    n_probe > 0 the export is (re)built with an ANN index if it lacks one.
+    Exports trained by stream_train.py are retrained from their dataset when
+    stale and never replaced by an export of the pickle; they have no ANN
+    index or reduced model, so asking for either raises ModelArtifactError.
+    Exporters and loaders that find the export missing or stale serialize on
+    model_store.build_lock(mmap_dir) and check again once they hold it.
+    """
+    def _read():
+        # meta.json alone says whether the export is stale and where it was
+        # trained from, whether or not it has the parts n_probe/reduced need
+        try:
+            meta = read_meta(mmap_dir)
+        except (model_store.ModelArtifactError, FileNotFoundError) as e:
+            return None, None, str(e)
+        reason = (model_store.data_stale_reason(meta, meta.get('trained_from') or data_path)
+                  or source_stale_reason(meta, artifact_path))
+        try:
+            artifact = read_mmap(mmap_dir, n_probe, reduced)
+        except (model_store.ModelArtifactError, FileNotFoundError) as e:
+            return meta, None, reason or str(e)
+        return artifact, artifact, reason
+
+    meta, artifact, reason = _read()
+    if reason is None:
+        return artifact
+    with model_store.build_lock(mmap_dir):
+        # A missing export may be mid-publish, and another worker may have
+        # rebuilt a stale one while this one waited: look again
+        meta, artifact, reason = _read()
+        if reason is None:
+            return artifact
+        trained_from = (meta or {}).get('trained_from')
+        if trained_from and (n_probe or reduced):
+            raise model_store.ModelArtifactError(
+                f"{mmap_dir} was trained by stream_train.py from {trained_from} and has no "
+                f"{'ANN index' if n_probe else 'reduced model'}; load it with n_probe=0 and reduced=False")
+        if strict:
+            command = (f"python stream_train.py --data {trained_from} --out {mmap_dir}" if trained_from
+                       else "python mmap_store.py export")
+            raise model_store.ModelArtifactError(f"{reason}. Run `{command}` first.")
+        if trained_from:
+            import stream_train
+            unsaved = (meta.get('appended') or {}).get('unsaved_rows')
+            if unsaved and artifact is not None:
+                warnings.warn(f"Not retraining memory-mapped model ({reason}): {unsaved} rows appended "
+                              f"with --no-data exist only in the current export")
+                return artifact
+            warnings.warn(f"Retraining memory-mapped model from {trained_from}: {reason}")
+            stream_train.train_streaming(trained_from, mmap_dir)
+            return read_mmap(mmap_dir, n_probe, reduced)
+        warnings.warn(f"Re-exporting memory-mapped model: {reason}")
+        source = model_store.load_model(artifact_path, data_path)
+        ann_lists = ann_index.default_lists(len(source['model']._fit_X)) if n_probe else 0
+        try:
+            export_mmap(source, mmap_dir, artifact_path, ann_lists)
+        except AppendedRowsError as e:
+            if artifact is None:
+                raise
+            # Keep serving the export rather than lose its appended rows
+            warnings.warn(f"Not re-exported: {e}")
+            return artifact
+        return read_mmap(mmap_dir, n_probe, reduced)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the model as memory-mapped arrays.")
+    parser.add_argument('command', choices=['export'])
+    parser.add_argument('--artifact', default=model_store.ARTIFACT_FILE, help="pickled artifact")
+    parser.add_argument('--out', default=MMAP_DIR, help="output directory")
+    parser.add_argument('--ann-lists', type=int, default=0,
+                        help="build an IVF index with this many lists (0: none, -1: sqrt of rows)")
+    parser.add_argument('--force', action='store_true',
+                        help="replace the export even if that drops rows appended by model_update.py")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    artifact = model_store.read_artifact(args.artifact)
+    ann_lists = args.ann_lists
+    if ann_lists < 0:
+        ann_lists = ann_index.default_lists(len(artifact['model']._fit_X))
+    try:
+        meta = export_mmap(artifact, args.out, args.artifact, ann_lists, args.force)
+    except AppendedRowsError as e:
+        print(f"Not exported: {e}. Pass --force to drop them.")
+        return 1
+    print(f"Wrote {args.out} in {time.perf_counter() - start:.2f}s")
+    print(f"  checksum: {meta['checksum']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Hot-reloadable holder for the served model.
+
+A ModelRegistry keeps one immutable ServedModel (artifact, engine, version)
+as the current model. reload() loads a new artifact, validates it, warms it
+with probe predictions and only then swaps the reference, all off the
+request path. Request handlers take current() once and use that object for
+the whole request, so requests already in flight finish on the version they
+started with while new requests see the new one.
+
+Reloads are triggered by watch(), which polls the artifact files for
+changes, by SIGHUP when install_signal_handler() was called, or by calling
+reload() directly (the admin API does this).
+"""
+
+import os
+import signal
+import threading
+import time
+import warnings
+from datetime import datetime
+
+import numpy as np
+
+# Raw feature rows (model_store.FEATURES order) scored before a swap:
+# typical, all-missing and extreme inputs
+PROBE_ROWS = [
+    [148, 72, 35, 0, 33.6, 0.627, 50],
+    [85, 66, 29, 0, 26.6, 0.351, 31],
+    [0, 0, 0, 0, 0, 0, 21],
+    [199, 122, 99, 846, 67.1, 2.42, 81],
+]
+# Times the probe batch is scored; the first pass faults in mmap pages
+WARM_PASSES = 3
+
+
+class ServedModel:
+    """One loaded model version. Never mutated after construction."""
+
+    def __init__(self, artifact, engine):
+        self.artifact = artifact
+        self.engine = engine
+        self.version = artifact['checksum']
+        self.features = list(artifact['features'])
+        self.metrics = artifact['metrics']
+        self.loaded_at = datetime.now().isoformat(timespec='seconds')
+
+
+def file_signature(paths):
+    """(size, mtime) of every existing path; changes when a file is rewritten."""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            signature.append(None)
+        else:
+            signature.append((stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+class ModelRegistry:
+    """
+    Load, validate and atomically swap the served model.
+
+    loader() returns an artifact dict (as model_store.load_model() or
+    mmap_store.load_mmap() do); make_engine(artifact) returns its serving
+    engine. watch_paths are polled by watch() for changes.
+    """
+
+    def __init__(self, loader, make_engine, watch_paths=()):
+        self.loader = loader
+        self.make_engine = make_engine
+        self.watch_paths = list(watch_paths)
+        self._reload_lock = threading.Lock()
+        self._reloads = 0
+        self._failed_reloads = 0
+        self._last_error = None
+        self._watch_interval = None
+        self._signature = file_signature(self.watch_paths)
+        # Startup load is validated the same way, but failures propagate
+        self._current = self._prepare(self.loader())
+
+    def current(self):
+        """The served model. Hold on to the returned object for a whole request."""
+        return self._current
+
+    def _prepare(self, artifact, schema=None):
+        """Build, validate and warm a ServedModel. Raises ValueError if it is unusable."""
+        served = ServedModel(artifact, self.make_engine(artifact))
+        if schema is not None and served.features != schema:
+            raise ValueError(f"features changed from {schema} to {served.features}; restart to serve it")
+
+        probes = np.asarray(PROBE_ROWS, dtype=np.float64)[:, :len(served.features)]
+        for _ in range(WARM_PASSES):
+            result = served.engine.predict(probes)
+        probabilities = np.asarray(result['probabilities'])
+        if len(result['predictions']) != len(probes):
+            raise ValueError("probe predictions have the wrong length")
+        if not np.isfinite(probabilities).all() or not np.allclose(probabilities.sum(axis=1), 1.0):
+            raise ValueError("probe probabilities are not valid distributions")
+        return served
+
+    def reload(self):
+        """
+        Load the artifact again and swap it in if its version changed.
+
+        Returns the served version. On failure the current model keeps
+        serving, the error is recorded in status() and re-raised.
+        """
+        with self._reload_lock:
+            self._signature = file_signature(self.watch_paths)
+            old = self._current
+            try:
+                artifact = self.loader()
+                if artifact['checksum'] == old.version:
+                    return old.version
+                served = self._prepare(artifact, schema=old.features)
+            except Exception as e:
+                self._failed_reloads += 1
+                self._last_error = f"{type(e).__name__}: {e}"
+                raise
+            # A single reference assignment: readers see the old or the new model
+            self._current = served
+            self._reloads += 1
+            self._last_error = None
+            return served.version
+
+    def reload_in_background(self):
+        """Start reload() on a daemon thread. Returns the thread."""
+        def run():
+            try:
+                self.reload()
+            except Exception as e:
+                warnings.warn(f"Model reload failed, still serving {self._current.version[:12]}: {e}")
+        thread = threading.Thread(target=run, name='model-reload', daemon=True)
+        thread.start()
+        return thread
+
+    def watch(self, interval=5.0):
+        """Poll watch_paths every interval seconds and reload when they change."""
+        self._watch_interval = interval
+
+        def run():
+            while True:
+                time.sleep(interval)
+                if file_signature(self.watch_paths) != self._signature:
+                    try:
+                        self.reload()
+                    except Exception as e:
+                        warnings.warn(f"Model reload failed, still serving "
+                                      f"{self._current.version[:12]}: {e}")
+        threading.Thread(target=run, name='model-watch', daemon=True).start()
+
+    def install_signal_handler(self, signum=getattr(signal, 'SIGHUP', None)):
+        """Reload on a signal (SIGHUP by default). Returns False where unsupported."""
+        if signum is None:
+            return False
+        try:
+            signal.signal(signum, lambda *_: self.reload_in_background())
+        except ValueError:
+            # Not the main thread, e.g. imported by a threaded server
+            return False
+        return True
+
+    def status(self):
+        served = self._current
+        return {
+            'version': served.version,
+            'loaded_at': served.loaded_at,
+            'reloads': self._reloads,
+            'failed_reloads': self._failed_reloads,
+            'last_error': self._last_error,
+            'watch_interval_s': self._watch_interval,
+        }
@@ -0,0 +1,409 @@
+"""
+Versioned model artifact store for the diabetes KNN model.
+
+Training is a build step, run once whenever diabetes.csv changes:
+
+    python model_store.py build
+
+The web app only loads the resulting artifact with load_model(), so worker
+boot time does not grow with the size of the training set.
+"""
+
+import fcntl
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_FILE = os.path.join(BASE_DIR, 'diabetes.csv')
+ARTIFACT_FILE = os.path.join(BASE_DIR, 'improved_model.pkl')
+
+# Bump whenever the layout of the artifact dict changes.
+ARTIFACT_FORMAT = 9
+
+FEATURES = [
+    'Glucose',
+    'BloodPressure',
+    'SkinThickness',
+    'Insulin',
+    'BMI',
+    'DiabetesPedigreeFunction',
+    'Age'
+]
+# Columns where a zero means "not measured" and is replaced by the column mean
+ZERO_AS_MISSING = ['Glucose', 'BloodPressure', 'SkinThickness', 'Insulin', 'BMI']
+# model.py's SVC uses these four columns; the KNN lineage uses all seven
+SVC_FEATURES = ['Glucose', 'Insulin', 'BMI', 'Age']
+TARGET = 'Outcome'
+N_NEIGHBORS = 24
+# Share of training rows kept as k-means prototypes for the reduced model
+# (condense.py); 0 builds no reduced model
+PROTOTYPE_FRACTION = 0.1
+# Extra models stored for ensemble serving (ensemble.py)
+ENSEMBLE_MEMBERS = ['svc']
+# Vote-count calibration fitted on the CV folds (calibration.py); None
+# serves the raw vote fractions
+CALIBRATION = 'isotonic'
+
+
+class ModelArtifactError(Exception):
+    """Raised when the model artifact is missing, unreadable or stale."""
+
+
+_held_locks = threading.local()
+
+
+@contextmanager
+def build_lock(path):
+    """
+    Exclusive flock on path + '.lock', held while a process writes path. Every
+    worker can rebuild a missing or stale model at boot; this lets one build
+    while the others wait and then load its result. Reentrant within a
+    thread, so a holder can call functions that take the same lock.
+    """
+    held = _held_locks.__dict__.setdefault('paths', set())
+    key = os.path.abspath(path)
+    if key in held:
+        yield
+        return
+    with open(key + '.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_atomic(path, write):
+    """
+    Call write(f) on a private temp file next to path, then rename it over
+    path, so readers never see a partial file and concurrent writers never
+    share one.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _sklearn_version():
+    import sklearn
+    return sklearn.__version__
+
+
+def _fingerprint_file(data_path):
+    """The file whose size/mtime/checksum identify a dataset (meta.json for columnar)."""
+    import synth_data
+    if synth_data.is_columnar(data_path):
+        return os.path.join(data_path, 'meta.json')
+    return data_path
+
+
+def dataset_checksum(data_path=DATA_FILE):
+    """Checksum identifying a dataset, used to key cached folds."""
+    return file_checksum(_fingerprint_file(data_path))
+
+
+def read_dataset(data_path=DATA_FILE):
+    """
+    Raw FEATURES matrix (zeros still present) and labels from a CSV or a
+    columnar directory written by synth_data.py.
+    """
+    import synth_data
+
+    if synth_data.is_columnar(data_path):
+        columns = synth_data.read_columnar(data_path, FEATURES + [TARGET])
+        X = np.column_stack([np.asarray(columns[c], dtype=np.float64) for c in FEATURES])
+        return X, np.asarray(columns[TARGET])
+
+    import pandas as pd
+    dataset = pd.read_csv(data_path, usecols=FEATURES + [TARGET])
+    return dataset[FEATURES].to_numpy(dtype=np.float64), dataset[TARGET].to_numpy()
+
+
+def iter_dataset(data_path=DATA_FILE, chunk_size=100000):
+    """Like read_dataset(), but yields (X_raw, y) chunks of at most chunk_size rows."""
+    import synth_data
+
+    if synth_data.is_columnar(data_path):
+        columns = synth_data.read_columnar(data_path, FEATURES + [TARGET])
+        for start in range(0, len(columns[TARGET]), chunk_size):
+            X = np.column_stack([np.asarray(columns[c][start:start + chunk_size], dtype=np.float64)
+                                 for c in FEATURES])
+            yield X, np.asarray(columns[TARGET][start:start + chunk_size])
+        return
+
+    import pandas as pd
+    for chunk in pd.read_csv(data_path, usecols=FEATURES + [TARGET], chunksize=chunk_size):
+        yield chunk[FEATURES].to_numpy(dtype=np.float64), chunk[TARGET].to_numpy()
+
+
+def train_model(data_path=DATA_FILE, cv_folds=5, n_jobs=None, data_checksum=None,
+                prototype_fraction=PROTOTYPE_FRACTION, members=ENSEMBLE_MEMBERS,
+                calibration_method=CALIBRATION):
+    """
+    Fit the preprocessor and KNN classifier and evaluate them with
+    cross-validation.
+
+    Returns (model, preprocessor, features, metrics, reduced, members,
+    calibration), where preprocessor is the fitted
+    preprocessing.Preprocessor, metrics holds the held-out scores from
+    evaluation.cross_validate(), reduced is None or {'model', 'metrics'} for
+    the prototype-reduced KNN, members maps ensemble member names to their
+    stored parameters and calibration is None or the dict from
+    calibration.calibrate().
+    """
+    from sklearn.neighbors import KNeighborsClassifier
+    import evaluation
+    from preprocessing import Preprocessor
+
+    X_raw, y = read_dataset(data_path)
+    params = {'n_neighbors': N_NEIGHBORS, 'metric': 'minkowski', 'p': 2}
+
+    preprocessor = Preprocessor.fit(X_raw, FEATURES, ZERO_AS_MISSING)
+    knn = KNeighborsClassifier(**params)
+    knn.fit(preprocessor.transform(X_raw), y)
+
+    # Held-out metrics; folds refit the preprocessor on training rows only
+    metrics, oof = evaluation.cross_validate(X_raw, y, FEATURES, ZERO_AS_MISSING, params,
+                                             n_splits=cv_folds, n_jobs=n_jobs,
+                                             data_checksum=data_checksum, return_oof=True)
+
+    calibrated = None
+    if calibration_method and len(knn.classes_) == 2:
+        import calibration
+        # Out-of-fold vote fractions back to positive vote counts
+        votes = np.rint(oof * N_NEIGHBORS).astype(np.intp)
+        calibrated = calibration.calibrate(votes, y == knn.classes_[1], N_NEIGHBORS,
+                                           evaluation.fold_splits(y, cv_folds, data_checksum=data_checksum),
+                                           calibration_method)
+        # Serving predicts with the calibrated probabilities; report that rule's accuracy
+        metrics = calibration.served_metrics(metrics, calibrated)
+
+    reduced = None
+    if prototype_fraction:
+        import condense
+        reduced = {
+            'model': condense.fit_reduced(knn._fit_X, y, N_NEIGHBORS, prototype_fraction),
+            'metrics': condense.evaluate(X_raw, y, FEATURES, ZERO_AS_MISSING, N_NEIGHBORS,
+                                         prototype_fraction, n_splits=cv_folds, n_jobs=n_jobs,
+                                         data_checksum=data_checksum),
+        }
+
+    stored = {}
+    if 'svc' in members:
+        import ensemble
+        stored['svc'] = ensemble.fit_linear_svc(X_raw, y, FEATURES, ZERO_AS_MISSING, n_splits=cv_folds,
+                                                data_checksum=data_checksum).to_dict()
+    return knn, preprocessor, list(FEATURES), metrics, reduced, stored, calibrated
+
+
+def _data_fingerprint(data_path):
+    path = _fingerprint_file(data_path)
+    stat = os.stat(path)
+    return {
+        'data_size': stat.st_size,
+        'data_mtime': stat.st_mtime,
+        'data_checksum': file_checksum(path),
+    }
+
+
+def build_artifact(data_path=DATA_FILE, artifact_path=ARTIFACT_FILE, cv_folds=5, n_jobs=None,
+                   prototype_fraction=PROTOTYPE_FRACTION, members=ENSEMBLE_MEMBERS,
+                   calibration_method=CALIBRATION):
+    """Train the model and atomically write the artifact. Returns the artifact dict."""
+    with build_lock(artifact_path):
+        return _build_artifact(data_path, artifact_path, cv_folds, n_jobs, prototype_fraction, members,
+                               calibration_method)
+
+
+def _build_artifact(data_path, artifact_path, cv_folds=5, n_jobs=None, prototype_fraction=PROTOTYPE_FRACTION,
+                    members=ENSEMBLE_MEMBERS, calibration_method=CALIBRATION):
+    # Caller holds build_lock(artifact_path)
+    fingerprint = _data_fingerprint(data_path)
+    model, preprocessor, features, metrics, reduced, stored, calibrated = train_model(
+        data_path, cv_folds, n_jobs, fingerprint['data_checksum'], prototype_fraction, members,
+        calibration_method)
+
+    payload = pickle.dumps({'model': model, 'preprocessor': preprocessor.to_dict(),
+                            'features': features, 'members': stored,
+                            'calibration': calibrated and calibrated['table']})
+    artifact = {
+        'model': model,
+        'preprocessor': preprocessor,
+        'features': features,
+        'metrics': metrics,
+        'format': ARTIFACT_FORMAT,
+        'checksum': hashlib.sha256(payload).hexdigest(),
+        'sklearn_version': _sklearn_version(),
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'reduced': None,
+        'members': stored,
+        'calibration': calibrated,
+    }
+    if reduced is not None:
+        payload = pickle.dumps({'model': reduced['model'], 'preprocessor': preprocessor.to_dict(),
+                                'features': features})
+        artifact['reduced'] = dict(reduced, checksum=hashlib.sha256(payload).hexdigest())
+    artifact.update(fingerprint)
+
+    write_atomic(artifact_path, lambda f: pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL))
+    return artifact
+
+
+def reduced_view(artifact):
+    """The artifact with its prototype-reduced model, metrics and checksum in place of the full ones."""
+    reduced = artifact.get('reduced')
+    if not reduced:
+        raise ModelArtifactError("artifact has no reduced model; build with --prototypes > 0")
+    # The calibration table is fitted to the full model's votes
+    return dict(artifact, model=reduced['model'], metrics=reduced['metrics'],
+                checksum=reduced['checksum'], calibration=None)
+
+
+def stale_reason(artifact, data_path=DATA_FILE):
+    """Return why the artifact is stale, or None if it is up to date."""
+    if not isinstance(artifact, dict) or artifact.get('format') != ARTIFACT_FORMAT:
+        return "artifact format is outdated"
+    if artifact.get('sklearn_version') != _sklearn_version():
+        return (f"built with scikit-learn {artifact.get('sklearn_version')}, "
+                f"running {_sklearn_version()}")
+    return data_stale_reason(artifact, data_path)
+
+
+def data_stale_reason(fingerprint, data_path=DATA_FILE):
+    """Compare a stored data fingerprint with the training CSV on disk."""
+    if not os.path.exists(data_path):
+        # Deployed without training data: nothing to compare against
+        return None
+    path = _fingerprint_file(data_path)
+    stat = os.stat(path)
+    if stat.st_size == fingerprint.get('data_size') and stat.st_mtime == fingerprint.get('data_mtime'):
+        return None
+    if file_checksum(path) != fingerprint.get('data_checksum'):
+        return f"{os.path.basename(data_path)} changed since the artifact was built"
+    return None
+
+
+def read_artifact(artifact_path=ARTIFACT_FILE):
+    """Unpickle an artifact file without any freshness checks."""
+    if not os.path.exists(artifact_path):
+        raise ModelArtifactError(f"model artifact not found: {artifact_path}")
+    try:
+        with open(artifact_path, 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        raise ModelArtifactError(f"could not read model artifact {artifact_path}: {e}")
+
+
+def load_model(artifact_path=ARTIFACT_FILE, data_path=DATA_FILE, strict=False):
+    """
+    Load the model artifact for serving.
+
+    In strict mode a missing or stale artifact raises ModelArtifactError so
+    the worker refuses to start. Otherwise the artifact is rebuilt once with
+    a warning, which keeps local development working out of the box; workers
+    booting together take build_lock() and only the first one trains.
+    """
+    def _read():
+        try:
+            artifact = read_artifact(artifact_path)
+            return artifact, stale_reason(artifact, data_path)
+        except ModelArtifactError as e:
+            return None, str(e)
+
+    artifact, reason = _read()
+    if reason is None:
+        return artifact
+    if strict:
+        raise ModelArtifactError(f"{reason}. Run `python model_store.py build` first.")
+    with build_lock(artifact_path):
+        # Another worker may have rebuilt it while this one waited for the lock
+        artifact, reason = _read()
+        if reason is None:
+            return artifact
+        warnings.warn(f"Rebuilding model artifact: {reason}")
+        return _build_artifact(data_path, artifact_path)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or inspect the model artifact.")
+    parser.add_argument('command', choices=['build', 'check'])
+    parser.add_argument('--data', default=DATA_FILE, help="training CSV or columnar dataset directory")
+    parser.add_argument('--artifact', default=ARTIFACT_FILE, help="artifact path")
+    parser.add_argument('--cv-folds', type=int, default=5, help="cross-validation folds")
+    parser.add_argument('--jobs', type=int, default=None, help="parallel folds (default: all cores)")
+    parser.add_argument('--prototypes', type=float, default=PROTOTYPE_FRACTION,
+                        help="share of rows kept as prototypes for the reduced model (0: none)")
+    parser.add_argument('--members', nargs='*', default=ENSEMBLE_MEMBERS, choices=['svc'],
+                        help="ensemble members to build next to the KNN (none: just the KNN)")
+    parser.add_argument('--calibration', default=CALIBRATION, choices=['isotonic', 'platt', 'none'],
+                        help="calibration of the vote fractions (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        artifact = build_artifact(args.data, args.artifact, args.cv_folds, args.jobs, args.prototypes,
+                                  args.members, None if args.calibration == 'none' else args.calibration)
+        metrics = artifact['metrics']
+        print(f"Wrote {args.artifact} in {time.perf_counter() - start:.2f}s")
+        print(f"  checksum: {artifact['checksum']}")
+        print(f"  accuracy: {metrics['accuracy'] * 100:.2f}% "
+              f"(95% CI {metrics['accuracy_ci'][0] * 100:.2f}-{metrics['accuracy_ci'][1] * 100:.2f}%, "
+              f"{metrics['cv_folds']}-fold CV)")
+        print(f"  AUC:      {metrics['auc']:.3f} "
+              f"(95% CI {metrics['auc_ci'][0]:.3f}-{metrics['auc_ci'][1]:.3f})")
+        if artifact['calibration']:
+            import calibration
+            print(calibration.describe(artifact['calibration']))
+        if artifact['reduced']:
+            reduced = artifact['reduced']['metrics']
+            print(f"  reduced:  {len(artifact['reduced']['model']._fit_X)} prototypes, "
+                  f"accuracy {reduced['accuracy'] * 100:.2f}%, AUC {reduced['auc']:.3f}, "
+                  f"agrees with the full model on {reduced['agreement'] * 100:.2f}% of held-out rows")
+        for name, member in artifact['members'].items():
+            print(f"  {name + ':':<9} accuracy {member['metrics']['accuracy'] * 100:.2f}%, "
+                  f"AUC {member['metrics']['auc']:.3f} (ensemble member)")
+        return 0
+
+    try:
+        reason = stale_reason(read_artifact(args.artifact), args.data)
+    except ModelArtifactError as e:
+        reason = str(e)
+    if reason:
+        print(f"STALE: {reason}")
+        return 1
+    print("OK: artifact is up to date")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
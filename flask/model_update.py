@@ -0,0 +1,230 @@
+"""
+Append newly labeled rows to the served KNN reference set.
+
+A KNN model is its reference set, so confirmed diagnoses can be added
+without retraining. append_rows() preprocesses the new rows with the
+export's Preprocessor, appends them to points.npy, sq_norms.npy and
+labels.npy in place and replaces meta.json with the new row count and
+version checksum. The cost is proportional to the number of new rows, and
+the ModelRegistry watcher picks up the new meta.json like any other export.
+
+The write order keeps readers consistent: array data goes past the old end
+first, then the .npy headers, then meta.json. read_mmap() serves
+meta['n_rows'] rows, so a reader sees either the old or the new version; an
+interrupted append leaves bytes past the committed rows, which the next
+append truncates.
+
+The Preprocessor stays frozen between full rebuilds, since refitting it
+would rescale every stored row. Values outside its fitted min-max bounds
+(scaled outside [0, 1]) are handled by policy:
+
+    keep    store them as scaled, as serving treats out-of-range queries
+    clip    clip them to the fitted bounds
+    reject  refuse the whole batch
+
+The scaled range seen so far is tracked in meta['appended']; once it
+exceeds the fitted bounds by more than REBUILD_DRIFT, a full rebuild is
+due. Rows are also appended to the training CSV, so that rebuild includes
+them. Until then they exist only in the export: MODEL_FORMAT=pickle does
+not serve them, and mmap_store.export_mmap() refuses to replace an export
+whose appended rows the pickle lacks (see mmap_store.appended_rows_lost()).
+
+    python model_update.py confirmed.csv --policy clip
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+import model_store
+from mmap_store import MMAP_DIR, MMAP_FORMAT, write_meta
+from preprocessing import Preprocessor
+
+POLICIES = ('keep', 'clip', 'reject')
+# Share of a feature's fitted range the appended rows may exceed it by
+# before a full rebuild is recommended
+REBUILD_DRIFT = 0.1
+
+_HEADER_IO = {
+    (1, 0): (npy_format.read_array_header_1_0, npy_format.write_array_header_1_0),
+    (2, 0): (npy_format.read_array_header_2_0, npy_format.write_array_header_2_0),
+}
+
+
+def _append_npy(path, arr, n_rows):
+    """Write arr after the first n_rows rows of a .npy file, then rewrite its shape."""
+    with open(path, 'r+b') as f:
+        read_header, write_header = _HEADER_IO[npy_format.read_magic(f)]
+        shape, fortran_order, dtype = read_header(f)
+        data_start = f.tell()
+        if fortran_order or dtype != arr.dtype or tuple(shape[1:]) != arr.shape[1:]:
+            raise model_store.ModelArtifactError(f"{os.path.basename(path)} does not match the new rows")
+        header = io.BytesIO()
+        write_header(header, {'descr': npy_format.dtype_to_descr(dtype), 'fortran_order': False,
+                              'shape': (n_rows + len(arr),) + tuple(shape[1:])})
+        if header.tell() != data_start:
+            raise model_store.ModelArtifactError(
+                f"no room to grow the header of {os.path.basename(path)}; re-export the model")
+
+        # Anything past the committed rows is left over from an interrupted append
+        f.truncate(data_start + n_rows * dtype.itemsize * int(np.prod(shape[1:])))
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(arr).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+        f.seek(0)
+        f.write(header.getvalue())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _append_csv(data_path, rows):
+    """Append rows to a CSV, in its column order."""
+    with open(data_path, 'rb') as f:
+        columns = f.readline().decode().strip().split(',')
+        f.seek(-1, os.SEEK_END)
+        needs_newline = f.read(1) != b'\n'
+    missing = [c for c in columns if c not in rows.columns]
+    if missing:
+        raise ValueError(f"new rows are missing columns of {os.path.basename(data_path)}: {', '.join(missing)}")
+    with open(data_path, 'a', newline='') as f:
+        if needs_newline:
+            f.write('\n')
+        rows[columns].to_csv(f, header=False, index=False)
+
+
+def drifted_features(meta):
+    """Features whose appended values exceed the fitted range by more than REBUILD_DRIFT."""
+    appended = meta.get('appended')
+    if not appended:
+        return []
+    return [name for name, low, high in zip(meta['features'], appended['low'], appended['high'])
+            if low < -REBUILD_DRIFT or high > 1 + REBUILD_DRIFT]
+
+
+def append_rows(rows, mmap_dir=MMAP_DIR, policy='keep', data_path=None):
+    """
+    Append a DataFrame of labeled rows (FEATURES and TARGET columns) to the
+    exported reference set and publish the result as a new version. With
+    data_path, the rows are also appended to that training CSV.
+
+    Returns the new meta dict. Raises ValueError for rows the policy
+    rejects or labels the model does not know.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"unknown policy {policy!r}, expected one of {', '.join(POLICIES)}")
+    missing = [c for c in model_store.FEATURES + [model_store.TARGET] if c not in rows.columns]
+    if missing:
+        raise ValueError(f"new rows are missing columns: {', '.join(missing)}")
+    if data_path is not None and not os.path.isfile(data_path):
+        raise ValueError(f"new rows can only be appended to a CSV, not {data_path}")
+
+    # The export lock: appends never interleave with each other or with a publish()
+    with model_store.build_lock(mmap_dir):
+        with open(os.path.join(mmap_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('format') != MMAP_FORMAT:
+            raise model_store.ModelArtifactError("memory-mapped model format is outdated")
+        if meta.get('ann_lists'):
+            raise model_store.ModelArtifactError(
+                "the export has an ANN index, whose lists cannot take new rows; rebuild it instead")
+        labels_path = os.path.join(mmap_dir, 'labels.npy')
+        n_rows = meta.get('n_rows') or len(np.load(labels_path, mmap_mode='r'))
+
+        y = rows[model_store.TARGET].to_numpy()
+        unknown = sorted(set(y.tolist()) - set(meta['classes']))
+        if unknown:
+            raise ValueError(f"unknown {model_store.TARGET} values: {unknown}")
+        points = Preprocessor.from_dict(meta['preprocessor']).transform(
+            rows[meta['features']].to_numpy(dtype=np.float64))
+        out_of_range = (points < 0) | (points > 1)
+        outside = out_of_range.any(axis=1)
+        if policy == 'reject' and outside.any():
+            columns = [f for f, bad in zip(meta['features'], out_of_range.any(axis=0)) if bad]
+            raise ValueError(f"{int(outside.sum())} rows are outside the fitted range of "
+                             f"{', '.join(columns)}; use --policy keep or clip, or rebuild")
+        low, high = points.min(axis=0, initial=np.inf), points.max(axis=0, initial=-np.inf)
+        if policy == 'clip':
+            np.clip(points, 0.0, 1.0, out=points)
+        labels = np.searchsorted(meta['classes'], y).astype(np.int8)
+
+        for name, arr in (('points', points), ('sq_norms', np.einsum('ij,ij->i', points, points)),
+                          ('labels', labels)):
+            _append_npy(os.path.join(mmap_dir, name + '.npy'), arr, n_rows)
+
+        fresh = data_path is not None and model_store.data_stale_reason(meta, data_path) is None
+        if data_path is not None:
+            _append_csv(data_path, rows)
+        if fresh:
+            # Only refresh a fingerprint that matched, so real staleness still shows
+            meta.update(model_store._data_fingerprint(data_path))
+
+        digest = hashlib.sha256(meta['checksum'].encode())
+        digest.update(points.tobytes())
+        digest.update(labels.tobytes())
+        appended = meta.get('appended') or {
+            'rows': 0, 'out_of_range_rows': 0, 'unsaved_rows': 0, 'data_checksum': None,
+            'low': [0.0] * len(meta['features']), 'high': [1.0] * len(meta['features']),
+        }
+        appended['rows'] += len(rows)
+        if data_path is None:
+            appended['unsaved_rows'] = appended.get('unsaved_rows', 0) + len(rows)
+        else:
+            # A pickle built from exactly this file holds every saved row
+            appended['data_checksum'] = meta['data_checksum'] if fresh else model_store.file_checksum(data_path)
+        appended['out_of_range_rows'] += int(outside.sum())
+        appended['low'] = np.minimum(appended['low'], low).tolist()
+        appended['high'] = np.maximum(appended['high'], high).tolist()
+        meta.update(n_rows=n_rows + len(rows), checksum=digest.hexdigest(), appended=appended,
+                    updated_at=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        write_meta(mmap_dir, meta)
+    return meta
+
+
+def main(argv=None):
+    import pandas as pd
+    import mmap_store
+
+    parser = argparse.ArgumentParser(description="Append labeled rows to the served KNN model.")
+    parser.add_argument('rows', help="CSV with the training data's columns, Outcome included")
+    parser.add_argument('--mmap', default=MMAP_DIR, help="export directory to update")
+    parser.add_argument('--policy', choices=POLICIES, default='keep',
+                        help="values outside the fitted scaler bounds (default: keep)")
+    parser.add_argument('--data', default=None,
+                        help="training CSV to append the rows to (default: the one the model was built from)")
+    parser.add_argument('--no-data', action='store_true', help="only update the model, not the training CSV")
+    args = parser.parse_args(argv)
+
+    current = mmap_store.read_mmap(args.mmap)
+    data_path = None if args.no_data else (args.data or current.get('trained_from') or model_store.DATA_FILE)
+    rows = pd.read_csv(args.rows)
+
+    start = time.perf_counter()
+    try:
+        meta = append_rows(rows, args.mmap, args.policy, data_path)
+    except (ValueError, model_store.ModelArtifactError) as e:
+        print(f"Not updated: {e}")
+        return 1
+    print(f"Appended {len(rows)} rows in {(time.perf_counter() - start) * 1000:.1f} ms; "
+          f"{meta['n_rows']} rows, version {meta['checksum'][:12]}")
+    print(f"  served from {args.mmap} only; MODEL_FORMAT=pickle serves them once the pickle is rebuilt"
+          + (f" from {data_path}" if data_path else ""))
+    if data_path is None:
+        print(f"  --no-data: {meta['appended']['unsaved_rows']} appended rows exist nowhere else; "
+              f"re-exporting from the pickle refuses to drop them unless given --force")
+    drifted = drifted_features(meta)
+    if drifted:
+        print(f"  appended values exceed the fitted range of {', '.join(drifted)} by more than "
+              f"{REBUILD_DRIFT:.0%}; rebuild to refit the scaler")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
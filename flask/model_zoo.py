@@ -0,0 +1,213 @@
+"""
+Latency / memory leaderboard across the candidate model families.
+
+    python model_zoo.py --scales 1 10 --out zoo_report.json
+
+Trains every model in ZOO on diabetes.csv and on enlarged copies of it, then
+measures what serving it costs: single-row latency (p50/p99), batch
+throughput, pickled size, cold and warm load time and resident memory growth
+on load (measured in a fresh interpreter). The JSON report has stable keys
+and ordering so two releases can be diffed directly.
+"""
+
+import argparse
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import model_store
+
+
+def _pipeline(estimator):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import MinMaxScaler
+    return make_pipeline(MinMaxScaler(), estimator)
+
+
+def _svc_linear():
+    from sklearn.svm import SVC
+    return _pipeline(SVC(kernel='linear', random_state=42))
+
+
+def _knn():
+    from sklearn.neighbors import KNeighborsClassifier
+    return _pipeline(KNeighborsClassifier(n_neighbors=model_store.N_NEIGHBORS))
+
+
+def _logreg():
+    from sklearn.linear_model import LogisticRegression
+    return _pipeline(LogisticRegression(max_iter=1000))
+
+
+def _knn_numpy():
+    """The served NumPy engine, fitted through the scikit-learn KNN."""
+    from numpy_engine import NumpyKNN, arrays_from_sklearn
+    from preprocessing import Preprocessor
+
+    class _Fit:
+        def fit(self, X, y):
+            # Rows arrive imputed, so the preprocessor only scales
+            preprocessor = Preprocessor.fit(X, [str(j) for j in range(X.shape[1])], [])
+            knn = _knn()[-1].fit(preprocessor.transform(X), y)
+            return NumpyKNN(preprocessor=preprocessor, classes=knn.classes_,
+                            n_neighbors=knn.n_neighbors, **arrays_from_sklearn(knn))
+    return _Fit()
+
+
+# name -> (feature columns, estimator factory)
+ZOO = {
+    'svc_linear_4f': (model_store.SVC_FEATURES, _svc_linear),
+    'knn_k24_7f': (model_store.FEATURES, _knn),
+    'knn_k24_7f_numpy': (model_store.FEATURES, _knn_numpy),
+    'logreg_7f': (model_store.FEATURES, _logreg),
+}
+
+
+def load_dataset(data_path, scale, seed=0):
+    """
+    The dataset (CSV or synth_data.py columnar directory) imputed as in
+    training, enlarged scale times by resampling rows with a small
+    per-column jitter.
+    """
+    from preprocessing import Preprocessor
+
+    X, y = model_store.read_dataset(data_path)
+    X = Preprocessor.fit(X, model_store.FEATURES, model_store.ZERO_AS_MISSING).impute(X)
+    if scale > 1:
+        rng = np.random.default_rng(seed)
+        idx = rng.integers(0, len(X), size=len(X) * scale)
+        X = X[idx] + rng.normal(0.0, 0.02, (len(idx), X.shape[1])) * X.std(axis=0)
+        y = y[idx]
+    return X, y
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _measure_load(path):
+    """
+    Run in a fresh interpreter. Times a cold load (including importing the
+    library code the model needs) and a warm reload, and the RSS growth.
+    """
+    before = _rss_bytes()
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        pickle.load(f)
+    cold = time.perf_counter() - start
+    rss = _rss_bytes() - before
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        pickle.load(f)
+    warm = time.perf_counter() - start
+    print(json.dumps({'cold_load_ms': cold * 1000.0, 'load_ms': warm * 1000.0, 'rss_bytes': rss}))
+
+
+def measure(name, X, y, latency_rows=500, batch_rows=10000):
+    """Train one zoo model and measure its serving costs."""
+    columns, factory = ZOO[name]
+    idx = [model_store.FEATURES.index(c) for c in columns]
+    X = np.ascontiguousarray(X[:, idx])
+
+    start = time.perf_counter()
+    model = factory().fit(X, y)
+    train_s = time.perf_counter() - start
+
+    rng = np.random.default_rng(1)
+    rows = X[rng.integers(0, len(X), size=latency_rows)]
+    timings = np.empty(len(rows))
+    for i in range(len(rows)):
+        start = time.perf_counter()
+        model.predict(rows[i:i + 1])
+        timings[i] = time.perf_counter() - start
+
+    batch = X[rng.integers(0, len(X), size=batch_rows)]
+    start = time.perf_counter()
+    model.predict(batch)
+    batch_s = time.perf_counter() - start
+
+    with tempfile.NamedTemporaryFile(suffix='.pkl', delete=False) as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        path = f.name
+    try:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure-load', path],
+                             cwd=model_store.BASE_DIR, capture_output=True, text=True, check=True)
+        load = json.loads(out.stdout.strip().splitlines()[-1])
+        size = os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+    return {
+        'model': name,
+        'features': len(columns),
+        'train_rows': int(len(X)),
+        'train_s': round(train_s, 4),
+        'latency_p50_us': round(float(np.median(timings) * 1e6), 1),
+        'latency_p99_us': round(float(np.percentile(timings, 99) * 1e6), 1),
+        'batch_rows_per_s': round(batch_rows / batch_s, 1),
+        'size_bytes': size,
+        'cold_load_ms': round(load['cold_load_ms'], 3),
+        'load_ms': round(load['load_ms'], 3),
+        'rss_bytes': load['rss_bytes'],
+    }
+
+
+def run(data_path, scales, models):
+    import sklearn
+    results = []
+    for scale in scales:
+        X, y = load_dataset(data_path, scale)
+        for name in models:
+            result = measure(name, X, y)
+            result['scale'] = scale
+            results.append(result)
+            print(f"{name:<18}x{scale:<5}{result['latency_p50_us']:>10.0f}{result['latency_p99_us']:>10.0f}"
+                  f"{result['batch_rows_per_s']:>14.0f}{result['size_bytes'] / 1024:>12.1f}"
+                  f"{result['cold_load_ms']:>10.1f}{result['load_ms']:>10.2f}"
+                  f"{result['rss_bytes'] / 2**20:>10.1f}")
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serving cost leaderboard for candidate models.")
+    parser.add_argument('--data', default=model_store.DATA_FILE)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+                        help="dataset size multipliers (the SVC gets slow past ~20)")
+    parser.add_argument('--models', nargs='+', default=list(ZOO), choices=list(ZOO))
+    parser.add_argument('--out', default='zoo_report.json', help="JSON report path")
+    parser.add_argument('--measure-load', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure_load:
+        _measure_load(args.measure_load)
+        return 0
+
+    print(f"{'model':<18}{'scale':<6}{'p50 us':>10}{'p99 us':>10}{'batch rows/s':>14}"
+          f"{'size KB':>12}{'cold ms':>10}{'warm ms':>10}{'rss MB':>10}")
+    report = run(args.data, args.scales, args.models)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+    print(f"Wrote {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""
+Pure-NumPy KNN serving engine.
+
+Runs the fitted model from plain arrays (see mmap_store.py), so web workers
+never import scikit-learn. The shared preprocessor imputes and scales
+queries in one pass ahead of the distance computation, neighbors are found
+by blocked brute-force search, and votes are uniform or distance-weighted
+like KNeighborsClassifier.
+
+Check the engine the app serves, loaded from the memory-mapped export,
+against the scikit-learn model on diabetes.csv with:
+
+    python numpy_engine.py verify
+"""
+
+import sys
+
+import numpy as np
+
+from inference import calibrated_probabilities, calibration_table
+
+# Rows per block when scanning the reference set; bounds temporary memory
+SEARCH_BLOCK = 1 << 18
+# Max query x reference distance cells held at once (8 bytes each)
+SEARCH_CELLS = 1 << 22
+
+
+def arrays_from_sklearn(model):
+    """Export the reference set of a fitted KNeighborsClassifier as plain arrays."""
+    points = np.ascontiguousarray(model._fit_X, dtype=np.float64)
+    return {
+        'points': points,
+        'sq_norms': np.einsum('ij,ij->i', points, points),
+        'labels': np.ascontiguousarray(model._y, dtype=np.int8),
+    }
+
+
+def exact_search(Q, points, sq_norms, k):
+    """
+    Brute-force k nearest points to preprocessed rows Q, scanning points in
+    blocks. Returns (squared distances, indices), each (len(Q), k), unordered.
+    """
+    q_norms = np.einsum('ij,ij->i', Q, Q)[:, None]
+    best_d = np.full((len(Q), 0), np.inf)
+    best_i = np.empty((len(Q), 0), dtype=np.intp)
+
+    for start in range(0, len(points), SEARCH_BLOCK):
+        block = points[start:start + SEARCH_BLOCK]
+        d = q_norms - 2.0 * (Q @ block.T) + sq_norms[start:start + SEARCH_BLOCK][None, :]
+        kk = min(k, d.shape[1])
+        idx = np.argpartition(d, kk - 1, axis=1)[:, :kk]
+        best_d = np.hstack([best_d, np.take_along_axis(d, idx, axis=1)])
+        best_i = np.hstack([best_i, idx + start])
+        if best_d.shape[1] > k:
+            keep = np.argpartition(best_d, k - 1, axis=1)[:, :k]
+            best_d = np.take_along_axis(best_d, keep, axis=1)
+            best_i = np.take_along_axis(best_i, keep, axis=1)
+    return best_d, best_i
+
+
+class NumpyKNN:
+    """
+    KNN classifier over raw inputs.
+
+    points are the preprocessed training rows, labels their class indices
+    into classes; preprocessor is the preprocessing.Preprocessor they were
+    prepared with. With an ann_index.IVFIndex as index, neighbor search is
+    approximate; otherwise it is exact. calibration is an optional vote-count
+    table, as for inference.InferenceEngine.
+    """
+
+    def __init__(self, points, sq_norms, labels, preprocessor, classes, n_neighbors,
+                 weights='uniform', index=None, calibration=None):
+        self.points = points
+        self.sq_norms = sq_norms
+        self.labels = labels
+        self.preprocessor = preprocessor
+        self.classes_ = np.asarray(classes)
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+        self.index = index
+        self.calibration = calibration_table(calibration, self.classes_, n_neighbors,
+                                             weights == 'distance')
+
+    def kneighbors(self, X, n_neighbors=None):
+        """Distances and indices of the nearest points to raw rows X, closest first."""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        if not np.isfinite(X).all():
+            # scikit-learn's input validation rejects these too
+            raise ValueError("Input contains NaN or infinity")
+        k = n_neighbors or self.n_neighbors
+        if self.index is not None:
+            # The index groups the whole batch by list and bounds its own memory
+            return self._kneighbors(X, k)
+        # Score queries in slices so the distance block stays within budget
+        step = max(1, SEARCH_CELLS // min(len(self.points), SEARCH_BLOCK))
+        parts = [self._kneighbors(X[i:i + step], k) for i in range(0, len(X), step)]
+        return np.vstack([p[0] for p in parts]), np.vstack([p[1] for p in parts])
+
+    def _kneighbors(self, X, k):
+        Q = self.preprocessor.transform(X)
+        if self.index is not None:
+            best_d, best_i = self.index.search(Q, self.points, self.sq_norms, k)
+        else:
+            best_d, best_i = exact_search(Q, self.points, self.sq_norms, k)
+
+        order = np.argsort(best_d, axis=1, kind='stable')
+        best_i = np.take_along_axis(best_i, order, axis=1)
+        best_d = np.sqrt(np.maximum(np.take_along_axis(best_d, order, axis=1), 0.0))
+        return best_d, best_i
+
+    def predict(self, X):
+        """
+        Score a 2-D array of raw feature rows.
+
+        Returns the same dict as inference.InferenceEngine.predict():
+        'predictions' and 'probabilities'.
+        """
+        distances, indices = self.kneighbors(X)
+        votes = np.asarray(self.labels)[indices]
+        if self.calibration is not None:
+            probabilities = calibrated_probabilities(self.calibration, votes)
+            return {
+                'predictions': self.classes_[probabilities.argmax(axis=1)],
+                'probabilities': probabilities,
+            }
+
+        if self.weights == 'distance':
+            weights = 1 / np.where(distances == 0, 1.0, distances)
+            # Exact matches take all the weight, as in scikit-learn
+            exact = (distances == 0).any(axis=1)
+            weights[exact] = (distances[exact] == 0).astype(np.float64)
+        else:
+            weights = np.ones_like(distances)
+
+        probabilities = np.zeros((len(votes), len(self.classes_)))
+        for c in range(len(self.classes_)):
+            probabilities[:, c] = (weights * (votes == c)).sum(axis=1)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+        return {
+            'predictions': self.classes_[probabilities.argmax(axis=1)],
+            'probabilities': probabilities,
+        }
+
+    def predict_one(self, input_values):
+        """Score a single row. Returns (prediction, probabilities)."""
+        result = self.predict([input_values])
+        return result['predictions'][0], result['probabilities'][0]
+
+
+def verify(artifact, engine, X):
+    """
+    Compare engine, as loaded for serving, with the sklearn model of the
+    pickled artifact on raw rows X: neighbor distances, and predictions and
+    probabilities against sklearn's neighbors voted through the artifact's
+    calibration table, if any. Returns mismatch counts.
+    """
+    from inference import InferenceEngine
+
+    model, preprocessor = artifact['model'], artifact['preprocessor']
+    expected = InferenceEngine(model, preprocessor, (artifact.get('calibration') or {}).get('table')).predict(X)
+    result = engine.predict(X)
+    distances, _ = engine.kneighbors(X)
+    expected_distances, _ = model.kneighbors(preprocessor.transform(X))
+    return {
+        'rows': len(X),
+        'prediction_mismatches': int((result['predictions'] != expected['predictions']).sum()),
+        'max_probability_error': float(np.abs(result['probabilities'] - expected['probabilities']).max()),
+        'max_distance_error': float(np.abs(distances - expected_distances).max()),
+    }
+
+
+def main(argv=None):
+    import argparse
+    import mmap_store
+    import model_store
+
+    parser = argparse.ArgumentParser(description="Check the NumPy engine against scikit-learn.")
+    parser.add_argument('command', choices=['verify'])
+    parser.add_argument('--data', default=model_store.DATA_FILE)
+    parser.add_argument('--mmap', default=mmap_store.MMAP_DIR, help="memory-mapped export to check")
+    parser.add_argument('--noise-rows', type=int, default=5000,
+                        help="extra perturbed rows to compare beyond the dataset")
+    args = parser.parse_args(argv)
+
+    artifact = model_store.load_model()
+    served = mmap_store.load_mmap(args.mmap)
+    if served['checksum'] != artifact['checksum']:
+        print(f"{args.mmap} does not hold the pickled model (checksum {served['checksum'][:12]}, "
+              f"pickle {artifact['checksum'][:12]}); nothing to compare")
+        return 1
+    X, _ = model_store.read_dataset(args.data)
+    rng = np.random.default_rng(0)
+    noisy = X[rng.integers(0, len(X), args.noise_rows)]
+    noisy = noisy * rng.normal(1.0, 0.1, noisy.shape)
+
+    failed = False
+    for label, rows in [(args.data, X), ("perturbed rows", noisy)]:
+        report = verify(artifact, served['engine'], rows)
+        print(f"{label}: {report}")
+        failed |= (report['prediction_mismatches'] > 0 or report['max_probability_error'] > 1e-9
+                   or report['max_distance_error'] > 1e-6)
+    print("FAIL" if failed else "OK: served NumPy engine matches scikit-learn")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
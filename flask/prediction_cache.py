@@ -0,0 +1,81 @@
+"""
+Bounded LRU cache of prediction results.
+
+Keys are the validated feature vector, optionally rounded to a fixed number
+of decimals so near-identical submissions share an entry. Every lookup names
+the model version (artifact checksum) it expects; when that changes the whole
+cache is dropped, so results from an old model are never served.
+
+Store only model outputs: with rounding, several inputs share an entry, so
+anything derived from the raw values would belong to whichever submission
+filled it.
+"""
+
+import collections
+import threading
+
+
+class PredictionCache:
+    """Thread-safe LRU mapping feature vectors to computed results."""
+
+    def __init__(self, max_size=4096, precision=None):
+        self.max_size = max_size
+        self.precision = precision
+        self.model_version = None
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def make_key(self, values):
+        if self.precision is None:
+            return tuple(float(v) for v in values)
+        return tuple(round(float(v), self.precision) for v in values)
+
+    def _check_version(self, model_version):
+        # Caller holds the lock
+        if model_version != self.model_version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.model_version = model_version
+
+    def get(self, values, model_version):
+        """Return the cached result for values, or None."""
+        key = self.make_key(values)
+        with self._lock:
+            self._check_version(model_version)
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, values, model_version, result):
+        """Store a result, evicting the least recently used entry if full."""
+        key = self.make_key(values)
+        with self._lock:
+            self._check_version(model_version)
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'precision': self.precision,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,129 @@
+"""
+The one preprocessing step shared by training, serving and batch scoring.
+
+Preprocessor is fitted once on the training rows: the mean of the non-zero
+values for every zero-as-missing column, then min-max (or standard) scaling
+bounds on the imputed data. It is saved with the model, and transform()
+applies both steps to any 2-D array in one vectorized pass, so the rows a
+model sees at serving time are prepared exactly as its training rows were.
+Plain NumPy only; no pandas or scikit-learn on the hot path.
+
+StreamingFit computes the same min-max parameters from row chunks, for
+datasets that do not fit in memory (stream_train.py).
+"""
+
+import numpy as np
+
+
+class Preprocessor:
+    """Zero-as-missing imputation followed by an affine scaling."""
+
+    def __init__(self, features, impute_values, scale, offset, means=None):
+        self.features = list(features)
+        # Column name -> value that replaces a zero
+        self.impute_values = {name: float(v) for name, v in impute_values.items()}
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.offset = np.asarray(offset, dtype=np.float64)
+        # Raw column means of the imputed training rows: the typical patient
+        self.means = None if means is None else np.asarray(means, dtype=np.float64)
+        self._impute_mask = np.array([f in self.impute_values for f in self.features])
+        self._fill = np.array([self.impute_values.get(f, 0.0) for f in self.features])
+
+    @classmethod
+    def fit(cls, X, features, zero_as_missing, scaling='minmax'):
+        """Fit on raw rows X (zeros still present). scaling is 'minmax' or 'standard'."""
+        X = np.asarray(X, dtype=np.float64)
+        columns = [features.index(c) for c in zero_as_missing]
+        block = X[:, columns]
+        present = block != 0
+        means = (block * present).sum(axis=0) / np.maximum(present.sum(axis=0), 1)
+
+        imputed = cls(features, dict(zip(zero_as_missing, means)),
+                      np.ones(X.shape[1]), np.zeros(X.shape[1])).impute(X)
+        if scaling == 'minmax':
+            low = imputed.min(axis=0)
+            spread = imputed.max(axis=0) - low
+        elif scaling == 'standard':
+            low = imputed.mean(axis=0)
+            spread = imputed.std(axis=0)
+        else:
+            raise ValueError(f"unknown scaling: {scaling}")
+        # Constant columns are left unscaled, as scikit-learn's scalers do
+        scale = 1.0 / np.where(spread == 0, 1.0, spread)
+        return cls(features, dict(zip(zero_as_missing, means)), scale, -low * scale,
+                   imputed.mean(axis=0))
+
+    def impute(self, X):
+        """Copy of raw rows X with zeros in the impute columns replaced."""
+        X = np.asarray(X, dtype=np.float64)
+        return np.where((X == 0) & self._impute_mask, self._fill, X)
+
+    def transform(self, X):
+        """Impute and scale raw rows X in one pass. Returns a new float64 array."""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        out = np.where((X == 0) & self._impute_mask, self._fill, X)
+        out *= self.scale
+        out += self.offset
+        return out
+
+    def to_dict(self):
+        """JSON-serializable parameters, the inverse of from_dict()."""
+        return {
+            'features': self.features,
+            'impute_values': self.impute_values,
+            'scale': self.scale.tolist(),
+            'offset': self.offset.tolist(),
+            'means': None if self.means is None else self.means.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, params):
+        return cls(params['features'], params['impute_values'], params['scale'], params['offset'],
+                   params.get('means'))
+
+
+class StreamingFit:
+    """
+    Fit a min-max Preprocessor over row chunks, in one pass and constant
+    memory. The result matches Preprocessor.fit() on the concatenated rows
+    up to float rounding in the means.
+    """
+
+    def __init__(self, features, zero_as_missing):
+        self.features = list(features)
+        self.zero_as_missing = list(zero_as_missing)
+        n = len(self.features)
+        self.n_rows = 0
+        # Per column: sum, count, min and max of the non-zero values, and
+        # whether any zero was seen (it becomes the impute value or stays 0)
+        self._sum = np.zeros(n)
+        self._count = np.zeros(n, dtype=np.int64)
+        self._low = np.full(n, np.inf)
+        self._high = np.full(n, -np.inf)
+        self._has_zero = np.zeros(n, dtype=bool)
+
+    def update(self, X):
+        """Add a chunk of raw rows."""
+        X = np.asarray(X, dtype=np.float64)
+        present = X != 0
+        self.n_rows += len(X)
+        self._sum += np.where(present, X, 0.0).sum(axis=0)
+        self._count += present.sum(axis=0)
+        self._has_zero |= ~present.all(axis=0)
+        if present.any():
+            self._low = np.minimum(self._low, np.where(present, X, np.inf).min(axis=0))
+            self._high = np.maximum(self._high, np.where(present, X, -np.inf).max(axis=0))
+
+    def preprocessor(self):
+        """The Preprocessor fitted on every row seen so far."""
+        means = self._sum / np.maximum(self._count, 1)
+        impute = np.array([f in self.zero_as_missing for f in self.features])
+        fill = np.where(impute, means, 0.0)
+        low = np.where(self._has_zero, np.minimum(self._low, fill), self._low)
+        high = np.where(self._has_zero, np.maximum(self._high, fill), self._high)
+        spread = high - low
+        scale = 1.0 / np.where(spread == 0, 1.0, spread)
+        impute_values = {f: means[self.features.index(f)] for f in self.zero_as_missing}
+        # Zeros count as the impute value, or as 0 in the other columns
+        column_means = (self._sum + (self.n_rows - self._count) * fill) / max(self.n_rows, 1)
+        return Preprocessor(self.features, impute_values, scale, -low * scale, column_means)
@@ -0,0 +1,116 @@
+"""
+Risk stratification and abnormal-value flags as threshold tables.
+
+FEATURE_RANGES and RISK_TIERS are the rules. RiskTable compiles them once
+into NumPy arrays for a feature order: flags() compares a whole batch of
+raw rows against the low/high bounds in one pass, and tiers() maps
+predictions and confidences to tier numbers with one searchsorted. Both
+return small integer codes, so the web page, the batch API and score_csv.py
+share the same logic; the text for a code (status, risk level, color,
+details) is looked up only when a result is rendered.
+"""
+
+import numpy as np
+
+# Normal ranges shown next to each input; only 'flag' features are marked
+# abnormal outside them
+FEATURE_RANGES = {
+    'Glucose': {'min': 70, 'max': 100, 'unit': 'mg/dL', 'normal': 'Normal fasting: 70-100', 'flag': True},
+    'BloodPressure': {'min': 90, 'max': 120, 'unit': 'mmHg', 'normal': 'Normal: <120/80', 'flag': True},
+    'SkinThickness': {'min': 10, 'max': 40, 'unit': 'mm', 'normal': 'Typical: 15-35', 'flag': True},
+    'Insulin': {'min': 0, 'max': 30, 'unit': 'mIU/L', 'normal': 'Normal: 0-25', 'flag': True},
+    'BMI': {'min': 18.5, 'max': 24.9, 'unit': 'kg/m²', 'normal': 'Healthy: 18.5-24.9', 'flag': True},
+    'DiabetesPedigreeFunction': {'min': 0, 'max': 1.0, 'unit': '', 'normal': 'Genetic risk factor', 'flag': False},
+    'Age': {'min': 0, 'max': 120, 'unit': 'years', 'normal': 'Age factor', 'flag': False},
+}
+
+# Per predicted class: (minimum confidence, level, color, details), lowest first
+RISK_TIERS = {
+    0: [
+        (0.0, "Low Risk", "green",
+         "Your risk indicators suggest low diabetes risk. Maintain healthy habits."),
+        (0.7, "Low Risk", "green",
+         "Good health indicators. Stay active and eat well."),
+        (0.85, "Very Low Risk", "darkgreen",
+         "Excellent indicators. Continue your healthy lifestyle."),
+    ],
+    1: [
+        (0.0, "Moderate Risk", "yellow",
+         "Some risk factors detected. Monitor your health closely."),
+        (0.6, "Moderate-High Risk", "orange",
+         "Significant risk indicators present. Schedule a medical checkup."),
+        (0.8, "High Risk", "red",
+         "High probability of diabetes. Consult a healthcare provider immediately."),
+    ],
+}
+
+# Feature flag codes
+NORMAL, LOW, HIGH = 0, 1, 2
+
+
+class RiskTable:
+    """FEATURE_RANGES and RISK_TIERS compiled for one feature order."""
+
+    def __init__(self, features, ranges=FEATURE_RANGES, tiers=RISK_TIERS):
+        self.features = list(features)
+        flagged = [ranges.get(f, {}).get('flag', False) for f in self.features]
+        # Unflagged features get infinite bounds, so they are never abnormal
+        self.low = np.array([ranges[f]['min'] if on else -np.inf for f, on in zip(self.features, flagged)])
+        self.high = np.array([ranges[f]['max'] if on else np.inf for f, on in zip(self.features, flagged)])
+        self.units = [ranges.get(f, {}).get('unit', '') for f in self.features]
+        # status_text[code][j]: the status of feature j for a flag code
+        self.status_text = [
+            ["Normal"] * len(self.features),
+            [f"Low (normal: {ranges[f]['min']}-{ranges[f]['max']})" if on else "Normal"
+             for f, on in zip(self.features, flagged)],
+            [f"High (normal: {ranges[f]['min']}-{ranges[f]['max']})" if on else "Normal"
+             for f, on in zip(self.features, flagged)],
+        ]
+
+        # All tiers in one sorted table keyed by 2 * class index + confidence,
+        # so one searchsorted finds the tier of any class (confidence <= 1)
+        self.classes = np.array(sorted(tiers))
+        rows = [t for c in self.classes for t in tiers[c]]
+        self.thresholds = np.array([2 * i + t[0] for i, c in enumerate(self.classes) for t in tiers[c]])
+        self.levels = [t[1] for t in rows]
+        self.colors = [t[2] for t in rows]
+        self.details = [t[3] for t in rows]
+
+    def flags(self, X):
+        """(n, n_features) int8 codes for raw rows X: NORMAL, LOW or HIGH."""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        return ((X < self.low) * LOW + (X > self.high) * HIGH).astype(np.int8)
+
+    def tiers(self, predictions, confidence):
+        """Tier numbers for predicted classes and their confidences."""
+        key = 2 * np.searchsorted(self.classes, predictions) + np.asarray(confidence, dtype=np.float64)
+        return np.atleast_1d(np.searchsorted(self.thresholds, key, side='right') - 1)
+
+    def tier(self, number):
+        """(risk_level, risk_color, risk_details) of a tier number."""
+        return self.levels[number], self.colors[number], self.details[number]
+
+    def feature_analysis(self, values, flags, importance, attribution=None):
+        """
+        Render one row: a dict per feature, most important first. With
+        attribution, each item also gets the signed change in diabetes
+        probability it causes.
+        """
+        values, flags = np.asarray(values, dtype=np.float64).tolist(), np.asarray(flags).tolist()
+        importance = np.asarray(importance, dtype=np.float64).tolist()
+        if attribution is not None:
+            attribution = np.asarray(attribution, dtype=np.float64).tolist()
+        items = []
+        for j in sorted(range(len(self.features)), key=importance.__getitem__, reverse=True):
+            item = {
+                'name': self.features[j],
+                'value': round(values[j], 1),
+                'unit': self.units[j],
+                'importance': importance[j],
+                'is_abnormal': flags[j] != NORMAL,
+                'status': self.status_text[flags[j]][j],
+            }
+            if attribution is not None:
+                item['attribution'] = attribution[j]
+            items.append(item)
+        return items
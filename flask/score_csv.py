@@ -0,0 +1,115 @@
+"""
+Bulk-score a CSV file offline.
+
+    python score_csv.py patients.csv predictions.csv --chunk-size 50000 --workers 8
+
+The input needs the same feature columns as diabetes.csv (extra columns such
+as Outcome are passed through). The file is streamed in fixed-size chunks,
+each chunk is imputed, scaled and scored in a worker process, and results are
+appended to the output in input order. At most a few chunks per worker are in
+flight at once, so memory stays flat no matter how large the input is.
+"""
+
+import argparse
+import collections
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import model_store
+from risk import RiskTable
+
+# Set in each worker process by _init_worker()
+_engine = None
+_risk_table = RiskTable(model_store.FEATURES)
+
+
+def _init_worker(use_mmap):
+    global _engine
+    from inference import engine_for
+
+    if use_mmap:
+        import mmap_store
+        artifact = mmap_store.load_mmap(strict=True)
+    else:
+        artifact = model_store.load_model(strict=True)
+    _engine = engine_for(artifact)
+
+
+def _score_chunk(X):
+    # The engine's preprocessor imputes and scales the chunk
+    scored = _engine.predict(X)
+    tiers = _risk_table.tiers(scored['predictions'], scored['probabilities'].max(axis=1))
+    return scored['predictions'], scored['probabilities'][:, 1], tiers
+
+
+def score_csv(input_path, output_path, chunk_size=50000, workers=None, use_mmap=False):
+    """Score input_path into output_path. Returns the number of rows written."""
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2
+
+    # Build the artifact once up front so workers can load it in strict mode
+    if use_mmap:
+        import mmap_store
+        mmap_store.load_mmap()
+    else:
+        model_store.load_model()
+
+    rows = 0
+    pending = collections.deque()
+    header = True
+
+    def _write_oldest():
+        nonlocal rows, header
+        chunk, future = pending.popleft()
+        predictions, probability, tiers = future.result()
+        chunk['Prediction'] = predictions
+        chunk['Probability'] = np.round(probability, 4)
+        chunk['RiskLevel'] = np.array(_risk_table.levels)[tiers]
+        chunk.to_csv(output_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+        rows += len(chunk)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(use_mmap,)) as pool:
+        for chunk in pd.read_csv(input_path, chunksize=chunk_size):
+            missing = [f for f in model_store.FEATURES if f not in chunk.columns]
+            if missing:
+                raise ValueError(f"Input is missing columns: {', '.join(missing)}")
+            X = chunk[model_store.FEATURES].to_numpy(dtype=np.float64)
+            pending.append((chunk, pool.submit(_score_chunk, X)))
+            if len(pending) >= max_in_flight:
+                _write_oldest()
+        while pending:
+            _write_oldest()
+
+    if header:
+        # Empty input: still produce a file with the expected header
+        columns = model_store.FEATURES + ['Prediction', 'Probability', 'RiskLevel']
+        pd.DataFrame(columns=columns).to_csv(
+            output_path, index=False)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a CSV of patients with the KNN model.")
+    parser.add_argument('input', help="CSV with the diabetes.csv feature columns")
+    parser.add_argument('output', help="CSV to write, input columns plus Prediction, Probability and RiskLevel")
+    parser.add_argument('--chunk-size', type=int, default=50000, help="rows per chunk")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--mmap', action='store_true', help="load the memory-mapped model in workers")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    rows = score_csv(args.input, args.output, args.chunk_size, args.workers, args.mmap)
+    elapsed = time.perf_counter() - start
+    print(f"Scored {rows} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):.0f} rows/sec)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
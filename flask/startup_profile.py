@@ -0,0 +1,128 @@
+"""
+Startup-time budget report for app.py.
+
+    python startup_profile.py --runs 5 --budget-ms 1500
+
+Each run starts a fresh interpreter that imports the app's dependencies one
+subsystem at a time, loads the model, imports app.py and builds the lazily
+created engines, timing every step. The report shows the median per step.
+The command exits non-zero when the total cold start exceeds --budget-ms or
+when a module listed in --forbid (pandas and scikit-learn by default) is
+imported by the serving path, so it can run as a CI gate.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+FORBIDDEN_MODULES = ['pandas', 'sklearn', 'matplotlib', 'seaborn']
+
+
+def _child():
+    """Run inside the fresh interpreter; prints the timings as JSON."""
+    timings = []
+    last = time.perf_counter()
+
+    def mark(step):
+        nonlocal last
+        now = time.perf_counter()
+        timings.append([step, (now - last) * 1000.0])
+        last = now
+
+    import numpy
+    mark("import numpy")
+    import flask
+    import werkzeug.security
+    mark("import flask + werkzeug")
+    import model_store
+    import mmap_store
+    import inference
+    import batching
+    import prediction_cache
+    mark("import serving modules")
+
+    strict = os.environ.get('MODEL_STRICT') == '1'
+    if os.environ.get('MODEL_FORMAT', 'mmap') == 'pickle':
+        model_store.load_model(strict=strict)
+    else:
+        mmap_store.load_mmap(strict=strict, n_probe=int(os.environ.get('ANN_NPROBE', 0)))
+    mark("model load")
+
+    import app
+    mark("import app (routes, warm model load)")
+    startup_total = sum(ms for _, ms in timings)
+
+    for name in ['diet_engine', 'symptoms_engine', 'food_search_engine']:
+        getattr(app, name).get()
+        mark(f"first use: {name}")
+
+    print(json.dumps({
+        'timings': timings,
+        'startup_ms': startup_total,
+        'modules': sorted({m.split('.')[0] for m in sys.modules}),
+    }))
+
+
+def profile(runs=5):
+    """Median timings over several cold starts."""
+    env = dict(os.environ, PYTHONWARNINGS='ignore')
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'],
+                             cwd=here, env=env, capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    steps = [step for step, _ in samples[0]['timings']]
+    return {
+        'runs': runs,
+        'steps': {
+            step: statistics.median(s['timings'][i][1] for s in samples)
+            for i, step in enumerate(steps)
+        },
+        'startup_ms': statistics.median(s['startup_ms'] for s in samples),
+        'modules': samples[0]['modules'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile app.py cold start.")
+    parser.add_argument('--runs', type=int, default=5, help="cold starts to take the median of")
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help="fail if the median startup exceeds this many milliseconds")
+    parser.add_argument('--forbid', nargs='*', default=FORBIDDEN_MODULES,
+                        help="fail if any of these modules get imported")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        _child()
+        return 0
+
+    report = profile(args.runs)
+    leaked = [m for m in args.forbid if m in report['modules']]
+
+    if args.json:
+        print(json.dumps(dict(report, forbidden_imports=leaked), indent=4))
+    else:
+        print(f"{'step':<44}{'ms':>10}")
+        for step, ms in report['steps'].items():
+            print(f"{step:<44}{ms:>10.1f}")
+        print(f"{'startup total (excludes first use)':<44}{report['startup_ms']:>10.1f}")
+        if leaked:
+            print(f"Forbidden modules imported: {', '.join(leaked)}")
+
+    failed = bool(leaked)
+    if args.budget_ms is not None and report['startup_ms'] > args.budget_ms:
+        print(f"FAIL: startup {report['startup_ms']:.1f} ms exceeds budget {args.budget_ms:.1f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
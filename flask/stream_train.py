@@ -0,0 +1,275 @@
+"""
+Out-of-core training straight into the memory-mapped model format.
+
+model_store.build_artifact() holds the whole dataset in memory several times
+(raw rows, scaled rows, scikit-learn's copy, the CV folds), so its peak
+memory grows with the dataset. train_streaming() reads the source in chunks
+instead, in two passes:
+
+1. preprocessing.StreamingFit accumulates the impute means and min/max
+   bounds, the row count and the classes;
+2. every chunk is preprocessed and appended to points.npy, sq_norms.npy and
+   labels.npy, written sequentially rather than through a memory map so
+   the written pages never count against the process.
+
+The result is an mmap_store export directory, served like any other with
+MODEL_FORMAT=mmap. Held-out metrics are leave-one-out scores of a random
+sample of rows against the on-disk reference set, scanned block by block;
+k-fold CV would need the folds in memory. The same leave-one-out vote
+counts fit the calibration table (calibration.py). Peak memory is a few
+chunks plus the sample, whatever the dataset size. There is no pickle, ANN
+index, reduced model or ensemble member.
+
+    python stream_train.py --data big.csv --chunk-size 100000
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+import calibration
+import evaluation
+import model_store
+from mmap_store import MMAP_DIR, MMAP_FORMAT, publish, staging_dir
+from numpy_engine import SEARCH_BLOCK, SEARCH_CELLS, exact_search
+from preprocessing import StreamingFit
+
+DEFAULT_CHUNK_SIZE = 100000
+# Rows scored leave-one-out for the held-out metrics, and the groups they
+# are split into for confidence intervals
+EVAL_ROWS = 2000
+EVAL_GROUPS = 5
+
+
+def scan(data_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """First pass. Returns (preprocessor, n_rows, classes)."""
+    fit = StreamingFit(model_store.FEATURES, model_store.ZERO_AS_MISSING)
+    classes = set()
+    for X, y in model_store.iter_dataset(data_path, chunk_size):
+        fit.update(X)
+        classes.update(np.unique(y).tolist())
+    if not fit.n_rows:
+        raise ValueError(f"{data_path} has no rows")
+    return fit.preprocessor(), fit.n_rows, sorted(int(c) for c in classes)
+
+
+def _open_npy(path, dtype, shape):
+    """A .npy file opened for writing its data sequentially after the header."""
+    f = open(path, 'wb')
+    npy_format.write_array_header_1_0(f, {'descr': npy_format.dtype_to_descr(np.dtype(dtype)),
+                                          'fortran_order': False, 'shape': shape})
+    return f
+
+
+def write_reference(data_path, out_dir, preprocessor, n_rows, classes, sample,
+                    chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Second pass: preprocess every chunk and append it to the reference
+    arrays in out_dir. sample holds sorted row numbers whose preprocessed
+    points and labels are also kept in memory for evaluation.
+
+    Returns (checksum, sample points, sample labels).
+    """
+    n_features = len(preprocessor.features)
+    digest = hashlib.sha256(json.dumps(preprocessor.to_dict(), sort_keys=True).encode())
+    sample_points = np.empty((len(sample), n_features))
+    sample_labels = np.empty(len(sample), dtype=np.int8)
+    files = {
+        'points': _open_npy(os.path.join(out_dir, 'points.npy'), np.float64, (n_rows, n_features)),
+        'sq_norms': _open_npy(os.path.join(out_dir, 'sq_norms.npy'), np.float64, (n_rows,)),
+        'labels': _open_npy(os.path.join(out_dir, 'labels.npy'), np.int8, (n_rows,)),
+    }
+    try:
+        start = 0
+        for X, y in model_store.iter_dataset(data_path, chunk_size):
+            points = preprocessor.transform(X)
+            labels = np.searchsorted(classes, y).astype(np.int8)
+            for name, arr in (('points', points),
+                              ('sq_norms', np.einsum('ij,ij->i', points, points)),
+                              ('labels', labels)):
+                files[name].write(arr.tobytes())
+            digest.update(points.tobytes())
+            digest.update(labels.tobytes())
+
+            lo, hi = np.searchsorted(sample, [start, start + len(X)])
+            sample_points[lo:hi] = points[sample[lo:hi] - start]
+            sample_labels[lo:hi] = labels[sample[lo:hi] - start]
+            start += len(X)
+    finally:
+        for f in files.values():
+            f.close()
+    if start != n_rows:
+        raise ValueError(f"{data_path} changed while training ({n_rows} rows, then {start})")
+    return digest.hexdigest(), sample_points, sample_labels
+
+
+def _read_blocks(out_dir, block_rows=SEARCH_BLOCK):
+    """Yield (start, points, sq_norms, labels) blocks of the reference arrays, read sequentially."""
+    readers = []
+    try:
+        for name in ('points', 'sq_norms', 'labels'):
+            f = open(os.path.join(out_dir, name + '.npy'), 'rb')
+            npy_format.read_magic(f)
+            shape, _, dtype = npy_format.read_array_header_1_0(f)
+            readers.append((f, dtype, shape[1:]))
+        n_rows = shape[0]
+        for start in range(0, n_rows, block_rows):
+            rows = min(block_rows, n_rows - start)
+            yield (start,) + tuple(np.fromfile(f, dtype, rows * int(np.prod(tail))).reshape((rows,) + tail)
+                                   for f, dtype, tail in readers)
+    finally:
+        for f, _, _ in readers:
+            f.close()
+
+
+def _merge(best, found, k):
+    """Keep the k nearest of two (distances, indices, labels) candidate sets, row by row."""
+    merged = [np.hstack(pair) for pair in zip(best, found)]
+    if merged[0].shape[1] > k:
+        keep = np.argpartition(merged[0], k - 1, axis=1)[:, :k]
+        merged = [np.take_along_axis(arr, keep, axis=1) for arr in merged]
+    return merged
+
+
+def leave_one_out(out_dir, sample, sample_points, sample_labels, classes, n_neighbors,
+                  n_groups=EVAL_GROUPS):
+    """
+    Score the sampled rows by their n_neighbors nearest other rows of the
+    reference set in out_dir. Returns (metrics, groups, votes): a metrics
+    dict shaped like evaluation.cross_validate()'s with the groups in place
+    of folds, the groups (index arrays into sample) and each sampled row's
+    count of positive-class votes.
+    """
+    from sklearn.metrics import roc_auc_score
+
+    k = n_neighbors + 1
+    # Placeholder candidates at infinite distance, replaced by the first block
+    best = [np.full((len(sample), k), np.inf), np.full((len(sample), k), -1, dtype=np.intp),
+            np.full((len(sample), k), -1, dtype=np.int8)]
+    step = max(1, SEARCH_CELLS // SEARCH_BLOCK)
+    for start, points, sq_norms, labels in _read_blocks(out_dir):
+        for q in range(0, len(sample), step):
+            rows = slice(q, q + step)
+            d, i = exact_search(sample_points[rows], points, sq_norms, k)
+            merged = _merge([arr[rows] for arr in best], [d, i + start, labels[i]], k)
+            for arr, part in zip(best, merged):
+                arr[rows] = part
+
+    # Drop each row itself; if exact duplicates pushed it out, drop the farthest
+    distances, indices, votes = best
+    is_self = indices == sample[:, None]
+    missing = ~is_self.any(axis=1)
+    is_self[missing, distances[missing].argmax(axis=1)] = True
+    votes = votes[~is_self].reshape(len(sample), -1)
+    proba = np.stack([(votes == c).mean(axis=1) for c in range(len(classes))], axis=1)
+    correct = proba.argmax(axis=1) == sample_labels
+    positive = sample_labels == len(classes) - 1
+
+    groups = np.array_split(np.arange(len(sample)), n_groups)
+    accuracy, accuracy_ci = evaluation.mean_ci([correct[g].mean() for g in groups])
+    fold_auc = [float(roc_auc_score(positive[g], proba[g, -1])) for g in groups]
+    auc, auc_ci = evaluation.mean_ci(fold_auc)
+    metrics = {
+        'accuracy': accuracy,
+        'accuracy_ci': accuracy_ci,
+        'auc': auc,
+        'auc_ci': auc_ci,
+        'oof_auc': float(roc_auc_score(positive, proba[:, -1])),
+        'fold_accuracy': [float(correct[g].mean()) for g in groups],
+        'fold_auc': fold_auc,
+        'validation': 'leave-one-out',
+        'eval_rows': int(len(sample)),
+        'cv_folds': None,
+        'n_samples': None,
+    }
+    return metrics, groups, (votes == len(classes) - 1).sum(axis=1)
+
+
+def train_streaming(data_path, out_dir=MMAP_DIR, chunk_size=DEFAULT_CHUNK_SIZE,
+                    eval_rows=EVAL_ROWS, seed=42, calibration_method=model_store.CALIBRATION):
+    """Train from data_path in chunks and publish the export to out_dir. Returns its meta."""
+    preprocessor, n_rows, classes = scan(data_path, chunk_size)
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(n_rows, min(eval_rows, n_rows), replace=False))
+
+    tmp_dir = staging_dir(out_dir)
+    try:
+        checksum, sample_points, sample_labels = write_reference(
+            data_path, tmp_dir, preprocessor, n_rows, classes, sample, chunk_size)
+        metrics, groups, votes = leave_one_out(tmp_dir, sample, sample_points, sample_labels, classes,
+                                               model_store.N_NEIGHBORS)
+        metrics['n_samples'] = n_rows
+        calibrated = None
+        if calibration_method and len(classes) == 2:
+            # Cross-fitted over the evaluation groups, like folds
+            splits = [(np.setdiff1d(np.arange(len(sample)), g), g) for g in groups]
+            calibrated = calibration.calibrate(votes, sample_labels == 1, model_store.N_NEIGHBORS,
+                                               splits, calibration_method)
+            metrics = calibration.served_metrics(metrics, calibrated)
+            # The table changes what is served, so it is part of the version
+            checksum = hashlib.sha256((checksum + json.dumps(calibrated['table'])).encode()).hexdigest()
+        meta = {
+            'format': MMAP_FORMAT,
+            'features': list(model_store.FEATURES),
+            'classes': classes,
+            'n_neighbors': model_store.N_NEIGHBORS,
+            'weights': 'uniform',
+            'metrics': metrics,
+            'preprocessor': preprocessor.to_dict(),
+            'checksum': checksum,
+            'n_rows': n_rows,
+            'ann_lists': 0,
+            'reduced': None,
+            'members': {},
+            'calibration': calibrated,
+            'trained_from': os.path.abspath(data_path),
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        meta.update(model_store._data_fingerprint(data_path))
+        publish(tmp_dir, out_dir, meta)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return meta
+
+
+def main(argv=None):
+    import resource
+
+    parser = argparse.ArgumentParser(description="Train the KNN model out of core into the mmap format.")
+    parser.add_argument('--data', default=model_store.DATA_FILE, help="training CSV or columnar dataset directory")
+    parser.add_argument('--out', default=MMAP_DIR, help="output directory")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="rows per chunk")
+    parser.add_argument('--eval-rows', type=int, default=EVAL_ROWS,
+                        help="rows scored leave-one-out for the held-out metrics")
+    parser.add_argument('--calibration', default=model_store.CALIBRATION, choices=['isotonic', 'platt', 'none'],
+                        help="calibration of the vote fractions (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    meta = train_streaming(args.data, args.out, args.chunk_size, args.eval_rows,
+                           calibration_method=None if args.calibration == 'none' else args.calibration)
+    metrics = meta['metrics']
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Wrote {args.out} in {time.perf_counter() - start:.2f}s "
+          f"({metrics['n_samples']} rows, peak RSS {peak_mb:.0f} MB)")
+    print(f"  checksum: {meta['checksum']}")
+    print(f"  accuracy: {metrics['accuracy'] * 100:.2f}% "
+          f"(95% CI {metrics['accuracy_ci'][0] * 100:.2f}-{metrics['accuracy_ci'][1] * 100:.2f}%, "
+          f"leave-one-out on {metrics['eval_rows']} rows)")
+    print(f"  AUC:      {metrics['auc']:.3f} "
+          f"(95% CI {metrics['auc_ci'][0]:.3f}-{metrics['auc_ci'][1]:.3f})")
+    if meta['calibration']:
+        print(calibration.describe(meta['calibration']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
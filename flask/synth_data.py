@@ -0,0 +1,192 @@
+"""
+Synthetic, statistically similar versions of diabetes.csv at any size.
+
+    python synth_data.py --rows 10000000 --out synthetic_10m.csv
+    python synth_data.py --rows 10000000 --out synthetic_10m --format columnar
+
+Per class (Outcome) the generator keeps the class prior, every column's
+empirical marginal (with zeros as a separate point mass, since zero means
+"not measured" in most columns) and the rank correlation between columns,
+through a Gaussian copula. Rows are generated in fixed-size chunks, each
+seeded from (seed, chunk index), so memory stays flat and a given seed and
+chunk size always produce the same file.
+
+The columnar format is a directory with meta.json and one .npy file per
+column, readable with read_columnar() or np.load(mmap_mode='r').
+model_store.read_dataset() accepts either output directly.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+COLUMNS = ['Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness', 'Insulin',
+           'BMI', 'DiabetesPedigreeFunction', 'Age', 'Outcome']
+TARGET = 'Outcome'
+# Decimal places to round each generated column to, matching diabetes.csv
+DECIMALS = {'BMI': 1, 'DiabetesPedigreeFunction': 3}
+# Integer columns fit in int16 (Insulin tops out under 1000), which keeps a
+# 100M-row columnar dataset around 3 GB
+INT_DTYPE = np.int16
+# Points kept per marginal; plenty for a smooth inverse CDF
+QUANTILE_POINTS = 1024
+COLUMNAR_FORMAT = 1
+
+
+def fit(dataset):
+    """Fit per-class priors, marginals and copula correlations from a DataFrame."""
+    from scipy import stats
+
+    features = [c for c in COLUMNS if c != TARGET]
+    classes = []
+    for label, group in dataset.groupby(TARGET):
+        X = group[features].to_numpy(dtype=np.float64)
+        marginals = []
+        for j in range(X.shape[1]):
+            column = np.sort(X[:, j])
+            nonzero = column[column != 0]
+            if len(nonzero) > QUANTILE_POINTS:
+                nonzero = np.quantile(nonzero, np.linspace(0, 1, QUANTILE_POINTS))
+            marginals.append({
+                'zero_fraction': float((column == 0).mean()),
+                'values': nonzero.tolist(),
+            })
+        # Normal scores of the ranks give the copula correlation
+        scores = stats.norm.ppf((stats.rankdata(X, axis=0) - 0.5) / len(X))
+        corr = np.corrcoef(scores, rowvar=False)
+        corr = np.nan_to_num(corr) + np.eye(len(features)) * 1e-9
+        classes.append({
+            'label': int(label),
+            'prior': float(len(group) / len(dataset)),
+            'marginals': marginals,
+            'cholesky': np.linalg.cholesky(corr).tolist(),
+        })
+    return {'features': features, 'classes': classes}
+
+
+def _inverse_marginal(u, marginal):
+    values = np.asarray(marginal['values'])
+    p0 = marginal['zero_fraction']
+    out = np.zeros_like(u)
+    if len(values) == 0:
+        return out
+    mask = u >= p0
+    rescaled = (u[mask] - p0) / max(1.0 - p0, 1e-12)
+    grid = (np.arange(len(values)) + 0.5) / len(values)
+    out[mask] = np.interp(rescaled, grid, values)
+    return out
+
+
+def generate_chunk(model, n_rows, seed, chunk_index):
+    """n_rows synthetic rows as a dict of column -> array."""
+    from scipy.special import ndtr
+
+    rng = np.random.default_rng([seed, chunk_index])
+    priors = np.array([c['prior'] for c in model['classes']])
+    which = rng.choice(len(priors), size=n_rows, p=priors / priors.sum())
+    features = model['features']
+    X = np.empty((n_rows, len(features)))
+    labels = np.empty(n_rows, dtype=np.int64)
+
+    for k, cls in enumerate(model['classes']):
+        rows = np.flatnonzero(which == k)
+        if len(rows) == 0:
+            continue
+        z = rng.standard_normal((len(rows), len(features))) @ np.asarray(cls['cholesky']).T
+        u = ndtr(z)
+        for j, marginal in enumerate(cls['marginals']):
+            X[rows, j] = _inverse_marginal(u[:, j], marginal)
+        labels[rows] = cls['label']
+
+    out = {}
+    for j, name in enumerate(features):
+        decimals = DECIMALS.get(name)
+        if decimals is None:
+            out[name] = np.rint(X[:, j]).astype(INT_DTYPE)
+        else:
+            out[name] = np.round(X[:, j], decimals)
+    out[TARGET] = labels.astype(np.int8)
+    return out
+
+
+def generate(model, n_rows, chunk_size=500000, seed=0):
+    """Yield chunks (dicts of column arrays) adding up to n_rows rows."""
+    for index, start in enumerate(range(0, n_rows, chunk_size)):
+        yield generate_chunk(model, min(chunk_size, n_rows - start), seed, index)
+
+
+def write_csv(chunks, path):
+    import pandas as pd
+
+    rows = 0
+    for i, chunk in enumerate(chunks):
+        pd.DataFrame(chunk, columns=COLUMNS).to_csv(path, mode='w' if i == 0 else 'a',
+                                                   header=(i == 0), index=False)
+        rows += len(chunk[TARGET])
+    return rows
+
+
+def write_columnar(chunks, path, n_rows, meta=None):
+    """Write chunks into one preallocated .npy file per column under path/."""
+    os.makedirs(path, exist_ok=True)
+    arrays = {}
+    offset = 0
+    for chunk in chunks:
+        n = len(chunk[TARGET])
+        for name, values in chunk.items():
+            if name not in arrays:
+                arrays[name] = np.lib.format.open_memmap(
+                    os.path.join(path, name + '.npy'), mode='w+', dtype=values.dtype, shape=(n_rows,))
+            arrays[name][offset:offset + n] = values
+        offset += n
+    for array in arrays.values():
+        array.flush()
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(dict(meta or {}, format=COLUMNAR_FORMAT, rows=offset, columns=COLUMNS), f, indent=4)
+    return offset
+
+
+def is_columnar(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'meta.json'))
+
+
+def read_columnar(path, columns=None):
+    """Memory-mapped column arrays of a columnar dataset directory."""
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    return {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+            for name in (columns or meta['columns'])}
+
+
+def main(argv=None):
+    import pandas as pd
+    import model_store
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic diabetes dataset.")
+    parser.add_argument('--source', default=model_store.DATA_FILE, help="CSV to fit")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--chunk-size', type=int, default=500000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', choices=['csv', 'columnar'], default='csv')
+    parser.add_argument('--out', required=True, help="output CSV file or columnar directory")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    model = fit(pd.read_csv(args.source))
+    chunks = generate(model, args.rows, args.chunk_size, args.seed)
+    if args.format == 'csv':
+        rows = write_csv(chunks, args.out)
+    else:
+        meta = {'seed': args.seed, 'chunk_size': args.chunk_size,
+                'source_checksum': model_store.file_checksum(args.source)}
+        rows = write_columnar(chunks, args.out, args.rows, meta)
+    print(f"Wrote {rows} rows to {args.out} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
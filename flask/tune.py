@@ -0,0 +1,263 @@
+"""
+Parallel hyperparameter search for the KNN and SVC models.
+
+    python tune.py --accuracy-floor 0.75 --workers 8
+
+Every candidate is scored on the same cached cross-validation folds
+(evaluation.fold_splits). Imputation and scaling are fitted per fold once
+per scaler choice and cached in cv_cache/, so workers only fit and score
+models. Each finished candidate is appended to the results file straight
+away, tagged with the dataset checksum and fold count; rerunning the
+command skips candidates already in it for the same data and folds, so an
+interrupted search resumes where it stopped.
+
+Once the search is done, each candidate is fitted on the whole dataset and
+its single-row latency is timed one candidate at a time, in the engine
+that would serve it (see serving_engine()), so the figures are not skewed
+by busy workers. The leaderboard reports cross-validated accuracy and AUC
+alongside that latency, and recommends the fastest candidate that meets
+the accuracy floor.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import evaluation
+import model_store
+
+RESULTS_FILE = os.path.join(model_store.BASE_DIR, 'tune_results.jsonl')
+
+SCALERS = ['minmax', 'standard']
+KNN_GRID = {
+    'n_neighbors': [5, 9, 15, 19, 24, 31, 41],
+    'metric': ['euclidean', 'manhattan'],
+    'weights': ['uniform', 'distance'],
+    'scaler': SCALERS,
+}
+SVC_GRID = {
+    'kernel': ['linear', 'rbf'],
+    'C': [0.1, 1.0, 10.0],
+    'scaler': SCALERS,
+}
+
+
+def candidates():
+    """All configs in the search space, as dicts with a 'model' key."""
+    for name, grid in [('knn', KNN_GRID), ('svc', SVC_GRID)]:
+        keys = list(grid)
+        for values in itertools.product(*(grid[k] for k in keys)):
+            yield dict(zip(keys, values), model=name)
+
+
+def config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+
+def _make_model(config):
+    from sklearn.neighbors import KNeighborsClassifier
+    from sklearn.svm import SVC
+
+    if config['model'] == 'knn':
+        return KNeighborsClassifier(n_neighbors=config['n_neighbors'], metric=config['metric'],
+                                    weights=config['weights'])
+    return SVC(kernel=config['kernel'], C=config['C'], random_state=42)
+
+
+def prepare_folds(X, y, n_splits, data_checksum):
+    """Impute and scale every fold once per scaler; returns {scaler: cache path}."""
+    from preprocessing import Preprocessor
+
+    splits = evaluation.fold_splits(y, n_splits, data_checksum=data_checksum)
+    paths = {}
+    for scaler_name in SCALERS:
+        path = os.path.join(evaluation.CACHE_DIR,
+                            f"prescaled-{data_checksum[:16]}-{scaler_name}-k{n_splits}.npz")
+        paths[scaler_name] = path
+        if os.path.exists(path):
+            continue
+        arrays = {}
+        for i, (train, test) in enumerate(splits):
+            preprocessor = Preprocessor.fit(X[train], model_store.FEATURES,
+                                            model_store.ZERO_AS_MISSING, scaling=scaler_name)
+            arrays[f'X_train{i}'] = preprocessor.transform(X[train])
+            arrays[f'X_test{i}'] = preprocessor.transform(X[test])
+            arrays[f'y_train{i}'] = y[train]
+            arrays[f'y_test{i}'] = y[test]
+        os.makedirs(evaluation.CACHE_DIR, exist_ok=True)
+        np.savez(path, **arrays)
+    return paths
+
+
+def evaluate_config(config, folds_path, n_splits):
+    """Cross-validated accuracy and AUC for one config."""
+    from sklearn.metrics import roc_auc_score
+
+    folds = np.load(folds_path)
+    accuracy, auc = [], []
+    for i in range(n_splits):
+        model = _make_model(config).fit(folds[f'X_train{i}'], folds[f'y_train{i}'])
+        X_test, y_test = folds[f'X_test{i}'], folds[f'y_test{i}']
+        accuracy.append(float((model.predict(X_test) == y_test).mean()))
+        if hasattr(model, 'predict_proba'):
+            score = model.predict_proba(X_test)[:, 1]
+        else:
+            score = model.decision_function(X_test)
+        auc.append(float(roc_auc_score(y_test, score)))
+
+    return dict(
+        config=config,
+        accuracy=float(np.mean(accuracy)),
+        accuracy_std=float(np.std(accuracy)),
+        auc=float(np.mean(auc)),
+    )
+
+
+def serving_engine(config, X, y):
+    """
+    Fit config on raw rows X and wrap it the way the app would serve it.
+    Returns (engine name, predict function on raw rows): NumpyKNN for
+    Euclidean KNN, inference.InferenceEngine (scikit-learn) for the metrics
+    NumpyKNN does not implement, ensemble.LinearModel for the linear SVC,
+    and scikit-learn for the RBF SVC, which has no serving engine.
+    """
+    from preprocessing import Preprocessor
+
+    preprocessor = Preprocessor.fit(X, model_store.FEATURES, model_store.ZERO_AS_MISSING,
+                                    scaling=config['scaler'])
+    model = _make_model(config).fit(preprocessor.transform(X), y)
+    if config['model'] == 'knn':
+        if config['metric'] == 'euclidean':
+            from numpy_engine import NumpyKNN, arrays_from_sklearn
+            engine = NumpyKNN(preprocessor=preprocessor, classes=model.classes_, n_neighbors=model.n_neighbors,
+                              weights=model.weights, **arrays_from_sklearn(model))
+            return 'numpy', engine.predict
+        from inference import InferenceEngine
+        return 'sklearn', InferenceEngine(model, preprocessor).predict
+    if config['kernel'] == 'linear':
+        from ensemble import LinearModel
+        engine = LinearModel(model_store.FEATURES, model_store.FEATURES, preprocessor, model.coef_[0],
+                             model.intercept_[0], [1.0, 0.0], model.classes_)
+        return 'linear', engine.predict
+    return 'sklearn', lambda rows: model.predict(preprocessor.transform(rows))
+
+
+def measure_latency(config, X, y, latency_rows=200):
+    """Single-row latency of config's serving engine, one row per call as /predict does."""
+    name, predict = serving_engine(config, X, y)
+    rows = X[:latency_rows]
+    predict(rows[:1])
+    timings = np.empty(len(rows))
+    for j in range(len(rows)):
+        start = time.perf_counter()
+        predict(rows[j:j + 1])
+        timings[j] = time.perf_counter() - start
+    return {
+        'engine': name,
+        'latency_p50_us': float(np.median(timings) * 1e6),
+        'latency_p99_us': float(np.percentile(timings, 99) * 1e6),
+    }
+
+
+def load_results(path, data_checksum, n_splits):
+    """
+    Results checkpointed by earlier runs on the same dataset and folds,
+    keyed by config. A truncated last line (an interrupted write) is skipped.
+    """
+    results = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if result.get('data_checksum') == data_checksum and result.get('cv_folds') == n_splits:
+                    results[config_key(result['config'])] = result
+    return results
+
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def run_search(data_path, results_path, n_splits=5, workers=None):
+    """
+    Evaluate every candidate not already in results_path, then time each
+    one serially. Returns all results.
+    """
+    X, y = model_store.read_dataset(data_path)
+    data_checksum = model_store.dataset_checksum(data_path)
+    folds = prepare_folds(X, y, n_splits, data_checksum)
+
+    results = load_results(results_path, data_checksum, n_splits)
+    todo = [c for c in candidates() if config_key(c) not in results]
+    print(f"{len(results)} candidates checkpointed, {len(todo)} to evaluate")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(results_path, 'a') as out:
+        if out.tell() and not _ends_with_newline(results_path):
+            # Start after a line cut short by an interrupted run
+            out.write('\n')
+        futures = [pool.submit(evaluate_config, c, folds[c['scaler']], n_splits) for c in todo]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = dict(future.result(), data_checksum=data_checksum, cv_folds=n_splits)
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            results[config_key(result['config'])] = result
+            print(f"  [{done}/{len(todo)}] {config_key(result['config'])} "
+                  f"acc={result['accuracy']:.4f}")
+
+    # Latency depends on the machine and its load, so it is measured again on
+    # every run, after the pool has shut down, rather than checkpointed
+    print(f"Timing {len(results)} candidates")
+    for result in results.values():
+        result.update(measure_latency(result['config'], X, y))
+    return list(results.values())
+
+
+def describe(config):
+    return ', '.join(f"{k}={v}" for k, v in config.items() if k != 'model')
+
+
+def print_leaderboard(results, accuracy_floor, top=15):
+    results = sorted(results, key=lambda r: (-r['accuracy'], r['latency_p50_us']))
+    print(f"\n{'model':<6}{'params':<62}{'acc':>8}{'auc':>8}{'engine':>9}{'p50 us':>10}{'p99 us':>10}")
+    for r in results[:top]:
+        print(f"{r['config']['model']:<6}{describe(r['config']):<62}{r['accuracy']:>8.4f}"
+              f"{r['auc']:>8.3f}{r['engine']:>9}{r['latency_p50_us']:>10.0f}{r['latency_p99_us']:>10.0f}")
+
+    eligible = [r for r in results if r['accuracy'] >= accuracy_floor]
+    if not eligible:
+        print(f"\nNo candidate reaches the accuracy floor of {accuracy_floor:.4f}")
+        return None
+    best = min(eligible, key=lambda r: r['latency_p50_us'])
+    print(f"\nFastest with accuracy >= {accuracy_floor:.4f}: {best['config']['model']} "
+          f"({describe(best['config'])}) acc={best['accuracy']:.4f} p50={best['latency_p50_us']:.0f} us")
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hyperparameter search for the KNN and SVC models.")
+    parser.add_argument('--data', default=model_store.DATA_FILE)
+    parser.add_argument('--results', default=RESULTS_FILE, help="JSONL checkpoint file")
+    parser.add_argument('--cv-folds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--accuracy-floor', type=float, default=0.75)
+    parser.add_argument('--top', type=int, default=15, help="leaderboard rows to print")
+    args = parser.parse_args(argv)
+
+    results = run_search(args.data, args.results, args.cv_folds, args.workers)
+    print_leaderboard(results, args.accuracy_floor, args.top)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,446 @@
+"""
+Persistent user accounts in SQLite.
+
+users_credentials.json was read whole at boot and rewritten whole on every
+registration, so both grew with the number of users. UserStore keeps the
+accounts in one SQLite table keyed by email (the primary key is its index):
+login is one indexed SELECT and registration one INSERT, whatever the size
+of the table. The database runs in WAL mode, so readers in other threads
+and processes never wait for a registration, and concurrent registrations
+of the same email are settled by the key constraint rather than by the last
+writer.
+
+With cache_size > 0 each process also keeps an LRU cache of looked-up
+accounts, misses included, kept coherent with the other processes:
+
+- triggers append every changed email to a 'changes' table, whose
+  autoincrement key is the store's generation;
+- after committing, a writer raises a shared generation counter, an 8-byte
+  file next to the database (users.db-generation) mapped into every process;
+- a lookup reads that counter from memory, and only when it moved fetches
+  the changes since its last generation and evicts those emails.
+
+So a cache hit costs a memory read, and an account registered in one
+worker is visible to the next lookup in any other. Edits made outside the
+app (sqlite3 shell) do not move the counter and are picked up within
+RESYNC_SECONDS. The change log keeps the last CHANGE_LOG_KEEP entries; a
+process that fell further behind drops its whole cache.
+
+migrate_json() copies an existing users_credentials.json into the table
+once; the app calls it at startup and later calls return at once. The JSON
+file is left in place as a backup.
+
+    python user_store.py migrate --json users_credentials.json --db users.db
+    python user_store.py stress --workers 4 --users 2000
+"""
+
+import argparse
+import collections
+import fcntl
+import json
+import mmap
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+DB_FILE = 'users.db'
+JSON_FILE = 'users_credentials.json'
+# Change log entries kept for processes catching up
+CHANGE_LOG_KEEP = 100000
+# Each process prunes the change log once its writes have moved the
+# generation this far since its last prune
+PRUNE_INTERVAL = 1000
+# Caches re-read the change log at least this often, for out-of-band edits
+RESYNC_SECONDS = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    password TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS migrations (
+    source TEXT PRIMARY KEY,
+    rows INTEGER NOT NULL,
+    migrated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    generation INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS users_inserted AFTER INSERT ON users
+BEGIN INSERT INTO changes (email) VALUES (new.email); END;
+CREATE TRIGGER IF NOT EXISTS users_updated AFTER UPDATE ON users
+BEGIN INSERT INTO changes (email) VALUES (old.email); INSERT INTO changes (email) VALUES (new.email); END;
+CREATE TRIGGER IF NOT EXISTS users_deleted AFTER DELETE ON users
+BEGIN INSERT INTO changes (email) VALUES (old.email); END;
+"""
+
+
+class GenerationCounter:
+    """
+    A 64-bit counter in a small file, memory-mapped so every process reads it
+    without a syscall. The file is reopened after a fork: flock() locks
+    belong to the open file, so a descriptor inherited from a preloaded
+    parent would be one lock shared by every worker.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < 8:
+                os.ftruncate(self._fd, 8)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, 8)
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # The parent's descriptor and mapping stay open in the parent
+            self._map.close()
+            os.close(self._fd)
+            self._open()
+
+    def value(self):
+        self._check_fork()
+        return int.from_bytes(self._map[:8], 'little')
+
+    def advance(self, generation):
+        """Raise the counter to generation; never lowers it."""
+        self._check_fork()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if generation > self.value():
+                self._map[:8] = generation.to_bytes(8, 'little')
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class UserStore:
+    """Email -> {'name', 'password'} accounts in a SQLite database file."""
+
+    def __init__(self, path=DB_FILE, cache_size=0):
+        self.path = path
+        # sqlite3 connections must stay in the thread (and process) that opened them
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+        self.counter = GenerationCounter(path + '-generation')
+
+        self.cache_size = cache_size
+        # email -> account, or None for an unregistered email
+        self._cache = collections.OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._generation = self._latest_generation()
+        self._seen_counter = self.counter.value()
+        self._synced_at = time.monotonic()
+        self._pruned_at = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.flushes = 0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # With WAL, NORMAL only syncs at checkpoints; a power loss can drop
+            # the last registrations but never corrupts the database
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _latest_generation(self):
+        return self._connect().execute('SELECT COALESCE(MAX(generation), 0) FROM changes').fetchone()[0]
+
+    def _lookup(self, email):
+        row = self._connect().execute(
+            'SELECT name, password FROM users WHERE email = ?', (email,)).fetchone()
+        return None if row is None else {'name': row[0], 'password': row[1]}
+
+    def _sync(self):
+        """Evict emails changed since the last sync. Caller holds the cache lock."""
+        counter = self.counter.value()
+        now = time.monotonic()
+        if counter == self._seen_counter and now - self._synced_at < RESYNC_SECONDS:
+            return
+        self._seen_counter = counter
+        self._synced_at = now
+        changed = self._connect().execute(
+            'SELECT generation, email FROM changes WHERE generation > ? ORDER BY generation',
+            (self._generation,)).fetchall()
+        if not changed:
+            return
+        if changed[0][0] != self._generation + 1:
+            # Entries this process never saw were pruned from the log
+            self._cache.clear()
+            self.flushes += 1
+        else:
+            for _, email in changed:
+                if self._cache.pop(email, False) is not False:
+                    self.invalidations += 1
+        self._generation = changed[-1][0]
+
+    def get(self, email):
+        """The account for email, or None."""
+        if not self.cache_size:
+            return self._lookup(email)
+        with self._cache_lock:
+            self._sync()
+            if email in self._cache:
+                self._cache.move_to_end(email)
+                self.hits += 1
+                return self._cache[email]
+            self.misses += 1
+            generation = self._generation
+        account = self._lookup(email)
+        with self._cache_lock:
+            # A sync in between may have evicted a change this lookup missed
+            if self._generation == generation:
+                self._cache[email] = account
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return account
+
+    def __contains__(self, email):
+        return self.get(email) is not None
+
+    def _publish(self, conn):
+        """Announce committed changes to the other processes and prune the change log."""
+        generation = self._latest_generation()
+        # Concurrent writers share the generations, so test the distance since
+        # this process last pruned rather than landing on a particular one
+        if generation - self._pruned_at >= PRUNE_INTERVAL and generation > CHANGE_LOG_KEEP:
+            with conn:
+                conn.execute('DELETE FROM changes WHERE generation <= ?', (generation - CHANGE_LOG_KEEP,))
+            self._pruned_at = generation
+        self.counter.advance(generation)
+
+    def add(self, email, name, password):
+        """Create an account. Returns False if the email is already registered."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('INSERT INTO users (email, name, password, created_at) VALUES (?, ?, ?, ?)',
+                             (email, name, password, time.strftime('%Y-%m-%dT%H:%M:%S')))
+        except sqlite3.IntegrityError:
+            return False
+        self._publish(conn)
+        return True
+
+    def add_many(self, accounts):
+        """
+        Bulk-create accounts from (email, name, password) tuples in one
+        transaction, skipping registered emails. Returns the number created.
+        """
+        now = time.strftime('%Y-%m-%dT%H:%M:%S')
+        conn = self._connect()
+        with conn:
+            created = conn.executemany(
+                'INSERT OR IGNORE INTO users (email, name, password, created_at) VALUES (?, ?, ?, ?)',
+                ((email, name, password, now) for email, name, password in accounts)).rowcount
+        if created:
+            generation = self._latest_generation()
+            with conn:
+                conn.execute('DELETE FROM changes WHERE generation <= ?', (generation - CHANGE_LOG_KEEP,))
+            self.counter.advance(generation)
+        return created
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def cache_stats(self):
+        with self._cache_lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._cache),
+                'max_size': self.cache_size,
+                'generation': self._generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'flushes': self.flushes,
+            }
+
+    def migrate_json(self, json_path=JSON_FILE):
+        """
+        Import a users_credentials.json once. Returns the number of accounts
+        imported; 0 if the file is missing or was already imported. Emails
+        already in the store keep their current account.
+        """
+        source = os.path.abspath(json_path)
+        if not os.path.exists(source):
+            return 0
+        conn = self._connect()
+        if conn.execute('SELECT 1 FROM migrations WHERE source = ?', (source,)).fetchone():
+            return 0
+        with open(source) as f:
+            accounts = json.load(f)
+        # Re-running is harmless: existing emails are skipped
+        imported = self.add_many((email.strip().lower(), user['name'], user['password'])
+                                 for email, user in accounts.items())
+        with conn:
+            conn.execute('INSERT OR IGNORE INTO migrations (source, rows, migrated_at) VALUES (?, ?, ?)',
+                         (source, imported, time.strftime('%Y-%m-%dT%H:%M:%S')))
+        return imported
+
+
+def _stress_worker(store, worker, emails, contested, inboxes, results):
+    """
+    One worker of stress(): registers its share of emails, announcing each
+    to the other workers, races for the contested emails and looks up
+    random accounts. Every announced email must be found at once. store is
+    inherited from the parent, as workers of a preloaded app inherit it.
+    """
+    import queue
+    import random
+
+    rng = random.Random(worker)
+    password = 'pbkdf2:sha256:1000000$' + 'x' * 80
+    n_workers = len(inboxes)
+    mine = emails[worker::n_workers]
+    expected = len(emails) - len(mine)
+    stats = {'registered': 0, 'checked': 0, 'stale': 0, 'won': []}
+    timings = {'register': [], 'lookup': []}
+
+    # Cache the other workers' emails as unregistered first, so their
+    # registrations have to invalidate these entries
+    for i, email in enumerate(emails):
+        if i % n_workers != worker:
+            store.get(email)
+
+    def check(block=False):
+        while stats['checked'] < expected:
+            try:
+                email = inboxes[worker].get(block=block)
+            except queue.Empty:
+                return
+            stats['checked'] += 1
+            if store.get(email) is None:
+                stats['stale'] += 1
+
+    race = contested[:]
+    rng.shuffle(race)
+    for i, email in enumerate(mine):
+        start = time.perf_counter()
+        stats['registered'] += store.add(email, 'Stress', password)
+        timings['register'].append(time.perf_counter() - start)
+        for j, inbox in enumerate(inboxes):
+            if j != worker:
+                inbox.put(email)
+        if race and i % 5 == 0:
+            email = race.pop()
+            if store.add(email, 'Contested', password):
+                stats['won'].append(email)
+        for email in rng.sample(emails, 5):
+            start = time.perf_counter()
+            store.get(email)
+            timings['lookup'].append(time.perf_counter() - start)
+        check()
+    for email in race:
+        if store.add(email, 'Contested', password):
+            stats['won'].append(email)
+    check(block=True)
+    stats['cache'] = store.cache_stats()
+    results.put((stats, timings))
+
+
+def stress(path, n_workers=4, n_users=2000, n_contested=50, cache_size=10000):
+    """
+    Run n_workers processes against a fresh store at path. Returns a dict
+    of totals; 'stale' (announced accounts not found) must be 0 and every
+    contested email must be won exactly once. The store is opened before
+    the workers are forked, like an app preloaded by gunicorn.
+    """
+    import multiprocessing
+
+    for suffix in ('', '-wal', '-shm', '-generation'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    store = UserStore(path, cache_size)
+    store.get('preload@example.com')
+    context = multiprocessing.get_context('fork')
+
+    emails = [f'user{i}@example.com' for i in range(n_users)]
+    contested = [f'contested{i}@example.com' for i in range(n_contested)]
+    inboxes = [context.Queue() for _ in range(n_workers)]
+    results = context.Queue()
+    workers = [context.Process(target=_stress_worker,
+                               args=(store, w, emails, contested, inboxes, results))
+               for w in range(n_workers)]
+    start = time.perf_counter()
+    for p in workers:
+        p.start()
+    reports = [results.get() for _ in workers]
+    for p in workers:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    won = collections.Counter(email for stats, _ in reports for email in stats['won'])
+    lookups = sorted(t for _, timings in reports for t in timings['lookup'])
+    registrations = sorted(t for _, timings in reports for t in timings['register'])
+    caches = [stats['cache'] for stats, _ in reports]
+    return {
+        'seconds': elapsed,
+        'registered': sum(stats['registered'] for stats, _ in reports),
+        'checked': sum(stats['checked'] for stats, _ in reports),
+        'stale': sum(stats['stale'] for stats, _ in reports),
+        'contested_won_once': sum(won[e] == 1 for e in contested),
+        'contested': n_contested,
+        'lookup_p50_us': lookups[len(lookups) // 2] * 1e6,
+        'register_p50_us': registrations[len(registrations) // 2] * 1e6,
+        'hit_rate': sum(c['hits'] for c in caches) / max(sum(c['hits'] + c['misses'] for c in caches), 1),
+        'invalidations': sum(c['invalidations'] for c in caches),
+        'in_store': len(UserStore(path)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the SQLite user store.")
+    parser.add_argument('command', choices=['migrate', 'count', 'stress'])
+    parser.add_argument('--db', default=DB_FILE, help="SQLite database file (stress: a scratch file, recreated)")
+    parser.add_argument('--json', default=JSON_FILE, help="users_credentials.json to import")
+    parser.add_argument('--workers', type=int, default=4, help="stress: worker processes")
+    parser.add_argument('--users', type=int, default=2000, help="stress: accounts registered")
+    parser.add_argument('--contested', type=int, default=50, help="stress: emails every worker tries to register")
+    parser.add_argument('--cache-size', type=int, default=10000, help="stress: per-process cache size (0: none)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'stress':
+        if args.db == DB_FILE:
+            parser.error("stress recreates --db; point it at a scratch file")
+        r = stress(args.db, args.workers, args.users, args.contested, args.cache_size)
+        print(f"{args.workers} workers registered {r['registered']} of {args.users} accounts "
+              f"in {r['seconds']:.2f}s ({r['in_store']} in the store)")
+        print(f"  cross-worker lookups: {r['checked']}, stale: {r['stale']}")
+        print(f"  contested emails registered exactly once: {r['contested_won_once']} of {r['contested']}")
+        print(f"  lookup p50 {r['lookup_p50_us']:.1f} us (hit rate {r['hit_rate']:.1%}, "
+              f"{r['invalidations']} invalidations), register p50 {r['register_p50_us']:.0f} us")
+        ok = (r['stale'] == 0 and r['contested_won_once'] == r['contested']
+              and r['in_store'] == args.users + args.contested)
+        print("OK" if ok else "FAIL")
+        return 0 if ok else 1
+
+    store = UserStore(args.db)
+    if args.command == 'migrate':
+        imported = store.migrate_json(args.json)
+        print(f"Imported {imported} accounts from {args.json}; {len(store)} accounts in {args.db}")
+    else:
+        print(f"{len(store)} accounts in {args.db}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())